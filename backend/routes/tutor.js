@@ -258,6 +258,17 @@ router.post('/generate-flashcards', async (req, res) => {
   }
 });
 
+// Poll feedback that was still being generated when a quiz was submitted
+router.get('/feedback/:feedbackId', async (req, res) => {
+  try {
+    const response = await axios.get(`${FLASK_URL}/feedback/${encodeURIComponent(req.params.feedbackId)}`);
+    res.json(response.data);
+  } catch (error) {
+    const status = error.response ? error.response.status : 500;
+    res.status(status).json({ error: error.message });
+  }
+});
+
 // Get quiz history
 router.get('/quiz-history/:userId', async (req, res) => {
   try {
@@ -5,6 +5,43 @@ const path = require('path');
 const axios = require('axios');
 const Material = require('../models/Material');
 
+const FLASK_URL = process.env.FLASK_SERVICE_URL || 'http://localhost:5000';
+const INGEST_POLL_INTERVAL_MS = parseInt(process.env.INGEST_POLL_INTERVAL_MS || '2000', 10);
+const INGEST_POLL_TIMEOUT_MS = parseInt(process.env.INGEST_POLL_TIMEOUT_MS || String(30 * 60 * 1000), 10);
+
+// Poll a Flask ingest job and record its outcome on the material
+const trackIngestJob = (jobId, materialId) => {
+  const startedAt = Date.now();
+
+  const poll = async () => {
+    try {
+      const { data: job } = await axios.get(`${FLASK_URL}/ingest-jobs/${jobId}`);
+
+      if (job.status === 'completed' || job.status === 'failed') {
+        const update = job.status === 'completed'
+          ? {
+              processingStatus: 'completed',
+              chunksCount: job.result ? job.result.chunks_processed : job.chunks_stored,
+              processedAt: new Date()
+            }
+          : { processingStatus: 'failed' };
+        await Material.findByIdAndUpdate(materialId, update);
+        return;
+      }
+    } catch (error) {
+      console.error('Ingest job poll error:', error.message);
+    }
+
+    if (Date.now() - startedAt > INGEST_POLL_TIMEOUT_MS) {
+      await Material.findByIdAndUpdate(materialId, { processingStatus: 'failed' });
+      return;
+    }
+    setTimeout(poll, INGEST_POLL_INTERVAL_MS);
+  };
+
+  setTimeout(poll, INGEST_POLL_INTERVAL_MS);
+};
+
 // Configure multer for file upload
 const storage = multer.diskStorage({
   destination: (req, file, cb) => {
@@ -57,27 +94,26 @@ router.post('/', upload.single('file'), async (req, res) => {
 
     await material.save();
     const absolutePath = path.resolve(req.file.path);
-    // Send to Flask service for processing
+    // Queue the document on the Flask service; processing continues in the background
     try {
       const flaskResponse = await axios.post(
-        `${process.env.FLASK_SERVICE_URL || 'http://localhost:5000'}/process-document`,
+        `${FLASK_URL}/process-document`,
         {
           file_path: absolutePath,
           user_id: userId,
-          material_id: material._id.toString()
+          material_id: material._id.toString(),
+          async: true
         }
       );
 
       if (flaskResponse.data.success) {
-        material.processingStatus = 'completed';
-        material.chunksCount = flaskResponse.data.chunks_processed;
-        material.processedAt = new Date();
-        await material.save();
+        trackIngestJob(flaskResponse.data.job_id, material._id);
 
         res.json({
           success: true,
           material: material,
-          message: 'Material uploaded and processed successfully'
+          jobId: flaskResponse.data.job_id,
+          message: 'Material uploaded, processing in background'
         });
       } else {
         material.processingStatus = 'failed';
@@ -1,46 +1,204 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from services.document_processor import DocumentProcessor
-from services.qa_service import QAService
-from services.quiz_generator import QuizGenerator
-from services.socratic_tutor import SocraticTutor
+from services.container import ServiceContainer
+from services.ingest_jobs import QueueFullError
+from services.telemetry import (
+    REGISTRY, activate_trace, configure_logging, current_trace, finish_request, finish_stream,
+    request_trace_id, start_trace
+)
+import json
+import logging
+import multiprocessing
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Request-ID', 'Server-Timing'])
+
+# Services and their clients are built lazily, once per worker process
+container = ServiceContainer()
+
+# Probes and scrapes are timed but not logged
+QUIET_ENDPOINTS = {'/health', '/ready', '/metrics'}
+
+def start_ingest_workers():
+    """Start the ingest workers in this serving process, so earlier jobs resume without a new upload"""
+    try:
+        container.ingest_queue
+    except Exception:
+        # Uploads report the error; the rest of the service keeps serving
+        logger.exception("Could not start the ingest workers")
+
+# Imported by a WSGI server or asgi.py: start now, and again in each pre-forked worker.
+# Worker processes of the PDF extraction pool import this module too and must not.
+if __name__ != '__main__' and multiprocessing.parent_process() is None:
+    start_ingest_workers()
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=start_ingest_workers)
+
+@app.before_request
+def begin_trace():
+    """Trace every request under the caller's X-Request-ID (or a new id)"""
+    g.trace = start_trace(request_trace_id(request.headers.get('X-Request-ID')))
+
+@app.after_request
+def end_trace(response):
+    """Record request latency and return the trace id and stage timings as headers"""
+    trace = g.get('trace')
+    if trace is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.headers.update(finish_request(
+            trace, request.method, endpoint, response.status_code, log=endpoint not in QUIET_ENDPOINTS
+        ))
+    return response
+
+def cache_metrics():
+    """Cache counters for /metrics, read from the caches this process has built"""
+    hits = []
+    misses = []
+    embedding_cache = container.built('embedding_cache')
+    if embedding_cache:
+        stats = embedding_cache.stats()
+        hits.append(({'cache': 'embedding'}, stats['memory_hits'] + stats['disk_hits']))
+        misses.append(({'cache': 'embedding'}, stats['misses']))
+    vector_cache = container.built('vector_cache')
+    if vector_cache:
+        stats = vector_cache.stats()
+        hits.append(({'cache': 'vector'}, stats['hits']))
+        misses.append(({'cache': 'vector'}, stats['misses']))
+    answer_cache = container.built('answer_cache')
+    if answer_cache:
+        stats = answer_cache.stats()
+        hits.append(({'cache': 'answer'}, stats['exact_hits'] + stats['semantic_hits']))
+        misses.append(({'cache': 'answer'}, stats['misses']))
+    feedback_cache = container.built('feedback_cache')
+    if feedback_cache:
+        stats = feedback_cache.stats()
+        hits.append(({'cache': 'feedback'}, stats['hits']))
+        misses.append(({'cache': 'feedback'}, stats['misses']))
+    families = [
+        ('mentivio_cache_hits_total', 'counter', 'Cache lookups answered from the cache', hits),
+        ('mentivio_cache_misses_total', 'counter', 'Cache lookups that missed', misses)
+    ]
+    context_builder = container.built('context_builder')
+    if context_builder:
+        families.append((
+            'mentivio_context_tokens_saved_total', 'counter',
+            'Prompt tokens saved by overlap removal and the context budget',
+            [({}, context_builder.stats()['tokens_saved'])]
+        ))
+    return families
 
-# Initialize services
-doc_processor = DocumentProcessor()
-qa_service = QAService()
-quiz_generator = QuizGenerator()
-socratic_tutor = SocraticTutor()
+REGISTRY.register_collector(cache_metrics)
+
+def llm_metrics():
+    """In-flight calls and limiter waits of the Azure clients this process has built"""
+    in_flight = []
+    waited = []
+    for client in ('chat', 'embedding'):
+        limiter = container.built(f'{client}_limiter')
+        if limiter:
+            stats = limiter.stats()
+            in_flight.append(({'client': client}, stats['in_flight']))
+            waited.append(({'client': client}, stats['wait_seconds_total']))
+    return [
+        ('mentivio_llm_in_flight', 'gauge', 'Azure calls currently holding a concurrency slot', in_flight),
+        ('mentivio_llm_limiter_wait_seconds_total', 'counter', 'Time spent waiting for a slot or token budget', waited)
+    ]
+
+REGISTRY.register_collector(llm_metrics)
+
+def sse_response(events):
+    """Stream service events ({'event': name, ...data}) as Server-Sent Events
+
+    When the client disconnects the WSGI server closes this generator, which
+    closes the service generator and with it the upstream LLM stream.
+    """
+    trace = current_trace()
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    def generate():
+        # Stages that run while streaming belong to the request's trace
+        if trace is not None:
+            activate_trace(trace)
+        try:
+            for event in events:
+                name = event.pop('event')
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            # Close the upstream LLM stream now, not at garbage collection; partial answers are not saved
+            if hasattr(events, 'close'):
+                events.close()
+            if trace is not None:
+                finish_stream(trace, endpoint)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy"}), 200
+    """Liveness: the process is up"""
+    return jsonify(container.liveness()), 200
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: MongoDB is reachable and Azure settings are present"""
+    status, is_ready = container.readiness()
+    return jsonify(status), 200 if is_ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of this worker process"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters and sizes of the retrieval caches"""
+    return jsonify({
+        "embedding_cache": container.doc_processor.embedding_cache.stats(),
+        "vector_cache": container.doc_processor.vector_cache.stats(),
+        "answer_cache": container.answer_cache.stats(),
+        "feedback_cache": container.feedback_cache.stats(),
+        "context": container.context_builder.stats(),
+        "llm_limits": {
+            "chat": container.chat_limiter.stats(),
+            "embedding": container.embedding_limiter.stats()
+        }
+    }), 200
+
+def resolve_document_path(file_path):
+    """Resolve a file path from the Node backend to an absolute path"""
+    # Normalize path (handles both \\ and /)
+    file_path = os.path.normpath(file_path)
+
+    # Optional: restrict access to uploads directory
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    return os.path.join(base_dir, file_path) if not os.path.isabs(file_path) else file_path
+
 
 @app.route('/process-document', methods=['POST'])
 def process_document():
+    """Process a document; with "async": true the work is queued as an ingest job"""
     try:
         data = request.get_json(force=True)
         file_path = data.get('file_path')
         user_id = data.get('user_id')
         material_id = data.get('material_id')
 
-        print("Received data:", data)
+        logger.info("Processing document %s for user %s, material %s", file_path, user_id, material_id)
 
         if not file_path:
             return jsonify({"success": False, "error": "Missing file_path"}), 400
 
-        # Normalize path (handles both \\ and /)
-        file_path = os.path.normpath(file_path)
-
-        # Optional: restrict access to uploads directory
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-        full_path = os.path.join(base_dir, file_path) if not os.path.isabs(file_path) else file_path
+        full_path = resolve_document_path(file_path)
 
         if not os.path.exists(full_path):
             return jsonify({
@@ -48,15 +206,65 @@ def process_document():
                 "error": f"File not found at {full_path}"
             }), 400
 
-        result = doc_processor.process_document(full_path, user_id, material_id)
-        print("Processing Done...", result)
+        if data.get('async'):
+            return enqueue_ingest_job(full_path, user_id, material_id)
+
+        result = container.process_document(full_path, user_id, material_id)
+        logger.info("Processed document %s: %s", file_path, result.get('message') or result.get('error'))
         return jsonify(result), 200
 
     except Exception as e:
-        print("Error in /process-document:", str(e))
+        logger.exception("Error in /process-document")
         return jsonify({"error": str(e)}), 500
 
 
+def enqueue_ingest_job(full_path, user_id, material_id):
+    try:
+        job = container.ingest_queue.submit(full_path, user_id, material_id)
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": str(e)}), 429
+    return jsonify({"success": True, "job_id": job['job_id'], "status": job['status']}), 202
+
+
+@app.route('/ingest-jobs', methods=['POST'])
+def create_ingest_job():
+    """Queue a document for background processing and return its job id"""
+    try:
+        data = request.get_json(force=True)
+        file_path = data.get('file_path')
+
+        if not file_path:
+            return jsonify({"success": False, "error": "Missing file_path"}), 400
+
+        full_path = resolve_document_path(file_path)
+
+        if not os.path.exists(full_path):
+            return jsonify({
+                "success": False,
+                "error": f"File not found at {full_path}"
+            }), 400
+
+        return enqueue_ingest_job(full_path, data.get('user_id'), data.get('material_id'))
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/ingest-jobs/<job_id>', methods=['GET'])
+def get_ingest_job(job_id):
+    """Progress (pages parsed, chunks embedded/stored) and final status of an ingest job"""
+    job = container.ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/ingest-jobs', methods=['GET'])
+def ingest_queue_stats():
+    """Queue depth and worker concurrency"""
+    return jsonify(container.ingest_queue.stats()), 200
+
+
 @app.route('/ask-question', methods=['POST'])
 def ask_question():
     """Contextual Q&A from user's materials with conversation memory"""
@@ -70,7 +278,7 @@ def ask_question():
         if not question or not user_id:
             return jsonify({"error": "Missing required fields"}), 400
         
-        result = qa_service.answer_question(
+        result = container.qa_service.answer_question(
             question, 
             user_id, 
             material_id, 
@@ -83,6 +291,24 @@ def ask_question():
         return jsonify({"error": str(e)}), 500
     
 
+@app.route('/ask-question/stream', methods=['POST'])
+def ask_question_stream():
+    """Streaming variant of /ask-question: sources first, then answer tokens (SSE)"""
+    data = request.get_json(silent=True) or {}
+    question = data.get('question')
+    user_id = data.get('user_id')
+    
+    if not question or not user_id:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    return sse_response(container.qa_service.stream_answer(
+        question,
+        user_id,
+        data.get('material_id'),
+        data.get('use_all_materials', False)
+    ))
+
+
 @app.route('/clear-conversation', methods=['POST'])
 def clear_conversation():
     """Clear conversation history for a user"""
@@ -93,7 +319,7 @@ def clear_conversation():
         if not user_id:
             return jsonify({"error": "Missing user_id"}), 400
         
-        qa_service.clear_conversation(user_id)
+        container.qa_service.clear_conversation(user_id)
         
         return jsonify({
             "message": "Conversation history cleared successfully"
@@ -113,7 +339,10 @@ def socratic_question():
         material_id = data.get('material_id')
         use_all_materials = data.get('use_all_materials', False)
         
-        response = socratic_tutor.generate_questions(
+        if not question or not user_id:
+            return jsonify({"error": "Missing required fields"}), 400
+        
+        response = container.socratic_tutor.generate_questions(
             question,
             user_id,
             material_id,
@@ -123,6 +352,23 @@ def socratic_question():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/socratic-question/stream', methods=['POST'])
+def socratic_question_stream():
+    """Streaming variant of /socratic-question (SSE)"""
+    data = request.get_json(silent=True) or {}
+    question = data.get('question')
+    user_id = data.get('user_id')
+    
+    if not question or not user_id:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    return sse_response(container.socratic_tutor.stream_questions(
+        question,
+        user_id,
+        data.get('material_id'),
+        data.get('use_all_materials', False)
+    ))
+
 @app.route('/generate-quiz', methods=['POST'])
 def generate_quiz():
     """Generate quiz from materials"""
@@ -135,18 +381,33 @@ def generate_quiz():
         difficulty = data.get('difficulty', 'medium')
         use_all_materials = data.get('use_all_materials', False)
         
-        quiz = quiz_generator.generate_quiz(
+        quiz = container.quiz_generator.generate_quiz(
             topic,
             user_id,
             material_id,
             num_questions,
             difficulty,
-            use_all_materials
+            use_all_materials,
+            from_pool=data.get('from_pool', True)
         )
         return jsonify({"quiz": quiz}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/generate-quiz/stream', methods=['POST'])
+def generate_quiz_stream():
+    """Streaming variant of /generate-quiz: each question is sent as soon as it is generated (SSE)"""
+    data = request.json
+    return sse_response(container.quiz_generator.stream_quiz(
+        data.get('topic'),
+        data.get('user_id'),
+        data.get('material_id'),
+        data.get('num_questions', 5),
+        data.get('difficulty', 'medium'),
+        data.get('use_all_materials', False),
+        from_pool=data.get('from_pool', True)
+    ))
+
 @app.route('/generate-flashcards', methods=['POST'])
 def generate_flashcards():
     try:
@@ -157,12 +418,13 @@ def generate_flashcards():
         num_cards = data.get('num_cards', 10)
         use_all_materials = data.get('use_all_materials', False)
         
-        flashcards = quiz_generator.generate_flashcards(
+        flashcards = container.quiz_generator.generate_flashcards(
             topic,
             user_id,
             material_id,
             num_cards,
-            use_all_materials
+            use_all_materials,
+            from_pool=data.get('from_pool', True)
         )
         return jsonify({"flashcards": flashcards}), 200
     except Exception as e:
@@ -178,10 +440,38 @@ def evaluate_answers():
         correct_answers = data.get('correct_answers')
         topic = data.get('topic')
         
-        feedback = quiz_generator.evaluate_answers(answers, correct_answers, topic)
+        feedback = container.quiz_generator.evaluate_answers(
+            answers, correct_answers, topic, feedback_mode=data.get('feedback_mode')
+        )
         return jsonify({"feedback": feedback}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/evaluate-answers/batch', methods=['POST'])
+def evaluate_answers_batch():
+    """Grade many submissions ([{answers, correct_answers, topic}]) in one request"""
+    try:
+        data = request.json
+        submissions = data.get('submissions')
+        
+        if not isinstance(submissions, list):
+            return jsonify({"error": "Missing submissions"}), 400
+        
+        results = container.quiz_generator.evaluate_batch(submissions, data.get('feedback_mode'))
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/feedback/<feedback_id>', methods=['GET'])
+def get_feedback(feedback_id):
+    """Feedback from an evaluation run with feedback_mode "async" (status pending or ready)"""
+    feedback = container.quiz_generator.get_feedback(feedback_id)
+    if feedback is None:
+        return jsonify({"error": "Feedback not found"}), 404
+    return jsonify(feedback), 200
+
 if __name__ == '__main__':
+    # Only the reloader's serving child runs jobs, not the process watching for changes
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_ingest_workers()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
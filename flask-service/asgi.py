@@ -0,0 +1,172 @@
+"""ASGI entry point: asyncio-native tutoring endpoints, everything else via the Flask app
+
+The Q&A and Socratic endpoints await Azure (ainvoke / astream / aembed_query)
+and MongoDB (AsyncMongoClient) instead of blocking a worker thread, so one
+process holds hundreds of in-flight tutoring requests. Remaining routes
+(ingest, quizzes, health) are served by the WSGI app in app.py through a
+thread-pool adapter, sharing the same ServiceContainer.
+
+Usage:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    hypercorn asgi:application --bind 0.0.0.0:5000
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+from app import app as flask_app, container
+from services.telemetry import activate_trace, current_trace, finish_request, finish_stream, request_trace_id, start_trace
+
+logger = logging.getLogger(__name__)
+
+async_app = cors(Quart(__name__), expose_headers=['X-Request-ID', 'Server-Timing'])
+
+# Paths answered natively by async_app; any other request goes to Flask
+ASYNC_PATHS = {'/ask-question', '/ask-question/stream', '/socratic-question', '/socratic-question/stream'}
+
+@async_app.before_serving
+async def build_services():
+    """Build the tutoring services before the first request, off the event loop
+
+    DocumentProcessor construction creates MongoDB indexes and may preload
+    IVF indexes from disk; both block.
+    """
+    try:
+        await asyncio.to_thread(lambda: (container.qa_service, container.socratic_tutor))
+    except Exception:
+        # The services are built lazily on first use instead
+        logger.exception("Could not build services at startup")
+
+@async_app.before_request
+async def begin_trace():
+    """Same tracing as the Flask app: X-Request-ID (or a new id) for every request"""
+    g.trace = start_trace(request_trace_id(request.headers.get('X-Request-ID')))
+
+@async_app.after_request
+async def end_trace(response):
+    trace = g.get('trace')
+    if trace is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.headers.update(finish_request(trace, request.method, endpoint, response.status_code))
+    return response
+
+def sse_response(events):
+    """Async counterpart of app.sse_response
+
+    When the client disconnects the server cancels this generator, which
+    closes the service generator and with it the upstream LLM stream.
+    """
+    trace = current_trace()
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    async def generate():
+        if trace is not None:
+            activate_trace(trace)
+        try:
+            async for event in events:
+                name = event.pop('event')
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n".encode('utf-8')
+        finally:
+            if hasattr(events, 'aclose'):
+                await events.aclose()
+            if trace is not None:
+                finish_stream(trace, endpoint)
+
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.timeout = None
+    return response
+
+@async_app.route('/ask-question', methods=['POST'])
+async def ask_question():
+    """Contextual Q&A from user's materials with conversation memory"""
+    try:
+        data = await request.get_json(force=True)
+        question = data.get('question')
+        user_id = data.get('user_id')
+
+        if not question or not user_id:
+            return jsonify({"error": "Missing required fields"}), 400
+
+        result = await container.qa_service.aanswer_question(
+            question,
+            user_id,
+            data.get('material_id'),
+            data.get('use_all_materials', False)
+        )
+
+        return jsonify(result), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@async_app.route('/ask-question/stream', methods=['POST'])
+async def ask_question_stream():
+    """Streaming variant of /ask-question: sources first, then answer tokens (SSE)"""
+    data = await request.get_json(force=True, silent=True) or {}
+    question = data.get('question')
+    user_id = data.get('user_id')
+
+    if not question or not user_id:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    return sse_response(container.qa_service.astream_answer(
+        question,
+        user_id,
+        data.get('material_id'),
+        data.get('use_all_materials', False)
+    ))
+
+@async_app.route('/socratic-question', methods=['POST'])
+async def socratic_question():
+    """Socratic questioning mode"""
+    try:
+        data = await request.get_json(force=True)
+        question = data.get('question')
+        user_id = data.get('user_id')
+
+        if not question or not user_id:
+            return jsonify({"error": "Missing required fields"}), 400
+
+        response = await container.socratic_tutor.agenerate_questions(
+            question,
+            user_id,
+            data.get('material_id'),
+            data.get('use_all_materials', False)
+        )
+        return jsonify({"questions": response}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@async_app.route('/socratic-question/stream', methods=['POST'])
+async def socratic_question_stream():
+    """Streaming variant of /socratic-question (SSE)"""
+    data = await request.get_json(force=True, silent=True) or {}
+    question = data.get('question')
+    user_id = data.get('user_id')
+
+    if not question or not user_id:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    return sse_response(container.socratic_tutor.astream_questions(
+        question,
+        user_id,
+        data.get('material_id'),
+        data.get('use_all_materials', False)
+    ))
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+async def application(scope, receive, send):
+    """Route tutoring requests to the async app and the rest to Flask"""
+    if scope['type'] == 'http' and scope['path'] not in ASYNC_PATHS:
+        await wsgi_app(scope, receive, send)
+    else:
+        await async_app(scope, receive, send)
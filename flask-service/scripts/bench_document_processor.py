@@ -0,0 +1,326 @@
+"""Offline benchmark of DocumentProcessor ingest and retrieval against local stand-ins
+
+Embeddings and chat completions come from deterministic fakes with
+configurable latency (scripts/bench_fakes.py) and MongoDB is replaced by an
+in-memory collection unless --mongo-uri points at a local server. Each size
+gets a synthetic topic-clustered corpus; the scenarios are:
+
+    ingest    process_document throughput on a generated text file
+    retrieve  get_relevant_chunks cold and p50/p95/p99 latency per retrieval mode
+    answer    QAService.answer_question latency with the fake chat model
+
+The in-memory store keeps documents as Python objects, so the default
+'array' storage format costs far more RAM than MongoDB would; use a packed
+EMBEDDING_STORAGE_FORMAT for corpora of a million chunks.
+
+Results (with the settings and environment that produced them) are printed
+and, with --output, written as JSON so runs can be compared across changes.
+
+Usage:
+    python scripts/bench_document_processor.py --sizes 1000 10000 100000 --output bench.json
+    EMBEDDING_STORAGE_FORMAT=float32 python scripts/bench_document_processor.py \
+        --scenarios retrieve --sizes 1000000 --dim 256 --vector-cache-mb 2048
+    python scripts/bench_document_processor.py --scenarios ingest --embed-latency-ms 150 --sizes 5000
+    python scripts/bench_document_processor.py --mongo-uri mongodb://localhost:27017/ --sizes 10000
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_fakes import FakeChatModel, FakeEmbeddings, MemoryDatabase, SyntheticCorpus
+from services.embedding_cache import EmbeddingCache
+from services.embedding_codec import encode_embedding
+from services.lexical_index import term_frequencies
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+USER_ID = 'bench-user'
+BENCH_COLLECTIONS = ('embeddings', 'chunk_embeddings', 'processed_files')
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux only, None elsewhere)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+
+
+def latency_summary(samples):
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self._client = None
+
+    def open_database(self):
+        """Fresh, empty database for one run"""
+        if not self.args.mongo_uri:
+            return MemoryDatabase()
+        from pymongo import MongoClient
+
+        if self._client is None:
+            self._client = MongoClient(self.args.mongo_uri)
+        db = self._client[self.args.database]
+        for name in BENCH_COLLECTIONS:
+            db[name].drop()
+        return db
+
+    def make_processor(self, db, embeddings):
+        from services.document_processor import DocumentProcessor
+        from services.vector_cache import VectorCache
+
+        vector_cache = None
+        if self.args.vector_cache_mb:
+            vector_cache = VectorCache(max_bytes=self.args.vector_cache_mb * 2 ** 20)
+        # No disk tier, so repeated runs do not share query embeddings
+        return DocumentProcessor(
+            vector_cache=vector_cache,
+            embedding_cache=EmbeddingCache(disk_path=''),
+            embeddings=embeddings,
+            db=db
+        )
+
+    def make_embeddings(self):
+        return FakeEmbeddings(
+            dim=self.args.dim,
+            latency=self.args.embed_latency_ms / 1000,
+            per_text_latency=self.args.embed_per_text_ms / 1000
+        )
+
+    def ingest(self, size):
+        corpus = SyntheticCorpus(chunk_words=self.args.chunk_words, seed=size)
+        _, tokens = corpus.chunk_tokens(size)
+        embeddings = self.make_embeddings()
+        processor = self.make_processor(self.open_database(), embeddings)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # One paragraph per chunk: each is shorter than chunk_size, so the splitter keeps them apart
+            path = os.path.join(directory, f'synthetic-{size}.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                for row in tokens:
+                    f.write(corpus.text(row))
+                    f.write('\n\n')
+            file_mb = round(os.path.getsize(path) / 2 ** 20, 2)
+
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            result = processor.process_document(path, USER_ID, 'ingest-material')
+            elapsed = time.perf_counter() - started
+
+        if not result.get('success'):
+            raise RuntimeError(f"Ingest failed: {result.get('error')}")
+        return {
+            'chunks': result['chunks_processed'],
+            'file_mb': file_mb,
+            'elapsed_seconds': round(elapsed, 3),
+            'chunks_per_second': round(result['chunks_processed'] / elapsed, 2) if elapsed > 0 else 0.0,
+            'embedding_calls': embeddings.calls,
+            'chunks_embedded': result['chunks_embedded'],
+            'chunks_reused': result['chunks_reused'],
+            'rss_before_mb': rss_before,
+            'rss_after_mb': rss_mb(),
+            'peak_rss_mb': peak_rss_mb()
+        }
+
+    def seed(self, size, embeddings, storage_format):
+        """Load size chunks straight into the embeddings collection; returns (db, corpus, seconds)"""
+        db = self.open_database()
+        corpus = SyntheticCorpus(chunk_words=self.args.chunk_words, seed=size)
+        started = time.perf_counter()
+        for start in range(0, size, self.args.seed_batch_size):
+            count = min(self.args.seed_batch_size, size - start)
+            topics, tokens = corpus.chunk_tokens(count)
+            vectors = corpus.vectors(embeddings, tokens)
+            docs = []
+            for offset in range(count):
+                index = start + offset
+                text = corpus.text(tokens[offset])
+                docs.append({
+                    'user_id': USER_ID,
+                    'material_id': f'material-{index % self.args.materials}',
+                    'chunk_index': index // self.args.materials,
+                    'content': text,
+                    'content_hash': None,
+                    'metadata': {'source': 'synthetic', 'topic': int(topics[offset])},
+                    'lexical_terms': term_frequencies(text),
+                    **encode_embedding(vectors[offset], storage_format)
+                })
+            collection = db['embeddings']
+            if hasattr(collection, 'insert_prepared'):
+                for doc in docs:
+                    doc['_id'] = ObjectId()
+                collection.insert_prepared(docs)
+            else:
+                collection.insert_many(docs, ordered=False)
+        return db, corpus, time.perf_counter() - started
+
+    def retrieve(self, size):
+        embeddings = self.make_embeddings()
+        storage_format = self.make_processor(MemoryDatabase(), embeddings).embedding_storage_format
+        db, corpus, seed_seconds = self.seed(size, embeddings, storage_format)
+        queries = corpus.queries(self.args.queries)
+        results = {'chunks': size, 'seed_seconds': round(seed_seconds, 3), 'storage_format': storage_format, 'modes': {}}
+
+        for mode in self.args.modes:
+            # A fresh processor per mode, so the first query pays the cold load
+            processor = self.make_processor(db, embeddings)
+            rss_before = rss_mb()
+            cold_started = time.perf_counter()
+            processor.get_relevant_chunks(queries[0][1], USER_ID, use_all_materials=True,
+                                          top_k=self.args.top_k, mode=mode)
+            cold = time.perf_counter() - cold_started
+
+            samples = []
+            on_topic = 0
+            returned = 0
+            for topic, query in queries:
+                started = time.perf_counter()
+                chunks = processor.get_relevant_chunks(query, USER_ID, use_all_materials=True,
+                                                       top_k=self.args.top_k, mode=mode)
+                samples.append(time.perf_counter() - started)
+                returned += len(chunks)
+                on_topic += sum(1 for chunk in chunks if chunk['metadata'].get('topic') == topic)
+
+            results['modes'][mode] = {
+                'cold_ms': round(cold * 1000, 3),
+                'latency': latency_summary(samples),
+                # Share of returned chunks drawn from the query's topic; a sanity check, not a recall metric
+                'on_topic_precision': round(on_topic / returned, 4) if returned else 0.0,
+                'rss_before_mb': rss_before,
+                'rss_after_mb': rss_mb(),
+                'vector_cache': processor.vector_cache.stats()
+            }
+        results['peak_rss_mb'] = peak_rss_mb()
+        return results
+
+    def answer(self, size):
+        from services.qa_service import QAService
+
+        embeddings = self.make_embeddings()
+        storage_format = self.make_processor(MemoryDatabase(), embeddings).embedding_storage_format
+        db, corpus, _ = self.seed(size, embeddings, storage_format)
+        llm = FakeChatModel(
+            latency=self.args.chat_latency_ms / 1000,
+            token_latency=self.args.chat_token_latency_ms / 1000
+        )
+        service = QAService(self.make_processor(db, embeddings), llm=llm)
+
+        samples = []
+        modes = {}
+        for number, (_, query) in enumerate(corpus.queries(self.args.queries)):
+            # Independent questions: history would otherwise grow (and change cache scopes) across the run
+            service.memory.clear_history(USER_ID)
+            started = time.perf_counter()
+            result = service.answer_question(query, USER_ID, material_id=f'material-{number % self.args.materials}')
+            samples.append(time.perf_counter() - started)
+            mode = 'cached' if result.get('cached') else result.get('mode')
+            modes[mode] = modes.get(mode, 0) + 1
+        return {
+            'chunks': size,
+            'latency': latency_summary(samples),
+            'llm_calls': llm.calls,
+            'answer_modes': modes,
+            'peak_rss_mb': peak_rss_mb()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=['ingest', 'retrieve', 'answer'],
+                        default=['ingest', 'retrieve'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Corpus sizes in chunks (up to 1000000)')
+    parser.add_argument('--modes', nargs='+', choices=['vector', 'lexical', 'hybrid', 'auto'], default=['vector', 'hybrid'])
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--chunk-words', type=int, default=110, help='Words per synthetic chunk (~8 characters each)')
+    parser.add_argument('--materials', type=int, default=10, help='Materials the retrieval corpus is spread over')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--embed-latency-ms', type=float, default=0.0, help='Fake latency per embedding call')
+    parser.add_argument('--embed-per-text-ms', type=float, default=0.0, help='Fake latency per embedded text')
+    parser.add_argument('--chat-latency-ms', type=float, default=0.0, help='Fake time to first token')
+    parser.add_argument('--chat-token-latency-ms', type=float, default=0.0, help='Fake time per streamed token')
+    parser.add_argument('--vector-cache-mb', type=int, help='Override VECTOR_CACHE_MAX_BYTES for the run')
+    parser.add_argument('--seed-batch-size', type=int, default=5000)
+    parser.add_argument('--mongo-uri', help='Benchmark against a MongoDB server instead of the in-memory stand-in')
+    parser.add_argument('--database', default='bench_mentivio', help='Database used (and emptied) with --mongo-uri')
+    parser.add_argument('--output', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+    if args.mongo_uri and args.database == 'ai_tutor':
+        parser.error('refusing to empty the application database; pick another --database')
+
+    bench = Bench(args)
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'store': 'mongodb' if args.mongo_uri else 'memory',
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'mongo_uri')},
+        'environment': {
+            key: os.environ[key] for key in sorted(os.environ)
+            if key.startswith(('EMBEDDING_', 'INGEST_', 'VECTOR_', 'IVF_', 'RETRIEVAL_', 'LEXICAL_', 'CONTEXT_', 'CHUNK_'))
+        },
+        'results': {scenario: [] for scenario in args.scenarios}
+    }
+
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            print(f"{scenario} {size} chunks...", file=sys.stderr)
+            result = getattr(bench, scenario)(size)
+            report['results'][scenario].append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
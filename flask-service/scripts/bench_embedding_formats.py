@@ -0,0 +1,80 @@
+"""Compare embedding storage formats: BSON size, load time and retrieval recall
+
+Every format is measured offline by BSON-encoding chunk documents and timing
+the decode path used by retrieval (BSON decode + decode_embedding), so the
+numbers isolate the storage format from network and server effects.
+
+Usage:
+    python scripts/bench_embedding_formats.py --synthetic 20000 --dim 1536
+    python scripts/bench_embedding_formats.py --user-id <user_id>
+"""
+import argparse
+import os
+import sys
+import time
+
+import bson
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embedding_codec import EMBEDDING_FIELDS, STORAGE_FORMATS, decode_embedding, encode_embedding
+from services.vector_cache import normalize_rows, top_k_scores
+
+
+def load_user_vectors(user_id):
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    collection = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))['ai_tutor']['embeddings']
+    return np.array([
+        decode_embedding(doc)
+        for doc in collection.find({'user_id': user_id}, EMBEDDING_FIELDS)
+    ], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--user-id', help='Benchmark a user\'s stored embeddings')
+    source.add_argument('--synthetic', type=int, help='Benchmark N random vectors')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.user_id:
+        vectors = load_user_vectors(args.user_id)
+    else:
+        vectors = np.random.default_rng(0).standard_normal((args.synthetic, args.dim)).astype(np.float32)
+    if not len(vectors):
+        print("No vectors found")
+        return
+
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    queries = normalize_rows(vectors[rows] + 0.1 * rng.standard_normal(vectors[rows].shape).astype(np.float32))
+    exact_matrix = normalize_rows(vectors)
+    exact = [set(top_k_scores(exact_matrix, query, args.top_k)[0].tolist()) for query in queries]
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}")
+    print(f"{'format':<8} {'bytes/doc':>10} {'load ms':>9} {'recall@' + str(args.top_k):>9}")
+    for storage_format in STORAGE_FORMATS:
+        encoded = [bson.encode({'_id': i, **encode_embedding(vector, storage_format)}) for i, vector in enumerate(vectors)]
+        size = sum(len(doc) for doc in encoded) / len(encoded)
+
+        start = time.perf_counter()
+        matrix = normalize_rows(np.array([decode_embedding(bson.decode(doc)) for doc in encoded], dtype=np.float32))
+        load_ms = (time.perf_counter() - start) * 1000
+
+        found = sum(
+            len(truth & set(top_k_scores(matrix, query, args.top_k)[0].tolist()))
+            for query, truth in zip(queries, exact)
+        )
+        recall = found / sum(len(truth) for truth in exact)
+        print(f"{storage_format:<8} {size:>10.0f} {load_ms:>9.1f} {recall:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""Deterministic local stand-ins for Azure OpenAI and MongoDB, used by the offline benchmarks
+
+FakeEmbeddings and FakeChatModel mimic the LangChain client methods the
+services call, with configurable latency. MemoryDatabase implements the
+subset of the pymongo collection API DocumentProcessor uses, so ingest and
+retrieval can be measured without a server. SyntheticCorpus generates
+topic-clustered chunk text whose fake embeddings and BM25 terms agree, so
+retrieval quality can be sanity-checked as well as timed.
+"""
+import asyncio
+import copy
+import random
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+class FakeEmbeddings:
+    """Bag-of-words embeddings: each word maps to a fixed random vector seeded by its crc32"""
+    def __init__(self, dim=384, latency=0.0, per_text_latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+        self.texts = 0
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def word_vector(self, word):
+        vector = self._words.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode('utf-8')))
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            self._words[word] = vector
+        return vector
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in TOKEN_PATTERN.findall(text.casefold()):
+            vector += self.word_vector(word)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        self._record(len(texts))
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self.embed(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        self._record(1)
+        time.sleep(self.latency + self.per_text_latency)
+        return self.embed(text).tolist()
+
+    async def aembed_query(self, text):
+        self._record(1)
+        await asyncio.sleep(self.latency + self.per_text_latency)
+        return self.embed(text).tolist()
+
+    def _record(self, count):
+        with self._lock:
+            self.calls += 1
+            self.texts += count
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeChatModel:
+    """Chat model returning a fixed reply after latency, streamed token by token"""
+    def __init__(self, latency=0.0, token_latency=0.0, reply=None):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reply = reply or "This is a benchmark answer generated without calling a model."
+        self.calls = 0
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, messages):
+        self.calls += 1
+        time.sleep(self.latency + self.token_latency * len(self.reply.split()))
+        return FakeMessage(self.reply)
+
+    def stream(self, messages):
+        self.calls += 1
+        time.sleep(self.latency)
+        for token in self.reply.split(' '):
+            time.sleep(self.token_latency)
+            yield FakeMessage(token + ' ')
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency + self.token_latency * len(self.reply.split()))
+        return FakeMessage(self.reply)
+
+    async def astream(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        for token in self.reply.split(' '):
+            await asyncio.sleep(self.token_latency)
+            yield FakeMessage(token + ' ')
+
+
+def _matches(doc, filter_query):
+    for field, condition in filter_query.items():
+        present = field in doc
+        value = doc.get(field)
+        if isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+            for operator, operand in condition.items():
+                if operator == '$in' and (not present or value not in operand):
+                    return False
+                if operator == '$exists' and present != bool(operand):
+                    return False
+                if operator == '$gt' and (not present or not value > operand):
+                    return False
+                if operator == '$lt' and (not present or not value < operand):
+                    return False
+        elif not present or value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.copy(doc)
+    include_id = projection.get('_id', 1)
+    fields = [field for field, flag in projection.items() if flag and field != '_id']
+    if fields:
+        result = {field: doc[field] for field in fields if field in doc}
+        if include_id and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    excluded = {field for field, flag in projection.items() if not flag}
+    return {field: value for field, value in doc.items() if field not in excluded}
+
+
+class MemoryCursor:
+    def __init__(self, docs, projection):
+        self._docs = docs
+        self._projection = projection
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda doc: doc.get(field), reverse=order < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    def hint(self, index):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        for doc in self._docs:
+            yield _project(doc, self._projection)
+
+
+class MemoryCollection:
+    """Dict-backed collection; _id lookups are O(1), every other filter is a scan"""
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def _candidates(self, filter_query):
+        filter_query = filter_query or {}
+        key = filter_query.get('_id')
+        if key is not None:
+            keys = key['$in'] if isinstance(key, dict) and '$in' in key else [key]
+            docs = [self._docs[k] for k in keys if k in self._docs]
+        else:
+            docs = list(self._docs.values())
+        return [doc for doc in docs if _matches(doc, filter_query)]
+
+    def find(self, filter_query=None, projection=None, sort=None):
+        with self._lock:
+            cursor = MemoryCursor(self._candidates(filter_query), projection)
+        return cursor.sort(sort) if sort else cursor
+
+    def find_one(self, filter_query=None, projection=None, sort=None):
+        return next(iter(self.find(filter_query, projection, sort)), None)
+
+    def count_documents(self, filter_query, limit=0):
+        with self._lock:
+            count = len(self._candidates(filter_query))
+        return min(count, limit) if limit else count
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def insert_many(self, docs, ordered=True):
+        errors = []
+        with self._lock:
+            for index, doc in enumerate(docs):
+                doc.setdefault('_id', ObjectId())
+                if doc['_id'] in self._docs:
+                    errors.append({'index': index, 'code': 11000, 'errmsg': 'duplicate key'})
+                    if ordered:
+                        break
+                    continue
+                self._docs[doc['_id']] = dict(doc)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(docs) - len(errors)})
+
+    def update_one(self, filter_query, update, upsert=False):
+        with self._lock:
+            matched = self._candidates(filter_query)[:1]
+            if matched:
+                matched[0].update(update.get('$set', {}))
+                return
+            if not upsert:
+                return
+            doc = {field: value for field, value in filter_query.items() if not isinstance(value, dict)}
+            doc.setdefault('_id', ObjectId())
+            if doc['_id'] in self._docs:
+                raise DuplicateKeyError('duplicate key')
+            doc.update(update.get('$setOnInsert', {}))
+            doc.update(update.get('$set', {}))
+            self._docs[doc['_id']] = doc
+
+    def replace_one(self, filter_query, replacement, upsert=False):
+        with self._lock:
+            matched = self._candidates(filter_query)[:1]
+            if not matched and not upsert:
+                return
+            key = matched[0]['_id'] if matched else filter_query.get('_id', ObjectId())
+            self._docs[key] = {**replacement, '_id': key}
+
+    def bulk_write(self, requests, ordered=True):
+        # Only UpdateOne requests are issued by the services
+        for request in requests:
+            self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+
+    def delete_one(self, filter_query):
+        with self._lock:
+            for doc in self._candidates(filter_query)[:1]:
+                del self._docs[doc['_id']]
+
+    def delete_many(self, filter_query):
+        with self._lock:
+            for doc in self._candidates(filter_query):
+                del self._docs[doc['_id']]
+
+    def aggregate(self, pipeline):
+        with self._lock:
+            docs = list(self._docs.values())
+        projection = None
+        for stage in pipeline:
+            if '$match' in stage:
+                docs = [doc for doc in docs if _matches(doc, stage['$match'])]
+            elif '$sample' in stage:
+                docs = random.sample(docs, min(stage['$sample']['size'], len(docs)))
+            elif '$project' in stage:
+                projection = stage['$project']
+        return iter(MemoryCursor(docs, projection))
+
+    def create_index(self, keys, **kwargs):
+        return kwargs.get('name', '_'.join(f"{field}_{order}" for field, order in keys))
+
+    def insert_prepared(self, docs):
+        """Bulk-load documents that already carry unique _ids, skipping per-document checks"""
+        with self._lock:
+            self._docs.update((doc['_id'], doc) for doc in docs)
+
+    def __len__(self):
+        return len(self._docs)
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, MemoryCollection())
+
+
+class SyntheticCorpus:
+    """Topic-clustered synthetic chunks: most words come from the chunk's topic vocabulary"""
+    def __init__(self, topics=200, words_per_topic=40, common_words=2000, chunk_words=110,
+                 topic_share=0.6, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.chunk_words = chunk_words
+        self.topic_share = topic_share
+        vocabulary = self._vocabulary(topics * words_per_topic + common_words)
+        self.vocabulary = vocabulary
+        self.topic_words = np.arange(topics * words_per_topic).reshape(topics, words_per_topic)
+        self.common_words = np.arange(topics * words_per_topic, len(vocabulary))
+
+    def _vocabulary(self, size):
+        syllables = ['ka', 'lo', 'mi', 'ren', 'tas', 'vu', 'zor', 'pel', 'qui', 'dra', 'nox', 'sem', 'bi', 'fa']
+        words = set()
+        while len(words) < size:
+            words.add(''.join(self.rng.choice(syllables, int(self.rng.integers(2, 5)))))
+        return sorted(words)
+
+    def chunk_tokens(self, count):
+        """(topics, [count x chunk_words] word indices) for count chunks"""
+        topics = self.rng.integers(0, len(self.topic_words), count)
+        topical = self.rng.random((count, self.chunk_words)) < self.topic_share
+        from_topic = self.topic_words[topics[:, None], self.rng.integers(0, self.topic_words.shape[1], (count, self.chunk_words))]
+        from_common = self.rng.choice(self.common_words, (count, self.chunk_words))
+        return topics, np.where(topical, from_topic, from_common)
+
+    def text(self, token_row):
+        return ' '.join(self.vocabulary[index] for index in token_row)
+
+    def queries(self, count, words=6):
+        """[(topic, query text)] built from topic words only"""
+        topics = self.rng.integers(0, len(self.topic_words), count)
+        return [
+            (int(topic), ' '.join(self.vocabulary[index] for index in self.rng.choice(self.topic_words[topic], words, replace=False)))
+            for topic in topics
+        ]
+
+    def vectors(self, embeddings, tokens):
+        """Embeddings of token rows, equal to embeddings.embed(text) but computed in bulk"""
+        if getattr(self, '_table_for', None) is not embeddings:
+            self._table = np.stack([embeddings.word_vector(word) for word in self.vocabulary])
+            self._table_for = embeddings
+        table = self._table
+        vectors = np.zeros((tokens.shape[0], embeddings.dim), dtype=np.float32)
+        for start in range(0, tokens.shape[0], 1000):
+            vectors[start:start + 1000] = table[tokens[start:start + 1000]].sum(axis=1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
@@ -0,0 +1,81 @@
+"""Compare PyPDFLoader with page-range-parallel extraction (ParallelPDFLoader)
+
+Each mode loads the whole PDF through lazy_load() and the ingest splitter.
+The table shows time to the first chunk, total time and pages per second.
+Worker pools are started and warmed up before they are timed, as they are
+in a running server. Parallel output (text and metadata) is checked page
+by page against PyPDFLoader, so a speedup never hides a different extraction.
+
+Usage:
+    python scripts/bench_pdf_extract.py textbook.pdf
+    python scripts/bench_pdf_extract.py textbook.pdf --workers 2 4 8 --pages-per-task 4 --repeat 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from services.pdf_extract import PDFExtractor
+
+
+def run(loader, splitter):
+    """(pages, seconds to first chunk, total seconds, [(text, metadata)]) for one pass over loader"""
+    start = time.perf_counter()
+    first_chunk = None
+    texts = []
+    for page in loader.lazy_load():
+        chunks = splitter.split_documents([page])
+        if chunks and first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        texts.append((page.page_content, page.metadata))
+    return len(texts), first_chunk or 0.0, time.perf_counter() - start, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdf', help='PDF file to extract')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument('--pages-per-task', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Same settings as DocumentProcessor
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+
+    print(f"{args.pdf}, {os.cpu_count()} CPUs")
+    print(f"{'mode':<14} {'pages':>6} {'first ms':>9} {'total ms':>9} {'pages/s':>8} {'speedup':>8}")
+
+    timings = [run(PyPDFLoader(args.pdf), splitter) for _ in range(args.repeat)]
+    pages, _, _, expected = timings[0]
+    baseline = statistics.median(total for _, _, total, _ in timings)
+    first = statistics.median(first for _, first, _, _ in timings)
+    print(f"{'pypdfloader':<14} {pages:>6} {first * 1000:>9.1f} {baseline * 1000:>9.1f} {pages / baseline:>8.1f} {1.0:>8.2f}")
+
+    for workers in sorted(set(args.workers)):
+        extractor = PDFExtractor(workers=workers, pages_per_task=args.pages_per_task, min_pages=0)
+        try:
+            loader = extractor.loader(args.pdf)
+            if loader is None:
+                print(f"{'parallel x' + str(workers):<14} skipped (needs pypdf and more than one worker)")
+                continue
+            run(loader, splitter)  # warm-up: start the pool and import pypdf in every worker
+            timings = [run(extractor.loader(args.pdf), splitter) for _ in range(args.repeat)]
+        finally:
+            extractor.shutdown()
+        if any(texts != expected for _, _, _, texts in timings):
+            print(f"{'parallel x' + str(workers):<14} MISMATCH: page text or metadata differs from PyPDFLoader")
+            continue
+        total = statistics.median(total for _, _, total, _ in timings)
+        first = statistics.median(first for _, first, _, _ in timings)
+        print(f"{'parallel x' + str(workers):<14} {pages:>6} {first * 1000:>9.1f} {total * 1000:>9.1f} "
+              f"{pages / total:>8.1f} {baseline / total:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
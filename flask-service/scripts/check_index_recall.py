@@ -0,0 +1,91 @@
+"""Offline recall/latency check of the IVF index against exact brute-force search
+
+Usage:
+    python scripts/check_index_recall.py --synthetic 50000 --dim 1536
+    python scripts/check_index_recall.py --user-id <user_id> --nprobe 4 8 16 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embedding_codec import EMBEDDING_FIELDS, decode_embedding
+from services.vector_cache import normalize_rows, top_k_scores
+from services.vector_index import IVFUserIndex
+
+
+def load_user_vectors(user_id):
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    collection = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))['ai_tutor']['embeddings']
+    ids = []
+    vectors = []
+    for doc in collection.find({'user_id': user_id}, EMBEDDING_FIELDS):
+        ids.append(doc['_id'])
+        vectors.append(decode_embedding(doc))
+    return ids, np.array(vectors, dtype=np.float32)
+
+
+def synthetic_vectors(count, dim, clusters=200, seed=0):
+    """Clustered random vectors so the quantizer has structure to find"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    return list(range(count)), vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--user-id', help='Evaluate on a user\'s stored embeddings')
+    source.add_argument('--synthetic', type=int, help='Evaluate on N synthetic vectors')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--nlist', type=int, default=int(os.getenv("IVF_NLIST", "64")))
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    ids, vectors = load_user_vectors(args.user_id) if args.user_id else synthetic_vectors(args.synthetic, args.dim)
+    if not len(ids):
+        print("No vectors found")
+        return
+
+    matrix = normalize_rows(vectors)
+    index = IVFUserIndex(nlist=args.nlist, min_train=0)
+    start = time.perf_counter()
+    index.add(ids, matrix)
+    print(f"Indexed {len(ids)} vectors (dim {matrix.shape[1]}, nlist {args.nlist}) in {time.perf_counter() - start:.2f}s")
+
+    # Queries are perturbed stored vectors so every query has close neighbours
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(ids), min(args.queries, len(ids)), replace=False)
+    queries = normalize_rows(matrix[rows] + 0.1 * rng.standard_normal(matrix[rows].shape).astype(np.float32))
+
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        hit_rows, _ = top_k_scores(matrix, query, args.top_k)
+        exact.append({ids[row] for row in hit_rows})
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"brute force: {exact_ms:.3f} ms/query")
+
+    for nprobe in args.nprobe:
+        found = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            found += len(truth & {chunk_id for chunk_id, _ in index.search(query, args.top_k, nprobe=nprobe)})
+        ivf_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = found / sum(len(truth) for truth in exact)
+        print(f"nprobe={nprobe:<4} recall@{args.top_k}={recall:.3f}  {ivf_ms:.3f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
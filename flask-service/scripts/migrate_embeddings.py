@@ -0,0 +1,82 @@
+"""Convert stored chunk embeddings to another storage format
+
+Both the per-user chunks (embeddings) and the shared dedup store of
+embeddings by content hash (chunk_embeddings) are converted. The dedup
+store is not per user, so --user-id leaves it alone.
+
+Usage:
+    python scripts/migrate_embeddings.py --format float16
+    python scripts/migrate_embeddings.py --format int8 --user-id <user_id> --dry-run
+
+Running Flask workers pick up the new format when their vector cache entries
+expire (VECTOR_CACHE_TTL_SECONDS); decoding handles every format, so old and
+new documents can coexist while the migration runs.
+"""
+import argparse
+import os
+import sys
+import time
+
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embedding_codec import EMBEDDING_FIELDS, STORAGE_FORMATS, decode_embedding, encode_embedding
+
+load_dotenv()
+
+
+def migrate(collection, filter_query, storage_format, batch_size, dry_run):
+    """Re-encode the embeddings of documents matching filter_query; returns the number converted"""
+    filter_query = dict(filter_query)
+    if storage_format == 'array':
+        filter_query['embedding_format'] = {'$exists': True}
+    else:
+        filter_query['embedding_format'] = {'$ne': storage_format}
+
+    pending = collection.count_documents(filter_query)
+    print(f"{collection.name}: {pending} documents to convert to {storage_format}")
+    if dry_run or not pending:
+        return 0
+
+    converted = 0
+    start = time.perf_counter()
+    operations = []
+    for doc in collection.find(filter_query, EMBEDDING_FIELDS):
+        fields = encode_embedding(decode_embedding(doc), storage_format)
+        update = {'$set': fields}
+        unset = {name: '' for name in ('embedding_format', 'embedding_scale') if name not in fields}
+        if unset:
+            update['$unset'] = unset
+        operations.append(UpdateOne({'_id': doc['_id']}, update))
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            print(f"  {converted}/{pending}")
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+
+    print(f"{collection.name}: converted {converted} documents in {time.perf_counter() - start:.1f}s")
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', required=True, choices=STORAGE_FORMATS)
+    parser.add_argument('--user-id', help='Only migrate this user\'s chunks (the shared dedup store is skipped)')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help='Count documents without writing')
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))['ai_tutor']
+
+    if args.user_id:
+        migrate(db['embeddings'], {'user_id': args.user_id}, args.format, args.batch_size, args.dry_run)
+        return
+    for name in ('embeddings', 'chunk_embeddings'):
+        migrate(db[name], {}, args.format, args.batch_size, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
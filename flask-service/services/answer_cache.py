@@ -0,0 +1,124 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from services.embedding_cache import normalize_text
+
+
+class AnswerCache:
+    """Cache of document-grounded answers with an exact and a near-duplicate tier
+
+    Answers are grouped by scope: the retrieval mode, the chunks the answer was
+    grounded on and (when present) the conversation history in the prompt.
+    Within a scope a question matches exactly on its normalized text, or
+    semantically when its embedding's cosine similarity to a cached question
+    reaches similarity_threshold.
+    """
+    def __init__(self, max_entries=None, ttl_seconds=None, similarity_threshold=None):
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+        self.similarity_threshold = float(
+            similarity_threshold if similarity_threshold is not None else os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")
+        )
+        self._entries = OrderedDict()  # {(scope, normalized question): (expires_at, unit vector, response)}
+        self._scopes = {}  # {scope: set of normalized questions}
+        self._lock = threading.Lock()
+        self._hits = {'exact': 0, 'semantic': 0}
+        self._misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_scope(mode, chunks, history=None):
+        """Scope key from the retrieval mode, grounding chunk ids and prompt history"""
+        digest = hashlib.sha256(mode.encode('utf-8'))
+        # Content hashes let students with their own copy of a handout share answers
+        for chunk_id in sorted(chunk.get('content_hash') or chunk.get('id') or chunk['content'] for chunk in chunks):
+            digest.update(b'\x00' + chunk_id.encode('utf-8'))
+        for message in history or []:
+            digest.update(f"\x01{message.type}:{message.content}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, scope, question, question_vector=None):
+        """Return (response, 'exact' | 'semantic') or None"""
+        normalized = normalize_text(question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((scope, normalized))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((scope, normalized))
+                self._hits['exact'] += 1
+                return copy.deepcopy(entry[2]), 'exact'
+
+            if question_vector is not None and self.similarity_threshold < 1.0:
+                query = _unit(question_vector)
+                best_key, best_score = None, self.similarity_threshold
+                for candidate in self._scopes.get(scope, ()):
+                    _, vector, _ = self._entries[(scope, candidate)]
+                    if vector is None:
+                        continue
+                    score = float(np.dot(query, vector))
+                    if score >= best_score:
+                        best_key, best_score = (scope, candidate), score
+                if best_key is not None and self._entries[best_key][0] > now:
+                    self._entries.move_to_end(best_key)
+                    self._hits['semantic'] += 1
+                    return copy.deepcopy(self._entries[best_key][2]), 'semantic'
+
+            self._misses += 1
+            return None
+
+    def put(self, scope, question, question_vector, response):
+        if not self.enabled:
+            return
+        key = (scope, normalize_text(question))
+        vector = _unit(question_vector) if question_vector is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector, copy.deepcopy(response))
+            self._scopes.setdefault(scope, set()).add(key[1])
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            hits = self._hits['exact'] + self._hits['semantic']
+            lookups = hits + self._misses
+            return {
+                'exact_hits': self._hits['exact'],
+                'semantic_hits': self._hits['semantic'],
+                'misses': self._misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
+
+    def _evict(self):
+        now = time.monotonic()
+        # Drop from the least recently used end while over capacity or expired
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now and len(self._entries) <= self.max_entries:
+                break
+            self._remove(key)
+
+    def _remove(self, key):
+        self._entries.pop(key)
+        questions = self._scopes.get(key[0])
+        if questions is not None:
+            questions.discard(key[1])
+            if not questions:
+                del self._scopes[key[0]]
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
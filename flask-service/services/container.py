@@ -0,0 +1,288 @@
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+from pymongo import MongoClient
+
+from services.answer_cache import AnswerCache
+from services.context_builder import ContextBuilder
+from services.conversation_memory import ConversationMemory, MongoConversationBackend
+from services.document_processor import DocumentProcessor
+from services.embedding_cache import EmbeddingCache
+from services.feedback_cache import FeedbackCache
+from services.ingest_jobs import IngestJobQueue
+from services.llm_client import RateLimitedChatModel, RateLimitedEmbeddings, RequestLimiter
+from services.qa_service import QAService
+from services.question_pool import QuestionPool
+from services.quiz_generator import QuizGenerator
+from services.socratic_tutor import SocraticTutor
+from services.vector_cache import VectorCache
+
+load_dotenv()
+
+
+class ServiceContainer:
+    """Per-process holder of shared clients and services, each built lazily on first use
+
+    Safe under pre-forking servers: MongoClient and HTTP pools must not be
+    shared across fork(), so a child process that inherits a populated
+    container drops every instance and rebuilds on demand.
+    """
+    def __init__(self):
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._instances = {}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """Forget every instance; the next access builds fresh ones"""
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._instances = {}
+
+    def built(self, name):
+        """The instance already built under name, or None; never builds it"""
+        if os.getpid() != self._pid:
+            return None
+        return self._instances.get(name) or None
+
+    def _get(self, name, factory):
+        if os.getpid() != self._pid:
+            self.reset()
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = factory()
+                    self._instances[name] = instance
+        return instance
+
+    # Clients
+
+    @property
+    def mongo_client(self):
+        return self._get('mongo_client', lambda: MongoClient(
+            os.getenv("MONGODB_URI", "mongodb://localhost:27017/"),
+            maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+            minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+            serverSelectionTimeoutMS=int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+            connect=False
+        ))
+
+    @property
+    def db(self):
+        return self.mongo_client['ai_tutor']
+
+    @property
+    def async_mongo_client(self):
+        """Native asyncio client for the ASGI entry point (None when pymongo predates 4.9)"""
+        def build():
+            try:
+                from pymongo import AsyncMongoClient
+            except ImportError:
+                return False
+            return AsyncMongoClient(
+                os.getenv("MONGODB_URI", "mongodb://localhost:27017/"),
+                maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+                minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+                serverSelectionTimeoutMS=int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+                connect=False
+            )
+        return self._get('async_mongo_client', build) or None
+
+    @property
+    def async_db(self):
+        client = self.async_mongo_client
+        return client['ai_tutor'] if client is not None else None
+
+    @property
+    def http_client(self):
+        """Connection pool shared by the Azure chat and embedding clients"""
+        return self._get('http_client', lambda: httpx.Client(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("AZURE_HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("AZURE_HTTP_MAX_KEEPALIVE", "20"))
+            )
+        ))
+
+    @property
+    def async_http_client(self):
+        """Connection pool for ainvoke/astream and aembed_query calls"""
+        return self._get('async_http_client', lambda: httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("AZURE_HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("AZURE_HTTP_MAX_KEEPALIVE", "20"))
+            )
+        ))
+
+    @property
+    def chat_limiter(self):
+        """Concurrency and tokens-per-minute budget of the chat deployment, shared by every service"""
+        return self._get('chat_limiter', lambda: RequestLimiter.from_env('chat'))
+
+    @property
+    def embedding_limiter(self):
+        return self._get('embedding_limiter', lambda: RequestLimiter.from_env('embedding'))
+
+    @property
+    def embeddings(self):
+        # Retries are left to the wrapper so they go through the limiter
+        return self._get('embeddings', lambda: RateLimitedEmbeddings(
+            AzureOpenAIEmbeddings(
+                azure_endpoint=os.getenv("embedding_AZURE_OPENAI_API_BASE"),
+                api_key=os.getenv("embedding_AZURE_OPENAI_API_KEY"),
+                api_version=os.getenv("embedding_AZURE_OPENAI_API_VERSION"),
+                azure_deployment=os.getenv("embedding_AZURE_OPENAI_API_NAME"),
+                max_retries=0,
+                http_client=self.http_client,
+                http_async_client=self.async_http_client
+            ),
+            limiter=self.embedding_limiter
+        ))
+
+    @property
+    def chat_model(self):
+        """Single chat client; services needing another temperature bind it per call"""
+        return self._get('chat_model', lambda: RateLimitedChatModel(
+            AzureChatOpenAI(
+                azure_endpoint=os.getenv("AZURE_OPENAI_API_BASE"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+                azure_deployment=os.getenv("AZURE_OPENAI_API_NAME"),
+                model_name="gpt-4o",
+                temperature=0.7,
+                max_retries=0,
+                http_client=self.http_client,
+                http_async_client=self.async_http_client
+            ),
+            limiter=self.chat_limiter
+        ))
+
+    # Caches
+
+    @property
+    def embedding_cache(self):
+        return self._get('embedding_cache', EmbeddingCache)
+
+    @property
+    def answer_cache(self):
+        return self._get('answer_cache', AnswerCache)
+
+    @property
+    def feedback_cache(self):
+        return self._get('feedback_cache', lambda: FeedbackCache(self.db['quiz_feedback']))
+
+    @property
+    def vector_cache(self):
+        return self._get('vector_cache', VectorCache)
+
+    @property
+    def context_builder(self):
+        return self._get('context_builder', ContextBuilder)
+
+    @property
+    def conversation_memory(self):
+        """Chat histories, persisted to MongoDB when CONVERSATION_BACKEND=mongo"""
+        def build():
+            max_history = 10
+            backend = None
+            if os.getenv("CONVERSATION_BACKEND", "memory").lower() == 'mongo':
+                backend = MongoConversationBackend(self.db['conversations'], max_messages=max_history * 2)
+            return ConversationMemory(backend=backend, max_history=max_history)
+        return self._get('conversation_memory', build)
+
+    # Services
+
+    @property
+    def doc_processor(self):
+        return self._get('doc_processor', lambda: DocumentProcessor(
+            vector_cache=self.vector_cache,
+            embedding_cache=self.embedding_cache,
+            embeddings=self.embeddings,
+            db=self.db,
+            async_db=self.async_db
+        ))
+
+    @property
+    def ingest_queue(self):
+        """Ingest job queue; its workers start with it and pick up jobs left by earlier processes"""
+        def build():
+            ingest_queue = IngestJobQueue(self.process_document)
+            ingest_queue.start()
+            return ingest_queue
+        return self._get('ingest_queue', build)
+
+    def process_document(self, file_path, user_id, material_id, **kwargs):
+        """Ingest a document, then queue question pool generation for it when enabled"""
+        result = self.doc_processor.process_document(file_path, user_id, material_id, **kwargs)
+        if result.get('success') and self.question_pool is not None:
+            self.question_pool.schedule_fill(user_id, material_id)
+        return result
+
+    @property
+    def question_pool(self):
+        """Pre-generated quiz/flashcard pools; None unless QUESTION_POOL_ENABLED=true"""
+        def build():
+            if os.getenv("QUESTION_POOL_ENABLED", "false").lower() != 'true':
+                return False
+            return QuestionPool(
+                self.db['question_pools'],
+                generate=lambda *args: self.quiz_generator.generate_items(*args),
+                sample_chunks=self.doc_processor.sample_chunks
+            )
+        return self._get('question_pool', build) or None
+
+    @property
+    def qa_service(self):
+        return self._get('qa_service', lambda: QAService(
+            self.doc_processor,
+            llm=self.chat_model,
+            answer_cache=self.answer_cache,
+            memory=self.conversation_memory,
+            context_builder=self.context_builder
+        ))
+
+    @property
+    def quiz_generator(self):
+        return self._get('quiz_generator', lambda: QuizGenerator(
+            self.doc_processor,
+            llm=self.chat_model,
+            question_pool=self.question_pool,
+            feedback_cache=self.feedback_cache,
+            context_builder=self.context_builder
+        ))
+
+    @property
+    def socratic_tutor(self):
+        return self._get('socratic_tutor', lambda: SocraticTutor(
+            self.doc_processor,
+            llm=self.chat_model.bind(temperature=0.8),
+            context_builder=self.context_builder
+        ))
+
+    # Health
+
+    def liveness(self):
+        """The process is up and serving requests"""
+        return {'status': 'healthy', 'pid': os.getpid()}
+
+    def readiness(self):
+        """Dependencies are configured and reachable"""
+        checks = {}
+        try:
+            self.mongo_client.admin.command('ping')
+            checks['mongodb'] = 'ok'
+        except Exception as e:
+            checks['mongodb'] = f'error: {str(e)}'
+        required = [
+            "AZURE_OPENAI_API_BASE", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_API_NAME",
+            "embedding_AZURE_OPENAI_API_BASE", "embedding_AZURE_OPENAI_API_KEY", "embedding_AZURE_OPENAI_API_NAME"
+        ]
+        missing = [name for name in required if not os.getenv(name)]
+        checks['azure_config'] = 'ok' if not missing else f"missing: {', '.join(missing)}"
+        ready = all(value == 'ok' for value in checks.values())
+        return {'status': 'ready' if ready else 'not_ready', 'checks': checks}, ready
@@ -0,0 +1,189 @@
+import logging
+import math
+import os
+import threading
+import time
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from services.telemetry import CONTEXT_TOKENS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """Local token counts with tiktoken, or roughly four characters per token without it"""
+    def __init__(self, encoding_name=None):
+        self.encoding = None
+        encoding_name = encoding_name or os.getenv("CONTEXT_TOKENIZER_ENCODING", "o200k_base")
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning("Falling back to estimated token counts: %s", e)
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / 4)
+
+    def truncate(self, text, max_tokens):
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+        return text[:max_tokens * 4]
+
+
+def remove_overlap(previous, following, max_overlap):
+    """Return following without the prefix it shares with the end of previous
+
+    The splitter repeats up to chunk_overlap characters between consecutive
+    chunks; only an exact suffix/prefix match within max_overlap is removed.
+    """
+    probe = following[:32]
+    if not probe:
+        return following
+    start = previous.find(probe, max(0, len(previous) - max_overlap))
+    while start != -1:
+        if following.startswith(previous[start:]):
+            return following[len(previous) - start:]
+        start = previous.find(probe, start + 1)
+    return following
+
+
+class ContextBuilder:
+    """Assembles retrieved chunks into a prompt context within a token budget
+
+    Chunks are taken in relevance order while the assembled context fits
+    max_tokens. Consecutive chunks of the same material (by chunk_index) are
+    merged with their shared overlap removed, and merged runs are ordered by
+    their most relevant chunk. Totals of tokens used and saved against plain
+    concatenation are kept for stats().
+    """
+    def __init__(self, max_tokens=None, max_overlap=None, counter=None):
+        self.max_tokens = int(max_tokens if max_tokens is not None else os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+        self.max_overlap = int(max_overlap if max_overlap is not None else os.getenv("CONTEXT_MAX_OVERLAP_CHARS", "400"))
+        self.counter = counter or TokenCounter()
+        self._lock = threading.Lock()
+        self._totals = {'builds': 0, 'tokens': 0, 'tokens_saved': 0, 'chunks_dropped': 0}
+
+    def build(self, chunks, max_tokens=None):
+        """Return (context, stats) for chunks ordered best first"""
+        budget = max_tokens or self.max_tokens
+        if not chunks:
+            return '', {'tokens': 0, 'tokens_saved': 0, 'chunks_used': 0, 'chunks_dropped': 0}
+
+        started = time.perf_counter()
+        # Runs of consecutive chunks keep the text (and tokens) each chunk adds, so a
+        # candidate is counted on its own instead of re-tokenizing the whole context
+        runs = []
+        by_first = {}  # {(material_id, first chunk_index): run}
+        by_last = {}  # {(material_id, last chunk_index): run}
+        placed = set()
+        separator = self.counter.count("\n\n")
+        estimate = 0
+        used = 0
+        for rank, chunk in enumerate(chunks):
+            position = self._position(chunk)
+            if position in placed:
+                position = None
+            before = by_last.get((position[0], position[1] - 1)) if position else None
+            after = by_first.get((position[0], position[1] + 1)) if position else None
+
+            text = self._piece(before['chunks'][-1] if before else None, chunk)
+            tokens = self.counter.count(text)
+            added = tokens
+            if after:
+                # The next run's first chunk now drops the overlap it shares with this one
+                following = self._piece(chunk, after['chunks'][0])
+                following_tokens = self.counter.count(following)
+                added += following_tokens - after['tokens'][0]
+            if before and after:
+                added -= separator
+            elif not before and not after and runs:
+                added += separator
+
+            if estimate + added > budget:
+                if not runs:
+                    # Even the best chunk alone is over budget: keep as much of it as fits
+                    runs.append({'rank': rank, 'texts': [chunk['content']]})
+                    used = 1
+                    break
+                continue
+
+            run = {'rank': rank, 'chunks': [chunk], 'texts': [text], 'tokens': [tokens]}
+            if before:
+                runs.remove(before)
+                del by_last[self._position(before['chunks'][-1])]
+                run = {
+                    'rank': min(before['rank'], rank),
+                    'chunks': before['chunks'] + run['chunks'],
+                    'texts': before['texts'] + run['texts'],
+                    'tokens': before['tokens'] + run['tokens']
+                }
+            if after:
+                runs.remove(after)
+                del by_first[self._position(after['chunks'][0])]
+                run = {
+                    'rank': min(run['rank'], after['rank']),
+                    'chunks': run['chunks'] + after['chunks'],
+                    'texts': run['texts'] + [following] + after['texts'][1:],
+                    'tokens': run['tokens'] + [following_tokens] + after['tokens'][1:]
+                }
+            runs.append(run)
+            if position:
+                placed.add(position)
+                by_first[self._position(run['chunks'][0])] = run
+                by_last[self._position(run['chunks'][-1])] = run
+            estimate += added
+            used += 1
+
+        runs.sort(key=lambda run: run['rank'])
+        context = "\n\n".join(''.join(run['texts']) for run in runs)
+        tokens = self.counter.count(context)
+        if tokens > budget:
+            # Pieces can tokenize a little differently once joined; the budget still holds
+            context = self.counter.truncate(context, budget)
+            tokens = self.counter.count(context)
+
+        naive_tokens = self.counter.count("\n\n".join(chunk['content'] for chunk in chunks))
+        stats = {
+            'tokens': tokens,
+            'tokens_saved': max(0, naive_tokens - tokens),
+            'chunks_used': used,
+            'chunks_dropped': len(chunks) - used
+        }
+        with self._lock:
+            self._totals['builds'] += 1
+            self._totals['tokens'] += stats['tokens']
+            self._totals['tokens_saved'] += stats['tokens_saved']
+            self._totals['chunks_dropped'] += stats['chunks_dropped']
+        CONTEXT_TOKENS.observe(tokens)
+        observe_stage('context.build', time.perf_counter() - started)
+        return context, stats
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self._totals)
+        totals.update(max_tokens=self.max_tokens, exact_token_counts=self.counter.exact)
+        return totals
+
+    @staticmethod
+    def _position(chunk):
+        """(material_id, chunk_index), or None for chunks that cannot be merged with neighbours"""
+        index = chunk.get('chunk_index')
+        return None if index is None else (chunk.get('material_id'), index)
+
+    def _piece(self, previous, chunk):
+        """Text chunk adds after previous, the chunk before it in the same run (None starts a run)"""
+        if previous is None:
+            return chunk['content']
+        remainder = remove_overlap(previous['content'], chunk['content'], self.max_overlap)
+        # No shared text (e.g. a page break between the chunks): keep them as separate lines
+        return remainder if remainder is not chunk['content'] else "\n" + remainder
@@ -0,0 +1,226 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessBackend:
+    """No persistence: histories live only in this process"""
+    persistent = False
+
+    def load(self, user_id: str) -> Optional[List[Dict]]:
+        return None
+
+    def append(self, user_id: str, role: str, content: str):
+        pass
+
+    def clear(self, user_id: str):
+        pass
+
+
+class MongoConversationBackend:
+    """Histories persisted in a MongoDB collection with batched write-behind
+
+    Writes are buffered per user and flushed by a background thread every
+    flush_interval seconds as one bulk_write; each history is capped at
+    max_messages with $slice.
+    """
+    persistent = True
+
+    def __init__(self, collection, max_messages: int, flush_interval: Optional[float] = None):
+        self.collection = collection
+        self.max_messages = max_messages
+        self.flush_interval = float(flush_interval or os.getenv("CONVERSATION_FLUSH_INTERVAL", "1.0"))
+        self._pending = OrderedDict()  # {user_id: {'clear': bool, 'messages': [...]}}
+        self._lock = threading.Lock()
+        self._flusher = threading.Thread(target=self._flush_loop, name="conversation-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def load(self, user_id: str) -> Optional[List[Dict]]:
+        # Persist our own buffered writes first so the read includes them
+        self.flush(user_id)
+        doc = self.collection.find_one({'_id': user_id}, {'messages': 1})
+        return doc.get('messages', []) if doc else []
+
+    def append(self, user_id: str, role: str, content: str):
+        with self._lock:
+            pending = self._pending.setdefault(user_id, {'clear': False, 'messages': []})
+            pending['messages'].append({'role': role, 'content': content})
+
+    def clear(self, user_id: str):
+        with self._lock:
+            self._pending[user_id] = {'clear': True, 'messages': []}
+
+    def flush(self, user_id: Optional[str] = None):
+        """Write buffered changes (for one user, or everyone) in a single bulk_write"""
+        with self._lock:
+            if user_id is None:
+                batch, self._pending = self._pending, OrderedDict()
+            elif user_id in self._pending:
+                batch = {user_id: self._pending.pop(user_id)}
+            else:
+                return
+        operations = []
+        for pending_user, pending in batch.items():
+            update = {'$set': {'updated_at': time.time()}}
+            if pending['clear']:
+                update['$set']['messages'] = pending['messages'][-self.max_messages:]
+            elif pending['messages']:
+                update['$push'] = {'messages': {'$each': pending['messages'], '$slice': -self.max_messages}}
+            operations.append(UpdateOne({'_id': pending_user}, update, upsert=True))
+        if operations:
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.warning("Error flushing conversation history: %s", e)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+class _History:
+    __slots__ = ('messages', 'chars', 'last_access', 'synced_at')
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.chars = 0
+        self.last_access = time.monotonic()
+        self.synced_at = time.monotonic()
+
+
+class ConversationMemory:
+    """Manages conversation history per user
+
+    Each history is a bounded deque of the last max_history exchanges. Users
+    idle for longer than idle_ttl seconds are evicted, and least recently used
+    users are evicted whenever the number of users or the total characters held
+    exceeds the global budget. A persistent backend lets several workers share
+    histories: a worker re-reads a user's history only after sync_interval
+    seconds, not on every request.
+    """
+    def __init__(self, backend=None, max_history: int = 10, idle_ttl: Optional[float] = None,
+                 max_users: Optional[int] = None, max_chars: Optional[int] = None,
+                 sync_interval: Optional[float] = None):
+        self.max_history = max_history  # Keep last 10 exchanges
+        self.backend = backend or InProcessBackend()
+        self.idle_ttl = float(idle_ttl if idle_ttl is not None else os.getenv("CONVERSATION_IDLE_TTL_SECONDS", "3600"))
+        self.max_users = int(max_users if max_users is not None else os.getenv("CONVERSATION_MAX_USERS", "10000"))
+        self.max_chars = int(max_chars if max_chars is not None else os.getenv("CONVERSATION_MAX_CHARS", str(50 * 1024 * 1024)))
+        self.sync_interval = float(sync_interval if sync_interval is not None else os.getenv("CONVERSATION_SYNC_INTERVAL", "30"))
+        self.conversations = OrderedDict()  # {user_id: _History}, least recently used first
+        self._chars = 0
+        self._lock = threading.RLock()
+
+    def add_message(self, user_id: str, role: str, content: str):
+        """Add a message to user's conversation history"""
+        if role == "user":
+            message = HumanMessage(content=content)
+        elif role == "assistant":
+            message = AIMessage(content=content)
+        else:
+            return
+        with self._history(user_id) as history:
+            if len(history.messages) == history.messages.maxlen:
+                self._account(history, -len(history.messages[0].content))
+            history.messages.append(message)
+            self._account(history, len(content))
+            self._evict()
+        self.backend.append(user_id, role, content)
+
+    def get_history(self, user_id: str) -> List:
+        """Get user's conversation history"""
+        with self._history(user_id) as history:
+            messages = list(history.messages)
+            self._evict()
+            return messages
+
+    def clear_history(self, user_id: str):
+        """Clear user's conversation history"""
+        with self._lock:
+            history = self.conversations.pop(user_id, None)
+            if history is not None:
+                self._chars -= history.chars
+        self.backend.clear(user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'users': len(self.conversations),
+                'chars': self._chars,
+                'max_users': self.max_users,
+                'max_chars': self.max_chars
+            }
+
+    @contextmanager
+    def _history(self, user_id: str):
+        """Hold the lock with user_id's history, loading it from the backend first if needed
+
+        The backend is read without the lock, so a slow load for one user
+        does not block the others; a history another thread installed in
+        the meantime wins over ours.
+        """
+        loaded = None
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                history = self.conversations.get(user_id)
+                if history is None or self._stale(history, now):
+                    if loaded is None:
+                        history = None
+                    else:
+                        if history is not None:
+                            self._chars -= history.chars
+                        history = loaded
+                        self._chars += history.chars
+                        self.conversations[user_id] = history
+                if history is not None:
+                    history.last_access = now
+                    self.conversations.move_to_end(user_id)
+                    yield history
+                    return
+            loaded = self._load(user_id)
+
+    def _stale(self, history: _History, now: float) -> bool:
+        return (
+            now - history.last_access > self.idle_ttl
+            or (self.backend.persistent and now - history.synced_at > self.sync_interval)
+        )
+
+    def _load(self, user_id: str) -> _History:
+        history = _History(self.max_history * 2)
+        stored = self.backend.load(user_id) or []
+        for message in stored[-self.max_history * 2:]:
+            cls = HumanMessage if message['role'] == 'user' else AIMessage
+            history.messages.append(cls(content=message['content']))
+            history.chars += len(message['content'])
+        return history
+
+    def _account(self, history: _History, chars: int):
+        history.chars += chars
+        self._chars += chars
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.conversations:
+            user_id, history = next(iter(self.conversations.items()))
+            idle = now - history.last_access > self.idle_ttl
+            over_budget = len(self.conversations) > self.max_users or self._chars > self.max_chars
+            if not idle and not over_budget:
+                break
+            # Never evict the entry being used right now
+            if len(self.conversations) == 1 and not idle:
+                break
+            self.conversations.popitem(last=False)
+            self._chars -= history.chars
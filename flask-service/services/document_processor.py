@@ -1,71 +1,180 @@
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import AzureOpenAIEmbeddings
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from services.embedding_codec import EMBEDDING_FIELDS, decode_embedding, default_storage_format, encode_embedding
+from services.lexical_index import LexicalIndex, term_frequencies
+from services.llm_client import RateLimitedEmbeddings
+from services.pdf_extract import PDFExtractor
+from services.telemetry import stage
+from services.vector_cache import VectorCache
+from services.vector_index import create_vector_index
+import asyncio
+import hashlib
+import logging
+import numpy as np
 import os
+import queue
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Compound index serving the phase-1 scan of a user's (or material's) chunks
+SCOPE_INDEX = [('user_id', 1), ('material_id', 1), ('chunk_index', 1)]
+SCOPE_INDEX_NAME = 'user_material_chunk'
+
+# Retrieval modes accepted by RETRIEVAL_MODE and get_relevant_chunks(mode=...)
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid', 'auto')
+
+# Fields returned by the phase-2 fetch of winning chunks
+CHUNK_FIELDS = {'content': 1, 'content_hash': 1, 'metadata': 1, 'material_id': 1, 'chunk_index': 1}
+
 class DocumentProcessor:
-    def __init__(self):
-        # Initialize Azure OpenAI Embeddings
-        self.embeddings = AzureOpenAIEmbeddings(
-            azure_endpoint=os.getenv("embedding_AZURE_OPENAI_API_BASE"),
-            api_key=os.getenv("embedding_AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("embedding_AZURE_OPENAI_API_VERSION"),
-            azure_deployment=os.getenv("embedding_AZURE_OPENAI_API_NAME")
+    def __init__(self, vector_cache=None, vector_index=None, embedding_cache=None, embeddings=None, db=None,
+                 async_db=None, lexical_index=None, pdf_extractor=None):
+        # Initialize Azure OpenAI Embeddings, with query embeddings cached
+        deployment = os.getenv("embedding_AZURE_OPENAI_API_NAME")
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        self.embeddings = CachedEmbeddings(
+            embeddings or RateLimitedEmbeddings(AzureOpenAIEmbeddings(
+                azure_endpoint=os.getenv("embedding_AZURE_OPENAI_API_BASE"),
+                api_key=os.getenv("embedding_AZURE_OPENAI_API_KEY"),
+                api_version=os.getenv("embedding_AZURE_OPENAI_API_VERSION"),
+                azure_deployment=deployment,
+                max_retries=0
+            )),
+            self.embedding_cache,
+            deployment
         )
         
-        # Initialize MongoDB
-        self.mongo_client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
-        self.db = self.mongo_client['ai_tutor']
+        # Initialize MongoDB (a shared database handle reuses its client's pool)
+        if db is None:
+            db = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))['ai_tutor']
+        self.db = db
         self.embeddings_collection = self.db['embeddings']
+        # content hash -> embedding, and whole-file hash -> first material processed from it
+        self.chunk_store = self.db['chunk_embeddings']
+        self.processed_files = self.db['processed_files']
+        # Optional AsyncMongoClient database used by the async retrieval path
+        self.async_db = async_db
         
         # Text splitter
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
             length_function=len
         )
+        
+        # Page-range-parallel extraction of long PDFs (PDF_EXTRACT_WORKERS)
+        self.pdf_extractor = pdf_extractor or PDFExtractor()
+        
+        # Ingest tuning: chunks per embed_documents call and batches in flight
+        self.embedding_batch_size = max(1, int(os.getenv("EMBEDDING_BATCH_SIZE", "64")))
+        self.embedding_concurrency = max(1, int(os.getenv("EMBEDDING_CONCURRENCY", "4")))
+        # Split batches buffered ahead of the embedder
+        self.pipeline_queue_size = max(1, int(os.getenv("INGEST_PIPELINE_QUEUE_SIZE", "4")))
+        
+        # Reuse embeddings of previously seen chunks and files
+        self.dedup_enabled = os.getenv("CHUNK_DEDUP_ENABLED", "true").lower() == 'true'
+        
+        # How new embeddings are stored: array (BSON doubles), float32, float16 or int8
+        self.embedding_storage_format = default_storage_format()
+        
+        # Per-user / per-material embedding matrices used for retrieval
+        self.vector_cache = vector_cache if vector_cache is not None else VectorCache()
+        
+        # Documents per round trip when scanning embeddings
+        self.scan_batch_size = max(1, int(os.getenv("EMBEDDING_SCAN_BATCH_SIZE", "2000")))
+        
+        # Create retrieval indexes once per process at startup
+        self.indexes_ready = False
+        if os.getenv("ENSURE_INDEXES", "true").lower() == 'true':
+            try:
+                self.ensure_indexes()
+                self.indexes_ready = True
+            except Exception as e:
+                logger.warning("Could not create embedding indexes: %s", e)
+        
+        # Search backend selected by VECTOR_INDEX_BACKEND (brute force by default)
+        self.vector_index = vector_index or create_vector_index(
+            self.vector_cache, self._load_vectors, self._count_vectors
+        )
+        
+        # BM25 over chunk text; RETRIEVAL_MODE picks vector, lexical, hybrid or auto
+        self.lexical_index = lexical_index or LexicalIndex(self._load_terms)
+        self.retrieval_mode = self._retrieval_mode(os.getenv("RETRIEVAL_MODE", "vector"))
+        # Candidates taken from each ranking before reciprocal-rank fusion
+        self.hybrid_candidates = max(1, int(os.getenv("RETRIEVAL_HYBRID_CANDIDATES", "50")))
+        self.rrf_k = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+        # In auto mode, lexical hits at or above this confidence skip the query embedding
+        self.lexical_confidence = float(os.getenv("LEXICAL_CONFIDENCE_THRESHOLD", "0.8"))
     
-    def process_document(self, file_path, user_id, material_id):
-        """Process document and store embeddings in MongoDB"""
+    def process_document(self, file_path, user_id, material_id, progress=None, resume=False):
+        """Process document and store embeddings in MongoDB
+        
+        Pages stream from the loader through the splitter, embedder and writer
+        with bounded buffers between stages, so memory stays flat regardless of
+        document length. Batches are written in chunk order, which means the
+        stored chunks always form a prefix; with resume=True processing picks
+        up after the last stored chunk.
+        
+        progress, if given, is called with counter increments such as
+        progress(pages_parsed=3) or progress(chunks_stored=64).
+        """
+        progress = progress or (lambda **counts: None)
         try:
-            # Load document based on file type
-            if file_path.endswith('.pdf'):
-                loader = PyPDFLoader(file_path)
-            elif file_path.endswith('.txt'):
-                loader = TextLoader(file_path)
-            else:
-                raise ValueError("Unsupported file format")
-            
-            # Load and split documents
-            documents = loader.load()
-            chunks = self.text_splitter.split_documents(documents)
-            
-            # Generate embeddings and store
-            stored_count = 0
-            for idx, chunk in enumerate(chunks):
-                # Generate embedding
-                embedding = self.embeddings.embed_query(chunk.page_content)
-                
-                # Store in MongoDB
-                doc = {
-                    'user_id': user_id,
-                    'material_id': material_id,
-                    'chunk_index': idx,
-                    'content': chunk.page_content,
-                    'embedding': embedding,
-                    'metadata': chunk.metadata
-                }
-                self.embeddings_collection.insert_one(doc)
-                stored_count += 1
+            loader = self._get_loader(file_path)
+            
+            start_time = time.perf_counter()
+            file_hash = self._file_hash(file_path) if self.dedup_enabled else None
+            
+            # An identical file was already processed: copy its chunks instead
+            if file_hash:
+                source = self.processed_files.find_one({'_id': file_hash})
+                if source and not resume:
+                    result = self._reuse_processed_file(source, file_path, user_id, material_id, progress, start_time)
+                    if result:
+                        return result
+                    # The source material's chunks are gone; process from scratch
+                    self.processed_files.delete_one({'_id': file_hash})
             
+            resume_from = self._stored_chunk_count(user_id, material_id) if resume else 0
+            if resume_from:
+                progress(chunks_stored=resume_from)
+            
+            batches = self._stream_batches(loader, resume_from, progress)
+            counts = self._embed_and_store(batches, user_id, material_id, progress)
+            elapsed = time.perf_counter() - start_time
+            
+            # Write the user's updated index to disk (no-op for brute force)
+            self.vector_index.persist(user_id)
+            
+            total_count = resume_from + counts['stored']
+            if file_hash:
+                self.processed_files.update_one(
+                    {'_id': file_hash},
+                    {'$setOnInsert': {'user_id': user_id, 'material_id': material_id, 'chunks': total_count}},
+                    upsert=True
+                )
             return {
                 'success': True,
-                'chunks_processed': stored_count,
-                'message': f'Successfully processed {stored_count} chunks'
+                'chunks_processed': total_count,
+                'chunks_resumed': resume_from,
+                'chunks_reused': counts['reused'],
+                'chunks_embedded': counts['stored'] - counts['reused'],
+                'elapsed_seconds': round(elapsed, 3),
+                'chunks_per_second': round(counts['stored'] / elapsed, 2) if elapsed > 0 else 0.0,
+                'message': f'Successfully processed {total_count} chunks'
             }
         except Exception as e:
             return {
@@ -73,44 +182,464 @@ class DocumentProcessor:
                 'error': str(e)
             }
     
-    def get_relevant_chunks(self, query, user_id, material_id=None, use_all_materials=False, top_k=5):
-        """Retrieve relevant chunks using similarity search"""
+    def _reuse_processed_file(self, source, file_path, user_id, material_id, progress, start_time):
+        """Copy the chunks of an identical, already processed file to a new material
+        
+        Returns None when the source material has no stored chunks left.
+        """
+        if source['user_id'] == user_id and source['material_id'] == material_id:
+            copied = self._stored_chunk_count(user_id, material_id)
+        else:
+            copied = 0
+            batch = []
+            cursor = self.embeddings_collection.find(
+                {'user_id': source['user_id'], 'material_id': source['material_id']},
+                {'_id': 0}
+            ).sort('chunk_index', 1)
+            for doc in cursor:
+                doc.update(user_id=user_id, material_id=material_id)
+                doc['metadata'] = {**doc.get('metadata', {}), 'source': file_path}
+                batch.append(doc)
+                if len(batch) >= self.embedding_batch_size:
+                    copied += self._insert_copied_chunks(batch, user_id, material_id, progress)
+                    batch = []
+            if batch:
+                copied += self._insert_copied_chunks(batch, user_id, material_id, progress)
+            self.vector_index.persist(user_id)
+        
+        if not copied:
+            return None
+        elapsed = time.perf_counter() - start_time
+        return {
+            'success': True,
+            'chunks_processed': copied,
+            'chunks_resumed': 0,
+            'chunks_reused': copied,
+            'chunks_embedded': 0,
+            'duplicate_of': source['material_id'],
+            'elapsed_seconds': round(elapsed, 3),
+            'chunks_per_second': round(copied / elapsed, 2) if elapsed > 0 else 0.0,
+            'message': f'Reused {copied} chunks from an identical upload'
+        }
+    
+    def _insert_copied_chunks(self, docs, user_id, material_id, progress):
+        for doc in docs:
+            if 'lexical_terms' not in doc:
+                doc['lexical_terms'] = term_frequencies(doc['content'])
+        self.embeddings_collection.insert_many(docs, ordered=True)
+        ids = [doc['_id'] for doc in docs]
+        self.vector_index.add(user_id, material_id, ids, [decode_embedding(doc) for doc in docs])
+        self.lexical_index.add(user_id, material_id, ids, [doc['lexical_terms'] for doc in docs])
+        progress(chunks_stored=len(docs))
+        return len(docs)
+    
+    def _file_hash(self, file_path):
+        """SHA-256 of the file bytes plus everything that shapes its chunks and vectors"""
+        digest = hashlib.sha256(self._content_key_prefix().encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _content_key_prefix(self):
+        return f"{self.embeddings.deployment}\x00{self.chunk_size}/{self.chunk_overlap}\x00"
+    
+    def _chunk_hash(self, text):
+        """Hash of a chunk's whitespace-normalized text and the embedding deployment"""
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(f"{self.embeddings.deployment}\x00{normalized}".encode('utf-8')).hexdigest()
+    
+    def _get_loader(self, file_path):
+        """Load document based on file type"""
+        if file_path.endswith('.pdf'):
+            return self.pdf_extractor.loader(file_path) or PyPDFLoader(file_path)
+        elif file_path.endswith('.txt'):
+            return TextLoader(file_path)
+        raise ValueError("Unsupported file format")
+    
+    def _stored_chunk_count(self, user_id, material_id):
+        """Index after the last stored chunk of a material (0 if none)"""
+        last = self.embeddings_collection.find_one(
+            {'user_id': user_id, 'material_id': material_id},
+            {'chunk_index': 1},
+            sort=[('chunk_index', -1)]
+        )
+        return last['chunk_index'] + 1 if last else 0
+    
+    def _stream_batches(self, loader, resume_from, progress):
+        """Yield (start_index, chunks) batches, loading and splitting pages on a producer thread
+        
+        The producer stays at most pipeline_queue_size batches ahead of the consumer.
+        """
+        batch_queue = queue.Queue(maxsize=self.pipeline_queue_size)
+        done = object()
+        stop = threading.Event()
+        
+        def put(item):
+            # Give up if the consumer has stopped reading
+            while not stop.is_set():
+                try:
+                    batch_queue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            try:
+                chunk_index = 0
+                batch = []
+                batch_start = resume_from
+                for page in loader.lazy_load():
+                    progress(pages_parsed=1)
+                    page_chunks = self.text_splitter.split_documents([page])
+                    progress(chunks_split=len(page_chunks))
+                    for chunk in page_chunks:
+                        if chunk_index >= resume_from:
+                            if not batch:
+                                batch_start = chunk_index
+                            batch.append(chunk)
+                            if len(batch) >= self.embedding_batch_size:
+                                if not put((batch_start, batch)):
+                                    return
+                                batch = []
+                        chunk_index += 1
+                if batch and not put((batch_start, batch)):
+                    return
+                put(done)
+            except Exception as e:
+                put(e)
+        
+        producer = threading.Thread(target=produce, name="ingest-splitter", daemon=True)
+        producer.start()
         try:
-            # Generate query embedding
-            query_embedding = self.embeddings.embed_query(query)
+            while True:
+                item = batch_queue.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+    
+    def _embed_and_store(self, batches, user_id, material_id, progress):
+        """Embed batches concurrently and write them to MongoDB in chunk order"""
+        counts = {'stored': 0, 'reused': 0}
+        in_flight = deque()
+        
+        def store_next():
+            stored, reused = self._store_batch(*in_flight.popleft(), user_id, material_id, progress)
+            counts['stored'] += stored
+            counts['reused'] += reused
+        
+        with ThreadPoolExecutor(max_workers=self.embedding_concurrency) as executor:
+            try:
+                for start_index, batch in batches:
+                    in_flight.append((start_index, batch, executor.submit(self._embed_batch, batch, progress)))
+                    if len(in_flight) >= self.embedding_concurrency:
+                        store_next()
+                while in_flight:
+                    store_next()
+            finally:
+                for _, _, future in in_flight:
+                    future.cancel()
+        return counts
+    
+    def _embed_batch(self, batch, progress):
+        """Embed a batch of chunks, reusing stored vectors for previously seen chunk text
+        
+        Returns (vectors, content_hashes, reused_count).
+        """
+        texts = [chunk.page_content for chunk in batch]
+        if not self.dedup_enabled:
+            with stage('ingest.embed'):
+                vectors = self.embeddings.embed_documents(texts)
+            progress(chunks_embedded=len(vectors))
+            return vectors, [None] * len(texts), 0
+        
+        hashes = [self._chunk_hash(text) for text in texts]
+        with stage('ingest.dedup_lookup'):
+            known = {
+                doc['_id']: decode_embedding(doc)
+                for doc in self.chunk_store.find({'_id': {'$in': list(set(hashes))}}, EMBEDDING_FIELDS)
+            }
+        
+        # Embed each unseen text once, even if it repeats within the batch
+        missing = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in known:
+                missing.setdefault(content_hash, text)
+        if missing:
+            with stage('ingest.embed'):
+                new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = dict(zip(missing.keys(), new_vectors))
+            try:
+                self.chunk_store.insert_many(
+                    [
+                        {'_id': content_hash, **encode_embedding(vector, self.embedding_storage_format)}
+                        for content_hash, vector in new_entries.items()
+                    ],
+                    ordered=False
+                )
+            except BulkWriteError:
+                # Another ingest stored some of the same hashes first
+                pass
+            known.update(new_entries)
+        
+        progress(chunks_embedded=len(texts))
+        reused = sum(1 for content_hash in hashes if content_hash not in missing)
+        return [known[content_hash] for content_hash in hashes], hashes, reused
+    
+    def _store_batch(self, start_index, batch, future, user_id, material_id, progress):
+        """Wait for a batch's embeddings and store the batch with one write
+        
+        Returns (stored_count, reused_count).
+        """
+        vectors, hashes, reused = future.result()
+        docs = [
+            {
+                'user_id': user_id,
+                'material_id': material_id,
+                'chunk_index': start_index + offset,
+                'content': chunk.page_content,
+                'content_hash': content_hash,
+                'metadata': chunk.metadata,
+                'lexical_terms': term_frequencies(chunk.page_content),
+                **encode_embedding(embedding, self.embedding_storage_format)
+            }
+            for offset, (chunk, embedding, content_hash) in enumerate(zip(batch, vectors, hashes))
+        ]
+        # Ordered so a failed write still leaves a contiguous prefix to resume from
+        with stage('ingest.store'):
+            self.embeddings_collection.insert_many(docs, ordered=True)
+        
+        # insert_many fills in each doc's _id
+        ids = [doc['_id'] for doc in docs]
+        self.vector_index.add(user_id, material_id, ids, vectors)
+        self.lexical_index.add(user_id, material_id, ids, [doc['lexical_terms'] for doc in docs])
+        progress(chunks_stored=len(docs))
+        return len(docs), reused
+    
+    def get_relevant_chunks(self, query, user_id, material_id=None, use_all_materials=False, top_k=5, mode=None):
+        """Retrieve relevant chunks using similarity search
+        
+        mode (default RETRIEVAL_MODE): 'vector' ranks by embedding similarity,
+        'lexical' by BM25 without embedding the query, 'hybrid' fuses both
+        rankings, and 'auto' answers lexically when BM25 is confident and
+        falls back to hybrid otherwise. An unknown mode raises ValueError
+        instead of returning no chunks.
+        """
+        mode = self._retrieval_mode(mode) if mode else self.retrieval_mode
+        try:
+            lexical_hits, lexical_only = self._lexical_stage(query, user_id, material_id, use_all_materials, top_k, mode)
+            if lexical_only:
+                return self._fetch_chunks(lexical_hits) if lexical_hits else []
             
-            # Build MongoDB filter
-            filter_query = {'user_id': user_id}
-            if not use_all_materials and material_id:
-                filter_query['material_id'] = material_id
+            # Generate query embedding
+            with stage('retrieval.embed_query'):
+                query_embedding = self.embeddings.embed_query(query)
             
-            # Get all documents matching filter
-            documents = list(self.embeddings_collection.find(filter_query))
+            # Phase 1: score ids + embeddings through the configured vector index
+            with stage('retrieval.vector_search'):
+                hits = self.vector_index.search(
+                    query_embedding, user_id, material_id, use_all_materials,
+                    self.hybrid_candidates if lexical_hits else top_k
+                )
+            if lexical_hits:
+                hits = self._fuse_hits(hits, lexical_hits, top_k)
             
-            if not documents:
+            if not hits:
                 return []
             
-            # Calculate cosine similarity
-            from numpy import dot
-            from numpy.linalg import norm
+            # Phase 2: fetch content only for the winning chunks
+            return self._fetch_chunks(hits, query_embedding)
             
-            def cosine_similarity(a, b):
-                return dot(a, b) / (norm(a) * norm(b))
+        except Exception:
+            logger.exception("Error retrieving chunks")
+            return []
+    
+    async def aget_relevant_chunks(self, query, user_id, material_id=None, use_all_materials=False, top_k=5, mode=None):
+        """Async variant of get_relevant_chunks for the ASGI entry point"""
+        mode = self._retrieval_mode(mode) if mode else self.retrieval_mode
+        try:
+            lexical_hits, lexical_only = await asyncio.to_thread(
+                self._lexical_stage, query, user_id, material_id, use_all_materials, top_k, mode
+            )
+            if lexical_only:
+                return await self._afetch_chunks(lexical_hits) if lexical_hits else []
             
-            # Calculate similarities
-            similarities = []
-            for doc in documents:
-                similarity = cosine_similarity(query_embedding, doc['embedding'])
-                similarities.append({
-                    'content': doc['content'],
-                    'similarity': similarity,
-                    'metadata': doc.get('metadata', {})
-                })
+            with stage('retrieval.embed_query'):
+                query_embedding = await self.embeddings.aembed_query(query)
             
-            # Sort by similarity and return top_k
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
-            return similarities[:top_k]
+            # Scoring is CPU-bound numpy (and may load a user's vectors), so keep it off the event loop
+            with stage('retrieval.vector_search'):
+                hits = await asyncio.to_thread(
+                    self.vector_index.search, query_embedding, user_id, material_id, use_all_materials,
+                    self.hybrid_candidates if lexical_hits else top_k
+                )
+            if lexical_hits:
+                hits = self._fuse_hits(hits, lexical_hits, top_k)
             
-        except Exception as e:
-            print(f"Error retrieving chunks: {str(e)}")
-            return []
\ No newline at end of file
+            if not hits:
+                return []
+            
+            return await self._afetch_chunks(hits, query_embedding)
+            
+        except Exception:
+            logger.exception("Error retrieving chunks")
+            return []
+    
+    def _lexical_stage(self, query, user_id, material_id, use_all_materials, top_k, mode):
+        """BM25 candidates for the mode as (hits, answer_lexically)"""
+        if mode == 'vector':
+            return [], False
+        with stage('retrieval.lexical_search'):
+            hits, confidence = self.lexical_index.search(
+                query, user_id, material_id, use_all_materials,
+                top_k if mode == 'lexical' else self.hybrid_candidates
+            )
+        if mode == 'lexical' or (mode == 'auto' and hits and confidence >= self.lexical_confidence):
+            # No query vector: report BM25 relative to the best hit as the similarity
+            best = hits[0][1] if hits else 1.0
+            return [(chunk_id, score / best, 'lexical') for chunk_id, score in hits[:top_k]], True
+        return hits, False
+    
+    @staticmethod
+    def _retrieval_mode(mode):
+        mode = str(mode).strip().lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {', '.join(RETRIEVAL_MODES)}")
+        return mode
+    
+    def _fuse_hits(self, vector_hits, lexical_hits, top_k):
+        """Reciprocal-rank fusion of both rankings; chunks only BM25 found get similarity None"""
+        fused = {}
+        similarities = dict(vector_hits)
+        for ranking in (vector_hits, lexical_hits):
+            for rank, (chunk_id, _) in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return [(chunk_id, similarities.get(chunk_id), 'hybrid') for chunk_id in best]
+    
+    def sample_chunks(self, user_id, material_id, count):
+        """Random chunks of one material, for generating content not tied to a query"""
+        docs = list(self.embeddings_collection.aggregate([
+            {'$match': {'user_id': user_id, 'material_id': material_id}},
+            {'$sample': {'size': count}},
+            {'$project': CHUNK_FIELDS}
+        ]))
+        return self._build_chunks([(doc['_id'], None, 'sample') for doc in docs], docs)
+    
+    def _fetch_chunks(self, hits, query_vector=None):
+        """Load content and metadata for [(chunk_id, similarity[, retrieval])] hits with one $in query"""
+        with stage('retrieval.fetch_chunks'):
+            docs = list(self.embeddings_collection.find(
+                {'_id': {'$in': [hit[0] for hit in hits]}},
+                self._fetch_fields(hits, query_vector)
+            ))
+        return self._build_chunks(hits, docs, query_vector)
+    
+    async def _afetch_chunks(self, hits, query_vector=None):
+        if self.async_db is None:
+            return await asyncio.to_thread(self._fetch_chunks, hits, query_vector)
+        with stage('retrieval.fetch_chunks'):
+            cursor = self.async_db['embeddings'].find(
+                {'_id': {'$in': [hit[0] for hit in hits]}},
+                self._fetch_fields(hits, query_vector)
+            )
+            docs = await cursor.to_list(length=None)
+        return self._build_chunks(hits, docs, query_vector)
+    
+    def _fetch_fields(self, hits, query_vector):
+        # Fused hits found only by BM25 get their cosine similarity from the fetched embedding
+        if query_vector is not None and any(hit[1] is None for hit in hits):
+            return {**CHUNK_FIELDS, **EMBEDDING_FIELDS}
+        return CHUNK_FIELDS
+    
+    def _build_chunks(self, hits, docs, query_vector=None):
+        """Chunk dicts in hit order; ids missing from docs (deleted meanwhile) are skipped"""
+        documents = {doc['_id']: doc for doc in docs}
+        query = None
+        if query_vector is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1.0)
+        chunks = []
+        for chunk_id, similarity, *retrieval in hits:
+            doc = documents.get(chunk_id)
+            if doc is None:
+                continue
+            if similarity is None and query is not None and 'embedding' in doc:
+                vector = decode_embedding(doc)
+                similarity = float(np.dot(vector, query) / (np.linalg.norm(vector) or 1.0))
+            chunks.append({
+                'id': str(chunk_id),
+                'content': doc['content'],
+                'content_hash': doc.get('content_hash'),
+                'similarity': similarity,
+                'metadata': doc.get('metadata', {}),
+                'material_id': doc.get('material_id'),
+                'chunk_index': doc.get('chunk_index'),
+                'retrieval': retrieval[0] if retrieval else 'vector'
+            })
+        return chunks
+    
+    def ensure_indexes(self):
+        """Create the indexes retrieval and resumable ingest rely on (idempotent)"""
+        self.embeddings_collection.create_index(SCOPE_INDEX, name=SCOPE_INDEX_NAME)
+    
+    def _scope_filter(self, user_id, material_id=None, use_all_materials=False):
+        """MongoDB filter for a user's chunks, optionally limited to one material"""
+        filter_query = {'user_id': user_id}
+        if not use_all_materials and material_id:
+            filter_query['material_id'] = material_id
+        return filter_query
+    
+    def _load_vectors(self, user_id, material_id=None, use_all_materials=False):
+        """Load chunk ids and embeddings for a scope as (ids, matrix)"""
+        ids = []
+        vectors = []
+        filter_query = self._scope_filter(user_id, material_id, use_all_materials)
+        with stage('retrieval.load_vectors'):
+            cursor = self.embeddings_collection.find(filter_query, EMBEDDING_FIELDS)
+            cursor = cursor.hint(SCOPE_INDEX_NAME).batch_size(self.scan_batch_size) if self.indexes_ready else cursor
+            for doc in cursor:
+                ids.append(doc['_id'])
+                vectors.append(decode_embedding(doc))
+            return ids, np.array(vectors, dtype=np.float32)
+    
+    def _load_terms(self, user_id):
+        """Load chunk ids, materials and term counts of a user's chunks for the BM25 index
+        
+        Chunks stored before lexical indexing are tokenized once and backfilled.
+        """
+        ids = []
+        materials = []
+        terms = []
+        missing = []
+        cursor = self.embeddings_collection.find({'user_id': user_id}, {'material_id': 1, 'lexical_terms': 1})
+        cursor = cursor.hint(SCOPE_INDEX_NAME).batch_size(self.scan_batch_size) if self.indexes_ready else cursor
+        for doc in cursor:
+            if 'lexical_terms' in doc:
+                ids.append(doc['_id'])
+                materials.append(doc.get('material_id'))
+                terms.append(doc['lexical_terms'])
+            else:
+                missing.append(doc['_id'])
+        for start in range(0, len(missing), self.scan_batch_size):
+            updates = []
+            for doc in self.embeddings_collection.find(
+                {'_id': {'$in': missing[start:start + self.scan_batch_size]}},
+                {'material_id': 1, 'content': 1}
+            ):
+                counts = term_frequencies(doc['content'])
+                ids.append(doc['_id'])
+                materials.append(doc.get('material_id'))
+                terms.append(counts)
+                updates.append(UpdateOne({'_id': doc['_id']}, {'$set': {'lexical_terms': counts}}))
+            if updates:
+                self.embeddings_collection.bulk_write(updates, ordered=False)
+        return ids, materials, terms
+    
+    def _count_vectors(self, user_id):
+        return self.embeddings_collection.count_documents({'user_id': user_id})
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different strings share a key"""
+    return ' '.join(text.split()).casefold()
+
+
+class EmbeddingCache:
+    """Query-embedding cache: bounded in-memory LRU tier plus an optional SQLite tier"""
+    def __init__(self, max_entries=None, disk_path=None):
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+        self.disk_path = disk_path if disk_path is not None else os.getenv("EMBEDDING_CACHE_PATH", "")
+        self._memory = OrderedDict()  # {key: float32 vector}
+        self._lock = threading.Lock()
+        self._hits = {'memory': 0, 'disk': 0}
+        self._misses = 0
+        self._db = None
+        if self.disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @property
+    def disk_enabled(self):
+        return self._db is not None
+
+    @staticmethod
+    def make_key(text, deployment):
+        return hashlib.sha256(f"{deployment}\x00{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._hits['memory'] += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._put_memory(key, vector)
+                    self._hits['disk'] += 1
+                    return vector
+            self._misses += 1
+            return None
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._put_memory(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                    (key, vector.tobytes())
+                )
+                self._db.commit()
+        return vector
+
+    def stats(self):
+        with self._lock:
+            hits = self._hits['memory'] + self._hits['disk']
+            lookups = hits + self._misses
+            return {
+                'memory_hits': self._hits['memory'],
+                'disk_hits': self._hits['disk'],
+                'misses': self._misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'disk_enabled': self._db is not None
+            }
+
+    def _put_memory(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+class CachedEmbeddings:
+    """Wraps an embeddings client so embed_query goes through an EmbeddingCache
+
+    Document embeddings are passed through untouched; only query text repeats.
+    """
+    def __init__(self, embeddings, cache, deployment):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.deployment = deployment or ''
+
+    def embed_query(self, text):
+        key = EmbeddingCache.make_key(text, self.deployment)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.cache.put(key, self.embeddings.embed_query(text))
+        return vector
+
+    async def aembed_query(self, text):
+        key = EmbeddingCache.make_key(text, self.deployment)
+        # The SQLite tier does blocking file I/O, so it stays off the event loop
+        on_disk = self.cache.disk_enabled
+        vector = await asyncio.to_thread(self.cache.get, key) if on_disk else self.cache.get(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            vector = await asyncio.to_thread(self.cache.put, key, vector) if on_disk else self.cache.put(key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+from bson import Binary
+
+# 'array' is the original BSON array of doubles; the others are packed binary
+STORAGE_FORMATS = ('array', 'float32', 'float16', 'int8')
+
+# Projection that fetches everything needed to decode a stored embedding
+EMBEDDING_FIELDS = {'embedding': 1, 'embedding_format': 1, 'embedding_scale': 1}
+
+_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+
+def default_storage_format():
+    storage_format = os.getenv("EMBEDDING_STORAGE_FORMAT", "array").lower()
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown EMBEDDING_STORAGE_FORMAT: {storage_format}")
+    return storage_format
+
+
+def encode_embedding(vector, storage_format='array'):
+    """Return the document fields that store vector in the given format"""
+    if storage_format == 'array':
+        return {'embedding': [float(value) for value in vector]}
+    vector = np.asarray(vector, dtype=np.float32)
+    if storage_format == 'int8':
+        # Symmetric per-vector quantization; decoded value = stored int * scale
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        packed = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return {'embedding': Binary(packed.tobytes()), 'embedding_format': 'int8', 'embedding_scale': scale}
+    if storage_format in _DTYPES:
+        packed = vector.astype(_DTYPES[storage_format])
+        return {'embedding': Binary(packed.tobytes()), 'embedding_format': storage_format}
+    raise ValueError(f"Unknown embedding storage format: {storage_format}")
+
+
+def decode_embedding(doc):
+    """Decode a stored embedding into a float32 vector"""
+    storage_format = doc.get('embedding_format', 'array')
+    value = doc['embedding']
+    if storage_format == 'array':
+        return np.asarray(value, dtype=np.float32)
+    vector = np.frombuffer(value, dtype=_DTYPES[storage_format])
+    if storage_format == 'int8':
+        return vector.astype(np.float32) * np.float32(doc.get('embedding_scale', 1.0))
+    return vector.astype(np.float32, copy=False)
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import DuplicateKeyError
+
+from services.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackCache:
+    """Quiz feedback keyed by topic and score band, in memory with an optional MongoDB tier
+
+    Feedback only depends on the topic and roughly how well the student did,
+    so every submission in the same band shares one generated text. The
+    MongoDB tier lets all workers (and restarts) share it, and lets a
+    feedback id handed out by one worker be fetched from another.
+    """
+    def __init__(self, collection=None, max_entries=None, ttl_seconds=None, band_width=None):
+        self.collection = collection
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv("FEEDBACK_CACHE_MAX_ENTRIES", "2000"))
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else os.getenv("FEEDBACK_CACHE_TTL_SECONDS", "604800"))
+        self.band_width = max(1, int(band_width if band_width is not None else os.getenv("FEEDBACK_SCORE_BAND", "10")))
+        self._memory = OrderedDict()  # {key: (expires_at, entry)}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def band(self, score):
+        """Score band as (low, high) percentages; 100% falls in the top band"""
+        top = max(0, (100 // self.band_width) - 1)
+        index = min(int(score // self.band_width), top)
+        low = index * self.band_width
+        return low, 100 if index == top else low + self.band_width - 1
+
+    def make_key(self, topic, band):
+        return hashlib.sha256(f"{normalize_text(topic or '')}\x00{band[0]}-{band[1]}".encode('utf-8')).hexdigest()[:24]
+
+    def get(self, key):
+        """Cached entry {'topic', 'band', 'feedback'} or None"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[0] > now:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                return dict(cached[1])
+
+        entry = None
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({
+                    '_id': key,
+                    'feedback': {'$exists': True},
+                    'created_at': {'$gt': time.time() - self.ttl_seconds}
+                })
+                if doc:
+                    entry = {'topic': doc['topic'], 'band': doc['band'], 'feedback': doc['feedback']}
+            except Exception as e:
+                logger.warning("Error reading feedback cache: %s", e)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._put_memory(key, entry)
+        return dict(entry)
+
+    def put(self, key, topic, band, feedback):
+        entry = {'topic': topic, 'band': list(band), 'feedback': feedback}
+        with self._lock:
+            self._put_memory(key, entry)
+        if self.collection is not None:
+            try:
+                self.collection.replace_one({'_id': key}, {**entry, 'created_at': time.time()}, upsert=True)
+            except Exception as e:
+                logger.warning("Error writing feedback cache: %s", e)
+
+    def mark_pending(self, key, topic, band):
+        """Record that feedback for key is being generated, so other workers report it as pending"""
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(
+                {'_id': key, 'feedback': {'$exists': False}},
+                {'$set': {'topic': topic, 'band': list(band), 'pending_since': time.time()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # A concurrent put already stored the feedback
+            pass
+        except Exception as e:
+            logger.warning("Error writing feedback cache: %s", e)
+
+    def is_pending(self, key, max_age=300):
+        if self.collection is None:
+            return False
+        try:
+            return self.collection.count_documents({
+                '_id': key,
+                'feedback': {'$exists': False},
+                'pending_since': {'$gt': time.time() - max_age}
+            }, limit=1) > 0
+        except Exception as e:
+            logger.warning("Error reading feedback cache: %s", e)
+            return False
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._memory),
+                'max_entries': self.max_entries
+            }
+
+    def _put_memory(self, key, entry):
+        self._memory[key] = (time.monotonic() + self.ttl_seconds, entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingest queue already holds INGEST_QUEUE_MAX_DEPTH waiting jobs"""
+
+
+PROGRESS_FIELDS = ('pages_parsed', 'chunks_split', 'chunks_embedded', 'chunks_stored')
+
+
+class IngestJobQueue:
+    """SQLite-backed document ingest queue drained by a bounded pool of worker threads
+
+    The job table is the queue: workers claim the oldest queued row inside an
+    IMMEDIATE transaction, so several Flask processes can share one database
+    file without running a job twice. A claim is a lease that a heartbeat
+    thread renews while the job runs; jobs whose lease expired (their
+    process or thread died) are put back in the queue by the next claim and
+    resume after the last chunk they stored, up to INGEST_MAX_ATTEMPTS
+    claims, after which they are marked failed.
+    """
+    def __init__(self, process_fn, db_path=None, workers=None, max_depth=None, poll_interval=None,
+                 lease_seconds=None, max_attempts=None):
+        # process_fn(file_path, user_id, material_id, progress=callback, resume=bool) -> result dict
+        self.process_fn = process_fn
+        self.db_path = db_path or os.getenv(
+            "INGEST_JOB_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'ingest_jobs.db')
+        )
+        self.workers = int(workers or os.getenv("INGEST_WORKERS", "2"))
+        self.max_depth = int(max_depth or os.getenv("INGEST_QUEUE_MAX_DEPTH", "100"))
+        self.poll_interval = float(poll_interval or os.getenv("INGEST_POLL_INTERVAL", "2.0"))
+        self.lease_seconds = float(lease_seconds or os.getenv("INGEST_LEASE_SECONDS", "60"))
+        # A document that keeps killing its worker (e.g. a PDF that crashes the parser) is not retried forever
+        self.max_attempts = max(1, int(max_attempts or os.getenv("INGEST_MAX_ATTEMPTS", "3")))
+        self._claims = {}  # {job_id: claim token} for jobs running in this process
+        self._claims_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._local = threading.local()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._init_db()
+
+    def submit(self, file_path, user_id, material_id):
+        """Queue a document for ingest and return the new job"""
+        self.start()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            depth = conn.execute("SELECT COUNT(*) FROM ingest_jobs WHERE status = 'queued'").fetchone()[0]
+            if depth >= self.max_depth:
+                raise QueueFullError(f"Ingest queue is full ({depth} jobs waiting)")
+            conn.execute(
+                """INSERT INTO ingest_jobs (id, status, file_path, user_id, material_id, created_at, updated_at)
+                   VALUES (?, 'queued', ?, ?, ?, ?, ?)""",
+                (job_id, file_path, user_id, material_id, now, now)
+            )
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Return a job's status and progress, or None if unknown"""
+        row = self._conn().execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['job_id'] = job.pop('id')
+        job.pop('claim_token', None)
+        return job
+
+    def stats(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status").fetchall()
+        counts = {status: count for status, count in rows}
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'completed': counts.get('completed', 0),
+            'failed': counts.get('failed', 0),
+            'workers': self.workers,
+            'max_depth': self.max_depth
+        }
+
+    def start(self):
+        """Start the worker threads and the lease heartbeat once per process"""
+        if self._threads and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._start_lock:
+            if self._threads and all(thread.is_alive() for thread in self._threads):
+                return
+            # Only dead threads are replaced; live ones keep their claims
+            alive = [thread for thread in self._threads if thread.is_alive()]
+            names = {thread.name for thread in alive}
+            started = [
+                threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+                for i in range(self.workers) if f"ingest-worker-{i}" not in names
+            ]
+            if "ingest-heartbeat" not in names:
+                started.append(threading.Thread(target=self._heartbeat, name="ingest-heartbeat", daemon=True))
+            for thread in started:
+                thread.start()
+            self._threads = alive + started
+            self._wakeup.set()
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception:
+                # e.g. "database is locked": keep the worker alive and try again
+                logger.exception("Could not claim an ingest job")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception:
+                # The lease is no longer renewed, so the job is retried elsewhere
+                logger.exception("Ingest job %s could not be recorded", job['id'])
+
+    def _heartbeat(self):
+        """Renew the leases of jobs running in this process"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._claims_lock:
+                claims = list(self._claims.items())
+            for job_id, token in claims:
+                try:
+                    self._update(job_id, token, lease_expires=time.time() + self.lease_seconds)
+                except Exception:
+                    logger.exception("Could not renew the lease of ingest job %s", job_id)
+
+    def _run(self, job):
+        job_id = job['id']
+        token = job['claim_token']
+        lock = threading.Lock()
+        counters = {field: 0 for field in PROGRESS_FIELDS}
+
+        def progress(**counts):
+            with lock:
+                for field, amount in counts.items():
+                    counters[field] += amount
+                self._update(job_id, token, **counters)
+
+        with self._claims_lock:
+            self._claims[job_id] = token
+        try:
+            try:
+                result = self.process_fn(
+                    job['file_path'], job['user_id'], job['material_id'],
+                    progress=progress, resume=job['attempts'] > 1
+                )
+                status = 'completed' if result.get('success') else 'failed'
+                self._update(job_id, token, status=status, result=json.dumps(result), error=result.get('error'))
+            except Exception as e:
+                self._update(job_id, token, status='failed', error=str(e))
+        finally:
+            with self._claims_lock:
+                self._claims.pop(job_id, None)
+
+    def _claim(self):
+        """Atomically mark the oldest queued job as running and return it"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs whose lease ran out lost their worker (crash, restart, dead thread)
+            conn.execute(
+                """UPDATE ingest_jobs SET status = 'failed', claim_token = NULL, updated_at = ?,
+                   error = 'Worker lost during ingest after ' || attempts || ' attempts'
+                   WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?) AND attempts >= ?""",
+                (now, now, self.max_attempts)
+            )
+            conn.execute(
+                """UPDATE ingest_jobs SET status = 'queued', claim_token = NULL, updated_at = ?
+                   WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)""",
+                (now, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM ingest_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """UPDATE ingest_jobs SET status = 'running', worker_pid = ?, claim_token = ?, lease_expires = ?,
+                   attempts = attempts + 1, pages_parsed = 0, chunks_split = 0, chunks_embedded = 0,
+                   chunks_stored = 0, updated_at = ? WHERE id = ?""",
+                (os.getpid(), token, now + self.lease_seconds, now, row['id'])
+            )
+        job = dict(row)
+        job['attempts'] += 1
+        job['claim_token'] = token
+        return job
+
+    def _update(self, job_id, token=None, **fields):
+        """Update a job; with token, only while that claim still owns it"""
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        query = f"UPDATE ingest_jobs SET {assignments} WHERE id = ?"
+        params = (*fields.values(), job_id)
+        if token is not None:
+            query += " AND claim_token = ?"
+            params += (token,)
+        conn = self._conn()
+        with conn:
+            conn.execute(query, params)
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections are not shareable by default
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            user_id TEXT,
+            material_id TEXT,
+            pages_parsed INTEGER NOT NULL DEFAULT 0,
+            chunks_split INTEGER NOT NULL DEFAULT 0,
+            chunks_embedded INTEGER NOT NULL DEFAULT 0,
+            chunks_stored INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker_pid INTEGER,
+            claim_token TEXT,
+            lease_expires REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, created_at)")
+        # Lease columns, added to databases created before claims expired
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(ingest_jobs)")}
+        for name, column_type in (('claim_token', 'TEXT'), ('lease_expires', 'REAL')):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {name} {column_type}")
+
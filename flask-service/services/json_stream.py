@@ -0,0 +1,109 @@
+import json
+import re
+
+# Commas left before a closing bracket, the most common LLM JSON slip
+TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+CLOSERS = {'{': '}', '[': ']'}
+
+
+class JSONArrayStream:
+    """Incrementally extract the objects of a JSON array from streamed LLM output
+
+    feed() takes text as it arrives and returns every object completed by it,
+    so callers can use items before generation ends. Anything before the first
+    '[' (code fences, preambles) is ignored. Each object is parsed on its own:
+    a malformed one is repaired when possible and otherwise skipped, leaving
+    the rest of the array intact. close() salvages an object cut off by the
+    end of the stream.
+    """
+    def __init__(self):
+        self.started = False  # seen the opening '['
+        self.finished = False  # seen the closing ']'
+        self.parsed = 0
+        self.skipped = 0
+        self._stack = []  # brackets open inside the current object
+        self._buffer = []  # characters of the current object
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        items = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.started:
+                self.started = char == '['
+                continue
+
+            if not self._stack:
+                # Between items: only an opening brace or the closing bracket matter
+                if char == '{':
+                    self._stack.append(char)
+                    self._buffer.append(char)
+                elif char == ']':
+                    # A bracket pair in a preamble ("[5 questions]") is not the array
+                    self.finished = bool(self.parsed or self.skipped)
+                    self.started = self.finished
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in CLOSERS:
+                self._stack.append(char)
+            elif char in '}]':
+                self._stack.pop()
+                if not self._stack:
+                    item = self._parse(''.join(self._buffer))
+                    self._buffer = []
+                    if item is not None:
+                        items.append(item)
+        return items
+
+    def close(self):
+        """Return the trailing object if the stream stopped mid-item and it can be closed"""
+        if not self._stack:
+            return []
+        text = ''.join(self._buffer)
+        if self._in_string:
+            text += '"'
+        text += ''.join(CLOSERS[bracket] for bracket in reversed(self._stack))
+        self._stack = []
+        self._buffer = []
+        self._in_string = self._escaped = False
+        item = self._parse(text)
+        return [item] if item is not None else []
+
+    def _parse(self, text):
+        # strict=False accepts raw newlines/tabs inside strings
+        for candidate in (text, TRAILING_COMMA.sub(r'\1', text)):
+            try:
+                item = json.loads(candidate, strict=False)
+            except ValueError:
+                continue
+            if isinstance(item, dict):
+                self.parsed += 1
+                return item
+        self.skipped += 1
+        return None
+
+
+def parse_json_array(content):
+    """Parse the objects of a JSON array in a complete completion, item by item
+
+    Raises ValueError when no object could be recovered.
+    """
+    parser = JSONArrayStream()
+    items = parser.feed(content) + parser.close()
+    if not items:
+        raise ValueError('No JSON objects found in response' if not parser.skipped
+                         else f'All {parser.skipped} JSON objects were malformed')
+    return items
@@ -0,0 +1,171 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from services.telemetry import stage
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i in is it its me my of on or
+should so that the their them then there these they this to was what when where which
+who why will with would you your explain tell about please give
+""".split())
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords; digits are kept so formula names survive"""
+    return [token for token in TOKEN_PATTERN.findall(text.casefold()) if token not in STOPWORDS]
+
+
+def term_frequencies(text):
+    """{term: count} stored with each chunk so indexes can be rebuilt without re-tokenizing"""
+    return dict(Counter(tokenize(text)))
+
+
+class BM25UserIndex:
+    """In-memory BM25 inverted index over one user's chunks"""
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.materials = []
+        self.lengths = []
+        self.postings = {}  # {term: ([rows], [term frequencies])}
+        self._arrays = {}  # {term: (rows array, tf array)}, rebuilt after adds
+        self._lengths = None
+        self._materials = None
+        self._lock = threading.Lock()
+        self.built_at = time.monotonic()
+
+    @property
+    def size(self):
+        return len(self.ids)
+
+    def add(self, ids, material_ids, term_counts):
+        with self._lock:
+            self._add(ids, material_ids, term_counts)
+
+    def _add(self, ids, material_ids, term_counts):
+        for chunk_id, material_id, counts in zip(ids, material_ids, term_counts):
+            row = len(self.ids)
+            self.ids.append(chunk_id)
+            self.materials.append(material_id)
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                rows, tfs = self.postings.setdefault(term, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+                self._arrays.pop(term, None)
+        self._lengths = None
+        self._materials = None
+
+    def search(self, terms, top_k=5, material_id=None):
+        """Return ([(chunk_id, score)] best first, confidence in [0, 1])
+
+        confidence is the idf-weighted share of query terms the best chunk
+        contains, scaled by how clearly it beats the runner-up.
+        """
+        terms = list(dict.fromkeys(terms))
+        with self._lock:
+            if not self.ids or not terms:
+                return [], 0.0
+            return self._search(terms, top_k, material_id)
+
+    def _search(self, terms, top_k, material_id):
+        if self._lengths is None:
+            self._lengths = np.asarray(self.lengths, dtype=np.float32)
+            self._materials = np.asarray(self.materials, dtype=object)
+        lengths = self._lengths
+        n = len(self.ids)
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+
+        scores = np.zeros(n, dtype=np.float32)
+        weights = {}
+        for term in terms:
+            posting = self._posting(term)
+            if posting is None:
+                weights[term] = math.log(1 + (n + 0.5) / 0.5)
+                continue
+            rows, tfs = posting
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            weights[term] = idf
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+
+        if material_id is not None:
+            scores[self._materials != material_id] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return [], 0.0
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        hits = [(self.ids[row], float(scores[row])) for row in candidates]
+
+        best = candidates[0]
+        matched = sum(weight for term, weight in weights.items() if self._contains(term, best))
+        coverage = matched / sum(weights.values())
+        margin = 1.0 if len(hits) == 1 else 1.0 - hits[1][1] / hits[0][1]
+        return hits, coverage * min(1.0, 0.5 + margin)
+
+    def _posting(self, term):
+        posting = self._arrays.get(term)
+        if posting is None and term in self.postings:
+            rows, tfs = self.postings[term]
+            posting = (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+            self._arrays[term] = posting
+        return posting
+
+    def _contains(self, term, row):
+        posting = self._posting(term)
+        return posting is not None and bool(np.any(posting[0] == row))
+
+
+class LexicalIndex:
+    """Per-user BM25 indexes, loaded from stored chunk term counts and kept in an LRU
+
+    Indexes older than ttl_seconds are rebuilt so chunks written by other
+    workers show up, the same way VectorCache entries expire.
+    """
+    def __init__(self, load_terms, max_users=None, ttl_seconds=None):
+        # load_terms(user_id) -> (ids, material_ids, [{term: tf}])
+        self.load_terms = load_terms
+        self.max_users = int(max_users if max_users is not None else os.getenv("LEXICAL_INDEX_MAX_USERS", "200"))
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else os.getenv("LEXICAL_INDEX_TTL_SECONDS", "600"))
+        self._indexes = OrderedDict()  # {user_id: BM25UserIndex}
+        self._lock = threading.Lock()
+
+    def search(self, query, user_id, material_id=None, use_all_materials=False, top_k=5):
+        """Return ([(chunk_id, bm25 score)] best first, confidence)"""
+        index = self._get_index(user_id)
+        scope = None if use_all_materials or not material_id else material_id
+        return index.search(tokenize(query), top_k, scope)
+
+    def add(self, user_id, material_id, ids, term_counts):
+        """New chunks were stored; extend the user's index if it is loaded"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                index.add(ids, [material_id] * len(ids), term_counts)
+
+    def _get_index(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and now - index.built_at <= self.ttl_seconds:
+                self._indexes.move_to_end(user_id)
+                return index
+        index = BM25UserIndex()
+        with stage('retrieval.load_terms'):
+            index.add(*self.load_terms(user_id))
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
@@ -0,0 +1,474 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from services.context_builder import TokenCounter
+from services.telemetry import REGISTRY, observe_stage
+
+logger = logging.getLogger(__name__)
+
+RETRIES = REGISTRY.counter(
+    'mentivio_llm_retries_total',
+    'Upstream Azure calls retried after a 429, 5xx or connection error',
+    ('client', 'reason')
+)
+COALESCED = REGISTRY.counter(
+    'mentivio_llm_coalesced_total',
+    'Calls answered by an identical call already in flight',
+    ('client',)
+)
+
+# OpenAI SDK and httpx errors for requests that never reached (or never came back from) Azure;
+# matched by name so this module does not import either client library
+CONNECTION_ERRORS = ('APIConnectionError', 'APITimeoutError', 'TransportError')
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def retry_reason(error):
+    """'429', '5xx' or 'connection' when error is worth retrying, else None"""
+    status = _status_code(error)
+    if status is not None:
+        if status == 429:
+            return '429'
+        if status >= 500 or status == 408:
+            return '5xx'
+        return None
+    if any(cls.__name__ in CONNECTION_ERRORS for cls in type(error).__mro__):
+        return 'connection'
+    return None
+
+
+def retry_after(error):
+    """Seconds Azure asked us to wait (retry-after-ms / retry-after headers), or None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                continue
+    return None
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, never shorter than Azure's retry-after"""
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None):
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("LLM_MAX_RETRIES", "4"))
+        self.base_delay = float(base_delay if base_delay is not None else os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+        self.max_delay = float(max_delay if max_delay is not None else os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+
+    def delay(self, attempt, error):
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        # Jitter spreads out the retries of requests that failed together
+        delay = random.uniform(backoff / 2, backoff)
+        requested = retry_after(error)
+        return max(delay, min(requested, 60.0)) if requested is not None else delay
+
+
+class RequestLimiter:
+    """Caps concurrent upstream calls and tokens per minute for one Azure deployment
+
+    Tokens are taken from a bucket refilled continuously at
+    tokens_per_minute; a call waits until its estimate fits, and the
+    estimate is corrected with the usage Azure reports. Both limits are
+    shared by sync callers and the asyncio entry point.
+    """
+    def __init__(self, max_concurrency=0, tokens_per_minute=0):
+        self.max_concurrency = int(max_concurrency)
+        self.tokens_per_minute = float(tokens_per_minute)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency > 0 else None
+        self._tokens = self.tokens_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waited = 0.0
+
+    @classmethod
+    def from_env(cls, name):
+        """Limiter configured by LLM_<NAME>_MAX_CONCURRENCY and LLM_<NAME>_TOKENS_PER_MINUTE (0 = unlimited)"""
+        prefix = f"LLM_{name.upper()}_"
+        defaults = {'chat': "16", 'embedding': "8"}
+        return cls(
+            max_concurrency=os.getenv(prefix + "MAX_CONCURRENCY", defaults.get(name, "16")),
+            tokens_per_minute=os.getenv(prefix + "TOKENS_PER_MINUTE", "0")
+        )
+
+    def _take_tokens(self, tokens):
+        """Take tokens from the bucket; returns 0, or the seconds to wait before trying again"""
+        if self.tokens_per_minute <= 0:
+            return 0.0
+        # A call larger than the whole budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            now = time.monotonic()
+            rate = self.tokens_per_minute / 60.0
+            self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / rate
+
+    def acquire(self, tokens):
+        started = time.monotonic()
+        wait = self._take_tokens(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._take_tokens(tokens)
+        if self._slots is not None:
+            self._slots.acquire()
+        self._acquired(time.monotonic() - started)
+
+    async def aacquire(self, tokens):
+        started = time.monotonic()
+        wait = self._take_tokens(tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._take_tokens(tokens)
+        # Poll rather than block: the slots are shared with worker threads
+        while self._slots is not None and not self._slots.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        self._acquired(time.monotonic() - started)
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def settle(self, estimated, actual):
+        """Correct the bucket once the real token count of a call is known"""
+        if self.tokens_per_minute <= 0 or actual is None:
+            return
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated - actual)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_concurrency': self.max_concurrency,
+                'tokens_per_minute': self.tokens_per_minute,
+                'tokens_available': round(self._tokens, 1) if self.tokens_per_minute > 0 else None,
+                'wait_seconds_total': round(self._waited, 3)
+            }
+
+    def _acquired(self, waited):
+        with self._lock:
+            self._in_flight += 1
+            self._waited += waited
+
+
+class _LeaderCancelled(Exception):
+    """The call a request was coalesced onto was cancelled; the request runs its own"""
+
+
+class Singleflight:
+    """Identical calls in flight at the same time share the first one's result"""
+    def __init__(self):
+        self._calls = {}  # {key: Future}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """(future, is_leader) for key; the leader must complete the future"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+def _message_text(message):
+    content = getattr(message, 'content', message)
+    return content if isinstance(content, str) else json.dumps(content, default=str)
+
+
+def _messages(input):
+    if isinstance(input, str):
+        return [input]
+    if hasattr(input, 'to_messages'):
+        return input.to_messages()
+    return list(input)
+
+
+def _usage_tokens(message):
+    usage = getattr(message, 'usage_metadata', None)
+    return usage.get('total_tokens') if usage else None
+
+
+class _LimitedClient:
+    """Shared call path: singleflight, then the limiter, then retries"""
+    def __init__(self, name, limiter, retry, singleflight, coalesce):
+        self.name = name
+        self.limiter = limiter if limiter is not None else RequestLimiter.from_env(name)
+        self.retry = retry or RetryPolicy()
+        self.singleflight = singleflight or Singleflight()
+        self.coalesce = coalesce if coalesce is not None else os.getenv("LLM_COALESCE_ENABLED", "true").lower() == 'true'
+        self.counter = TokenCounter()
+
+    def _key(self, *parts):
+        if not self.coalesce:
+            return None
+        return hashlib.sha256(json.dumps([self.name, *parts], default=str).encode('utf-8')).hexdigest()
+
+    def _run(self, call, tokens, key=None, usage=_usage_tokens):
+        if key is None:
+            return self._execute(call, tokens, usage)
+        future, leader = self.singleflight.join(key)
+        if not leader:
+            COALESCED.inc(client=self.name)
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                return self._run(call, tokens, key, usage)
+        try:
+            result = self._execute(call, tokens, usage)
+        except BaseException as e:
+            self.singleflight.finish(key, future, error=e)
+            raise
+        self.singleflight.finish(key, future, result)
+        return result
+
+    async def _arun(self, call, tokens, key=None, usage=_usage_tokens):
+        if key is None:
+            return await self._aexecute(call, tokens, usage)
+        future, leader = self.singleflight.join(key)
+        if not leader:
+            COALESCED.inc(client=self.name)
+            try:
+                # Shielded so a cancelled follower does not cancel the call everyone else shares
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                return await self._arun(call, tokens, key, usage)
+        try:
+            result = await self._aexecute(call, tokens, usage)
+        except asyncio.CancelledError:
+            # The leader's client went away; callers sharing its call must not fail with it
+            self.singleflight.finish(key, future, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self.singleflight.finish(key, future, error=e)
+            raise
+        self.singleflight.finish(key, future, result)
+        return result
+
+    def _execute(self, call, tokens, usage):
+        for attempt in itertools.count():
+            self._acquire(tokens)
+            try:
+                result = call()
+            except Exception as e:
+                self.limiter.settle(tokens, 0)
+                delay = self._retry_delay(attempt, e)
+            else:
+                self.limiter.settle(tokens, usage(result))
+                return result
+            finally:
+                self.limiter.release()
+            time.sleep(delay)
+
+    async def _aexecute(self, call, tokens, usage):
+        for attempt in itertools.count():
+            await self._aacquire(tokens)
+            try:
+                result = await call()
+            except Exception as e:
+                self.limiter.settle(tokens, 0)
+                delay = self._retry_delay(attempt, e)
+            else:
+                self.limiter.settle(tokens, usage(result))
+                return result
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
+
+    def _acquire(self, tokens):
+        started = time.perf_counter()
+        self.limiter.acquire(tokens)
+        observe_stage(f"{self.name}.limiter_wait", time.perf_counter() - started)
+
+    async def _aacquire(self, tokens):
+        started = time.perf_counter()
+        await self.limiter.aacquire(tokens)
+        observe_stage(f"{self.name}.limiter_wait", time.perf_counter() - started)
+
+    def _retry_delay(self, attempt, error):
+        """Backoff before the next attempt; re-raises error when it should not be retried"""
+        reason = retry_reason(error)
+        if reason is None or attempt >= self.retry.max_retries:
+            raise error
+        delay = self.retry.delay(attempt, error)
+        RETRIES.inc(client=self.name, reason=reason)
+        logger.warning("Azure %s call failed (%s), retry %d/%d in %.2fs: %s",
+                       self.name, reason, attempt + 1, self.retry.max_retries, delay, error)
+        return delay
+
+
+class RateLimitedChatModel(_LimitedClient):
+    """Chat model wrapper used by every service: invoke/stream/ainvoke/astream/bind
+
+    Calls share the deployment's concurrency and tokens-per-minute budget and
+    are retried on 429/5xx with jittered backoff. Identical invoke/ainvoke
+    calls in flight at the same time (same messages and bound parameters)
+    make one upstream request. Streams are limited and retried until their
+    first chunk arrives, but not coalesced.
+    """
+    def __init__(self, llm, limiter=None, retry=None, singleflight=None, coalesce=None, bound=None):
+        super().__init__('chat', limiter, retry, singleflight, coalesce)
+        self.llm = llm
+        self.bound = bound or {}
+        # Azure counts the completion budget against TPM up front
+        self.completion_tokens = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1000"))
+
+    def bind(self, **kwargs):
+        return RateLimitedChatModel(
+            self.llm.bind(**kwargs), self.limiter, self.retry, self.singleflight, self.coalesce,
+            {**self.bound, **kwargs}
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        messages = _messages(input)
+        return self._run(
+            lambda: self.llm.invoke(input, **self._options(config, kwargs)),
+            self._estimate(messages),
+            self._call_key(messages, kwargs)
+        )
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        messages = _messages(input)
+        return await self._arun(
+            lambda: self.llm.ainvoke(input, **self._options(config, kwargs)),
+            self._estimate(messages),
+            self._call_key(messages, kwargs)
+        )
+
+    def stream(self, input, config=None, **kwargs):
+        tokens = self._estimate(_messages(input))
+        for attempt in itertools.count():
+            self._acquire(tokens)
+            upstream = None
+            started = False
+            used = None
+            try:
+                upstream = self.llm.stream(input, **self._options(config, kwargs))
+                for chunk in upstream:
+                    started = True
+                    used = _usage_tokens(chunk) or used
+                    yield chunk
+                self.limiter.settle(tokens, used)
+                return
+            except Exception as e:
+                self.limiter.settle(tokens, used or 0)
+                if started:
+                    raise
+                delay = self._retry_delay(attempt, e)
+            finally:
+                if upstream is not None and hasattr(upstream, 'close'):
+                    upstream.close()
+                self.limiter.release()
+            time.sleep(delay)
+
+    async def astream(self, input, config=None, **kwargs):
+        tokens = self._estimate(_messages(input))
+        for attempt in itertools.count():
+            await self._aacquire(tokens)
+            upstream = None
+            started = False
+            used = None
+            try:
+                upstream = self.llm.astream(input, **self._options(config, kwargs))
+                async for chunk in upstream:
+                    started = True
+                    used = _usage_tokens(chunk) or used
+                    yield chunk
+                self.limiter.settle(tokens, used)
+                return
+            except Exception as e:
+                self.limiter.settle(tokens, used or 0)
+                if started:
+                    raise
+                delay = self._retry_delay(attempt, e)
+            finally:
+                if upstream is not None and hasattr(upstream, 'aclose'):
+                    await upstream.aclose()
+                self.limiter.release()
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _options(config, kwargs):
+        return {**kwargs, 'config': config} if config is not None else kwargs
+
+    def _estimate(self, messages):
+        return sum(self.counter.count(_message_text(message)) for message in messages) + self.completion_tokens
+
+    def _call_key(self, messages, kwargs):
+        return self._key(
+            sorted(self.bound.items()), sorted(kwargs.items()),
+            [(getattr(message, 'type', 'text'), _message_text(message)) for message in messages]
+        )
+
+
+class RateLimitedEmbeddings(_LimitedClient):
+    """Embeddings wrapper with the same budgets and retries as RateLimitedChatModel
+
+    Identical query embeddings requested at the same time are coalesced;
+    document batches (ingest) are not.
+    """
+    def __init__(self, embeddings, limiter=None, retry=None, singleflight=None, coalesce=None):
+        super().__init__('embedding', limiter, retry, singleflight, coalesce)
+        self.embeddings = embeddings
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
+    def embed_documents(self, texts):
+        return self._run(lambda: self.embeddings.embed_documents(texts), self._estimate(texts), usage=self._no_usage)
+
+    def embed_query(self, text):
+        return self._run(
+            lambda: self.embeddings.embed_query(text), self._estimate([text]), self._key('query', text), self._no_usage
+        )
+
+    async def aembed_documents(self, texts):
+        return await self._arun(lambda: self.embeddings.aembed_documents(texts), self._estimate(texts), usage=self._no_usage)
+
+    async def aembed_query(self, text):
+        return await self._arun(
+            lambda: self.embeddings.aembed_query(text), self._estimate([text]), self._key('query', text), self._no_usage
+        )
+
+    def _estimate(self, texts):
+        return sum(self.counter.count(text) for text in texts)
+
+    @staticmethod
+    def _no_usage(result):
+        # Embedding responses carry no usage through LangChain; the estimate stands
+        return None
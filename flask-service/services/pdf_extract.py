@@ -0,0 +1,157 @@
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Worker-process cache of the last opened PDF, reused by consecutive page ranges
+_reader = None
+_reader_key = None
+
+
+def _open_reader(file_path):
+    from pypdf import PdfReader
+
+    global _reader, _reader_key
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if _reader_key != key:
+        _reader = PdfReader(file_path)
+        _reader_key = key
+    return _reader
+
+
+def extract_pages(file_path, start, end):
+    """[text] of pages [start, end), extracted the way PyPDFLoader does; runs in a worker process"""
+    reader = _open_reader(file_path)
+    return [reader.pages[number].extract_text() for number in range(start, end)]
+
+
+def _document_info(reader):
+    """PDF document info (author, title, creationdate, ...) keyed the way PyPDFLoader reports it"""
+    info = {'producer': 'PyPDF', 'creator': 'PyPDF', 'creationdate': ''}
+    try:
+        metadata = dict(reader.metadata or {})
+    except Exception as e:
+        logger.warning("Could not read PDF document info: %s", e)
+        return info
+    for key, value in metadata.items():
+        if not isinstance(value, (str, int)):
+            value = str(value)
+        key = key.lstrip('/').lower()
+        if key in ('creationdate', 'moddate'):
+            # PDF dates look like D:20240131120000+01'00'
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        info[key] = value
+    return info
+
+
+def _mp_context():
+    # Forking a threaded server process can deadlock the child, so workers start clean
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class ParallelPDFLoader:
+    """Drop-in for PyPDFLoader.lazy_load that extracts page ranges in a process pool
+
+    Pages are yielded in document order with PyPDFLoader's metadata (the
+    document info fields plus source, total_pages, page and page_label) while
+    later ranges are still being extracted; at most two ranges per worker
+    are in flight, so memory stays bounded on long books.
+    """
+    def __init__(self, file_path, extractor, reader):
+        self.file_path = file_path
+        self.extractor = extractor
+        self.reader = reader
+
+    def lazy_load(self):
+        total_pages = len(self.reader.pages)
+        info = _document_info(self.reader)
+        try:
+            labels = list(self.reader.page_labels)
+        except Exception:
+            labels = []
+        step = self.extractor.pages_per_task
+        ranges = deque((start, min(start + step, total_pages)) for start in range(0, total_pages, step))
+        pool = self.extractor.get_pool()
+        pending = deque()
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < self.extractor.workers * 2:
+                    start, end = ranges.popleft()
+                    pending.append((start, pool.submit(extract_pages, self.file_path, start, end)))
+                start, future = pending.popleft()
+                for offset, text in enumerate(future.result()):
+                    number = start + offset
+                    yield Document(page_content=text, metadata={
+                        **info,
+                        'source': self.file_path,
+                        'total_pages': total_pages,
+                        'page': number,
+                        'page_label': labels[number] if number < len(labels) else str(number + 1)
+                    })
+        finally:
+            # Stop extracting pages nobody will read (failed or cancelled ingest)
+            for _, future in pending:
+                future.cancel()
+
+
+class PDFExtractor:
+    """Chooses between PyPDFLoader and ParallelPDFLoader and owns the worker pool
+
+    PDF_EXTRACT_WORKERS processes (0 or 1 disables the pool) extract
+    PDF_EXTRACT_PAGES_PER_TASK pages per task. PDFs with fewer than
+    PDF_EXTRACT_MIN_PAGES pages are read in-process, where starting
+    workers would cost more than it saves.
+    """
+    def __init__(self, workers=None, pages_per_task=None, min_pages=None):
+        self.workers = int(workers if workers is not None else os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.pages_per_task = max(1, int(pages_per_task if pages_per_task is not None else os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "8")))
+        self.min_pages = int(min_pages if min_pages is not None else os.getenv("PDF_EXTRACT_MIN_PAGES", "16"))
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 1
+
+    def loader(self, file_path):
+        """ParallelPDFLoader for long PDFs when enabled, else None (use PyPDFLoader)"""
+        if not self.enabled:
+            return None
+        try:
+            from pypdf import PdfReader
+            reader = PdfReader(file_path)
+            pages = len(reader.pages)
+        except Exception as e:
+            # Let PyPDFLoader report unreadable or encrypted files as before
+            logger.warning("Parallel PDF extraction unavailable for %s: %s", file_path, e)
+            return None
+        if pages < self.min_pages:
+            return None
+        return ParallelPDFLoader(file_path, self, reader)
+
+    def get_pool(self):
+        with self._lock:
+            # Pools do not survive fork(); a child server process starts its own
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
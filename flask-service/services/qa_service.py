@@ -1,60 +1,43 @@
 from langchain_openai import AzureChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langchain_core.messages import HumanMessage, SystemMessage
+from services.answer_cache import AnswerCache
+from services.context_builder import ContextBuilder
+from services.conversation_memory import ConversationMemory
 from services.document_processor import DocumentProcessor
+from services.llm_client import RateLimitedChatModel
+from services.telemetry import atimed_stream, record_llm_usage, stage, timed_stream
+import asyncio
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Iterator, Optional
 
 load_dotenv()
 
-class ConversationMemory:
-    """Manages conversation history per user"""
-    def __init__(self):
-        self.conversations = {}  # {user_id: [messages]}
-        self.max_history = 10  # Keep last 10 exchanges
-    
-    def add_message(self, user_id: str, role: str, content: str):
-        """Add a message to user's conversation history"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
-        
-        if role == "user":
-            self.conversations[user_id].append(HumanMessage(content=content))
-        elif role == "assistant":
-            self.conversations[user_id].append(AIMessage(content=content))
-        
-        # Keep only recent history
-        if len(self.conversations[user_id]) > self.max_history * 2:
-            self.conversations[user_id] = self.conversations[user_id][-self.max_history * 2:]
-    
-    def get_history(self, user_id: str) -> List:
-        """Get user's conversation history"""
-        return self.conversations.get(user_id, [])
-    
-    def clear_history(self, user_id: str):
-        """Clear user's conversation history"""
-        if user_id in self.conversations:
-            self.conversations[user_id] = []
-
-
 class QAService:
-    def __init__(self):
-        # Initialize Azure OpenAI LLM
-        self.llm = AzureChatOpenAI(
+    def __init__(self, doc_processor=None, llm=None, answer_cache=None, memory=None, context_builder=None):
+        # Initialize Azure OpenAI LLM unless a shared client is given
+        self.llm = llm or RateLimitedChatModel(AzureChatOpenAI(
             azure_endpoint=os.getenv("AZURE_OPENAI_API_BASE"),
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
             azure_deployment=os.getenv("AZURE_OPENAI_API_NAME"),
             model_name="gpt-4o",
-            temperature=0.7
-        )
+            temperature=0.7,
+            max_retries=0
+        ))
         
         # Initialize document processor for retrieval
-        self.doc_processor = DocumentProcessor()
+        self.doc_processor = doc_processor or DocumentProcessor()
         
         # Initialize conversation memory
-        self.memory = ConversationMemory()
+        self.memory = memory or ConversationMemory()
+        
+        # Document-grounded answers shared across students asking the same thing
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache()
+        
+        # Packs retrieved chunks into the prompt within a token budget
+        self.context_builder = context_builder or ContextBuilder()
     
     def _is_general_query(self, question: str) -> bool:
         """Detect if query is general conversation (greetings, personal info, etc.)"""
@@ -79,19 +62,167 @@ class QAService:
                        use_all_materials: bool = False) -> Dict:
         """Answer questions with intelligent context usage and conversation memory"""
         try:
-            # Get conversation history
-            conversation_history = self.memory.get_history(user_id)
-            
-            # Determine if we should use document context
-            is_general = self._is_general_query(question)
-            needs_context = self._requires_course_context(question)
-            
-            # MODE 1: General conversation or "use_all_materials" mode
-            # In "use_all_materials" mode, use LLM's general knowledge
-            if is_general or use_all_materials:
-                messages = [
-                    SystemMessage(content="""You are a friendly and knowledgeable AI tutor assistant.
-                    
+            plan = self._plan_answer(question, user_id, material_id, use_all_materials)
+            if plan['cached_result']:
+                return self._serve_cached(plan, question, user_id)
+            
+            # Generate response
+            with stage('qa.llm'):
+                response = self.llm.invoke(plan['messages'])
+            record_llm_usage('qa', response)
+            return self._finish_answer(plan, question, user_id, response.content)
+            
+        except Exception as e:
+            return {
+                'answer': f"I encountered an error: {str(e)}. Please try again.",
+                'sources': [],
+                'mode': 'error',
+                'cached': False
+            }
+    
+    def stream_answer(self, question: str, user_id: str, material_id: Optional[str] = None,
+                      use_all_materials: bool = False) -> Iterator[Dict]:
+        """Answer a question as a stream of events: sources, then tokens, then done
+        
+        Conversation memory is only updated once the whole answer has streamed;
+        if the consumer stops iterating (client disconnected) the upstream
+        completion is closed and nothing is stored.
+        """
+        try:
+            plan = self._plan_answer(question, user_id, material_id, use_all_materials)
+            yield {'event': 'sources', 'sources': plan['sources'], 'mode': plan['mode']}
+            
+            if plan['cached_result']:
+                result = self._serve_cached(plan, question, user_id)
+                yield {'event': 'token', 'content': result['answer']}
+                yield {'event': 'done', **result}
+                return
+            
+            if plan['answer_prefix']:
+                yield {'event': 'token', 'content': plan['answer_prefix']}
+            parts = []
+            for chunk in timed_stream('qa', self.llm.stream(plan['messages'])):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {'event': 'token', 'content': chunk.content}
+            
+            yield {'event': 'done', **self._finish_answer(plan, question, user_id, ''.join(parts))}
+            
+        except Exception as e:
+            yield {'event': 'error', 'error': str(e)}
+    
+    async def aanswer_question(self, question: str, user_id: str, material_id: Optional[str] = None,
+                               use_all_materials: bool = False) -> Dict:
+        """Async variant of answer_question: the event loop is free while Azure responds"""
+        try:
+            plan = await self._aplan_answer(question, user_id, material_id, use_all_materials)
+            if plan['cached_result']:
+                return self._serve_cached(plan, question, user_id)
+            
+            with stage('qa.llm'):
+                response = await self.llm.ainvoke(plan['messages'])
+            record_llm_usage('qa', response)
+            return self._finish_answer(plan, question, user_id, response.content)
+            
+        except Exception as e:
+            return {
+                'answer': f"I encountered an error: {str(e)}. Please try again.",
+                'sources': [],
+                'mode': 'error',
+                'cached': False
+            }
+    
+    async def astream_answer(self, question: str, user_id: str, material_id: Optional[str] = None,
+                             use_all_materials: bool = False) -> AsyncIterator[Dict]:
+        """Async variant of stream_answer; cancelling the consumer closes the upstream stream"""
+        try:
+            plan = await self._aplan_answer(question, user_id, material_id, use_all_materials)
+            yield {'event': 'sources', 'sources': plan['sources'], 'mode': plan['mode']}
+            
+            if plan['cached_result']:
+                result = self._serve_cached(plan, question, user_id)
+                yield {'event': 'token', 'content': result['answer']}
+                yield {'event': 'done', **result}
+                return
+            
+            if plan['answer_prefix']:
+                yield {'event': 'token', 'content': plan['answer_prefix']}
+            parts = []
+            async for chunk in atimed_stream('qa', self.llm.astream(plan['messages'])):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {'event': 'token', 'content': chunk.content}
+            
+            yield {'event': 'done', **self._finish_answer(plan, question, user_id, ''.join(parts))}
+            
+        except Exception as e:
+            yield {'event': 'error', 'error': str(e)}
+    
+    def _plan_answer(self, question: str, user_id: str, material_id: Optional[str],
+                     use_all_materials: bool) -> Dict:
+        """Pick the answer mode and build its prompt (or find a cached answer)"""
+        conversation_history = self.memory.get_history(user_id)
+        plan = self._plan_without_documents(question, conversation_history, use_all_materials)
+        if plan['mode']:
+            return plan
+        
+        # MODE 2: Document-based Q&A (default mode with uploaded materials)
+        # Retrieve relevant chunks
+        relevant_chunks = self.doc_processor.get_relevant_chunks(
+            question,
+            user_id,
+            material_id,
+            use_all_materials=False,  # Only use specific materials
+            top_k=5
+        )
+        # Retrieval just embedded the question (unless it answered lexically), so this is a cache hit
+        question_vector = None
+        if relevant_chunks and relevant_chunks[0].get('retrieval') != 'lexical' and self.answer_cache.enabled:
+            question_vector = self.doc_processor.embeddings.embed_query(question)
+        return self._plan_with_documents(plan, question, conversation_history, relevant_chunks, question_vector)
+    
+    async def _aplan_answer(self, question: str, user_id: str, material_id: Optional[str],
+                            use_all_materials: bool) -> Dict:
+        # History may be reloaded from a persistent backend, so read it off the event loop
+        conversation_history = await asyncio.to_thread(self.memory.get_history, user_id)
+        plan = self._plan_without_documents(question, conversation_history, use_all_materials)
+        if plan['mode']:
+            return plan
+        
+        relevant_chunks = await self.doc_processor.aget_relevant_chunks(
+            question,
+            user_id,
+            material_id,
+            use_all_materials=False,
+            top_k=5
+        )
+        question_vector = None
+        if relevant_chunks and relevant_chunks[0].get('retrieval') != 'lexical' and self.answer_cache.enabled:
+            question_vector = await self.doc_processor.embeddings.aembed_query(question)
+        return self._plan_with_documents(plan, question, conversation_history, relevant_chunks, question_vector)
+    
+    def _plan_without_documents(self, question: str, conversation_history: List,
+                                use_all_materials: bool) -> Dict:
+        """Plan for general / knowledge-base questions; mode stays None when documents are needed"""
+        plan = {
+            'messages': [],
+            'sources': [],
+            'mode': None,
+            'answer_prefix': '',
+            'cache_scope': None,
+            'question_vector': None,
+            'cached_result': None
+        }
+        
+        # Determine if we should use document context
+        is_general = self._is_general_query(question)
+        
+        # MODE 1: General conversation or "use_all_materials" mode
+        # In "use_all_materials" mode, use LLM's general knowledge
+        if is_general or use_all_materials:
+            messages = [
+                SystemMessage(content="""You are a friendly and knowledgeable AI tutor assistant.
+                
 Your role:
 - Engage in natural conversation with students
 - Remember information shared with you in the conversation
@@ -100,120 +231,118 @@ Your role:
 - When students share personal information (like their name), acknowledge and remember it
 
 Keep responses professional but friendly. Don't be overly verbose.""")
-                ]
-                
-                # Add conversation history for context
-                messages.extend(conversation_history[-6:])  # Last 3 exchanges
-                
-                # Add current question
-                messages.append(HumanMessage(content=question))
-                
-                # Generate response
-                response = self.llm.invoke(messages)
-                
-                # Store in memory
-                self.memory.add_message(user_id, "user", question)
-                self.memory.add_message(user_id, "assistant", response.content)
-                
-                return {
-                    'answer': response.content,
-                    'sources': [],
-                    'mode': 'general' if is_general else 'knowledge_base'
-                }
+            ]
             
-            # MODE 2: Document-based Q&A (default mode with uploaded materials)
-            else:
-                # Retrieve relevant chunks
-                relevant_chunks = self.doc_processor.get_relevant_chunks(
-                    question,
-                    user_id,
-                    material_id,
-                    use_all_materials=False,  # Only use specific materials
-                    top_k=5
-                )
+            # Add conversation history for context
+            messages.extend(conversation_history[-6:])  # Last 3 exchanges
+            
+            # Add current question
+            messages.append(HumanMessage(content=question))
+            
+            plan.update(messages=messages, mode='general' if is_general else 'knowledge_base')
+        return plan
+    
+    def _plan_with_documents(self, plan: Dict, question: str, conversation_history: List,
+                             relevant_chunks: List[Dict], question_vector=None) -> Dict:
+        """Build the document-grounded prompt (or the no-materials fallback) from retrieved chunks"""
+        if not relevant_chunks:
+            # Fallback to general knowledge with a note
+            messages = [
+                SystemMessage(content="""You are a knowledgeable AI tutor.
                 
-                if not relevant_chunks:
-                    # Fallback to general knowledge with a note
-                    messages = [
-                        SystemMessage(content="""You are a knowledgeable AI tutor.
-                        
 The student has asked a question, but no relevant information was found in their uploaded materials.
 Provide a helpful answer using your general knowledge, but mention that this isn't from their specific materials.""")
-                    ]
-                    
-                    messages.extend(conversation_history[-4:])  # Last 2 exchanges
-                    messages.append(HumanMessage(content=question))
-                    
-                    response = self.llm.invoke(messages)
-                    
-                    self.memory.add_message(user_id, "user", question)
-                    self.memory.add_message(user_id, "assistant", response.content)
-                    
-                    return {
-                        'answer': f"I couldn't find this specific information in your uploaded materials. Based on general knowledge: {response.content}",
-                        'sources': [],
-                        'mode': 'fallback'
-                    }
-                
-                # Prepare context from chunks
-                context = "\n\n".join([chunk['content'] for chunk in relevant_chunks])
-                
-                # Check relevance of top chunk
-                top_similarity = relevant_chunks[0].get('similarity', 0)
-                
-                # If similarity is low, blend with general knowledge
-                if top_similarity < 0.3:
-                    system_prompt = """You are an expert AI tutor.
-                    
+            ]
+            
+            messages.extend(conversation_history[-4:])  # Last 2 exchanges
+            messages.append(HumanMessage(content=question))
+            
+            plan.update(
+                messages=messages,
+                mode='fallback',
+                answer_prefix="I couldn't find this specific information in your uploaded materials. Based on general knowledge: "
+            )
+            return plan
+        
+        plan.update(
+            mode='document_based',
+            sources=[
+                {
+                    'content': chunk['content'][:200] + '...' if len(chunk['content']) > 200 else chunk['content'],
+                    'similarity': chunk['similarity']
+                }
+                for chunk in relevant_chunks[:3]
+            ]
+        )
+        
+        # Serve a cached answer grounded on the same chunks (and history) if one exists
+        recent_history = conversation_history[-4:]  # Last 2 exchanges
+        if self.answer_cache.enabled:
+            plan['cache_scope'] = AnswerCache.make_scope('document_based', relevant_chunks, recent_history)
+            plan['question_vector'] = question_vector
+            plan['cached_result'] = self.answer_cache.get(plan['cache_scope'], question, plan['question_vector'])
+            if plan['cached_result']:
+                return plan
+        
+        # Prepare context from chunks
+        context, _ = self.context_builder.build(relevant_chunks)
+        
+        # Check relevance of top chunk
+        top_similarity = relevant_chunks[0].get('similarity', 0)
+        
+        # If similarity is low, blend with general knowledge
+        if top_similarity < 0.3:
+            system_prompt = """You are an expert AI tutor.
+            
 Provide a clear, concise answer to the student's question. Use the provided context if relevant, but feel free to supplement with general knowledge to give a complete answer.
 
 Be natural - don't constantly reference "the context" or "the materials". Just answer the question professionally."""
-                else:
-                    system_prompt = """You are an expert AI tutor helping students learn from their study materials.
-                    
+        else:
+            system_prompt = """You are an expert AI tutor helping students learn from their study materials.
+            
 Provide a clear, concise answer based on the context provided. Be direct and professional.
 
 - Answer the question naturally without constantly saying "according to the context"
 - Only mention the source if directly asked or when it adds value
 - Be concise but thorough
 - If context is insufficient, say so briefly and provide general guidance"""
-                
-                messages = [SystemMessage(content=system_prompt)]
-                
-                # Add recent conversation history for continuity
-                messages.extend(conversation_history[-4:])  # Last 2 exchanges
-                
-                # Add current question with context
-                messages.append(HumanMessage(content=f"""Context from study materials:
+        
+        messages = [SystemMessage(content=system_prompt)]
+        
+        # Add recent conversation history for continuity
+        messages.extend(recent_history)
+        
+        # Add current question with context
+        messages.append(HumanMessage(content=f"""Context from study materials:
 {context}
 
 Question: {question}"""))
-                
-                # Generate answer
-                response = self.llm.invoke(messages)
-                
-                # Store in memory
-                self.memory.add_message(user_id, "user", question)
-                self.memory.add_message(user_id, "assistant", response.content)
-                
-                return {
-                    'answer': response.content,
-                    'sources': [
-                        {
-                            'content': chunk['content'][:200] + '...' if len(chunk['content']) > 200 else chunk['content'],
-                            'similarity': chunk['similarity']
-                        }
-                        for chunk in relevant_chunks[:3]
-                    ],
-                    'mode': 'document_based'
-                }
-            
-        except Exception as e:
-            return {
-                'answer': f"I encountered an error: {str(e)}. Please try again.",
-                'sources': [],
-                'mode': 'error'
-            }
+        
+        plan['messages'] = messages
+        return plan
+    
+    def _serve_cached(self, plan: Dict, question: str, user_id: str) -> Dict:
+        result, match = plan['cached_result']
+        self.memory.add_message(user_id, "user", question)
+        self.memory.add_message(user_id, "assistant", result['answer'])
+        result.update(cached=True, cache_match=match)
+        return result
+    
+    def _finish_answer(self, plan: Dict, question: str, user_id: str, content: str) -> Dict:
+        """Store the exchange in memory (and the answer cache) and build the response"""
+        # Store in memory
+        self.memory.add_message(user_id, "user", question)
+        self.memory.add_message(user_id, "assistant", content)
+        
+        result = {
+            'answer': plan['answer_prefix'] + content,
+            'sources': plan['sources'],
+            'mode': plan['mode'],
+            'cached': False
+        }
+        if plan['cache_scope']:
+            self.answer_cache.put(plan['cache_scope'], question, plan['question_vector'], result)
+        return result
     
     def clear_conversation(self, user_id: str):
         """Clear conversation history for a user"""
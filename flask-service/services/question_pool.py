@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+POOL_INDEX = [('user_id', 1), ('material_id', 1), ('kind', 1), ('difficulty', 1)]
+POOL_INDEX_NAME = 'user_material_kind_difficulty'
+
+QUIZ_DIFFICULTIES = ('easy', 'medium', 'hard')
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionPool:
+    """Pre-generated quiz questions (per difficulty) and flashcards per material
+
+    Items live one per document in a MongoDB collection. take() claims a
+    random sample and deletes it, so a student is not served the same item
+    twice, and schedules a background refill once a pool drops below
+    low_watermark. Generation and chunk sampling are passed in as callables:
+    generate(kind, chunks, count, difficulty, existing) -> [items] and
+    sample_chunks(user_id, material_id, count) -> [chunks].
+    """
+    def __init__(self, collection, generate, sample_chunks, quiz_size=None, flashcard_size=None,
+                 low_watermark=None, workers=None, claim_ttl=None):
+        self.collection = collection
+        self.generate = generate
+        self.sample_chunks = sample_chunks
+        self.quiz_size = int(quiz_size if quiz_size is not None else os.getenv("QUESTION_POOL_SIZE", "20"))
+        self.flashcard_size = int(flashcard_size if flashcard_size is not None else os.getenv("QUESTION_POOL_FLASHCARDS", "30"))
+        self.low_watermark = int(low_watermark if low_watermark is not None else os.getenv("QUESTION_POOL_LOW_WATERMARK", "10"))
+        # Claims older than this were left by a process that died mid-take and are released
+        self.claim_ttl = float(claim_ttl if claim_ttl is not None else os.getenv("QUESTION_POOL_CLAIM_TTL_SECONDS", "300"))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, int(workers or os.getenv("QUESTION_POOL_WORKERS", "1"))),
+            thread_name_prefix='question-pool'
+        )
+        self._pending = set()  # pools with a fill queued or running
+        self._lock = threading.Lock()
+        try:
+            self.collection.create_index(POOL_INDEX, name=POOL_INDEX_NAME)
+        except Exception as e:
+            logger.warning("Could not create question pool index: %s", e)
+
+    def pools(self):
+        """Every (kind, difficulty) pool kept per material"""
+        return [('quiz', difficulty) for difficulty in QUIZ_DIFFICULTIES] + [('flashcard', None)]
+
+    def schedule_fill(self, user_id, material_id, kind=None, difficulty=None):
+        """Fill a material's pools (or one pool) in the background; duplicate requests are dropped"""
+        targets = [(kind, difficulty)] if kind else self.pools()
+        for target_kind, target_difficulty in targets:
+            if not self._pooled(target_kind, target_difficulty):
+                logger.warning("No %s pool for difficulty %r", target_kind, target_difficulty)
+                continue
+            key = (user_id, material_id, target_kind, target_difficulty)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._executor.submit(self._fill_pending, key)
+
+    def fill(self, user_id, material_id, kind, difficulty=None):
+        """Top a pool up to its target size; returns the number of items added"""
+        scope = self._scope(user_id, material_id, kind, difficulty)
+        target = self.quiz_size if kind == 'quiz' else self.flashcard_size
+        existing = [doc['item'] for doc in self.collection.find(scope, {'item': 1})]
+        missing = target - len(existing)
+        if missing <= 0:
+            return 0
+        chunks = self.sample_chunks(user_id, material_id, max(10, missing))
+        if not chunks:
+            return 0
+        items = self.generate(kind, chunks, missing, difficulty, existing)
+        if items:
+            now = time.time()
+            self.collection.insert_many([{**scope, 'item': item, 'created_at': now} for item in items])
+        return len(items)
+
+    def take(self, user_id, material_id, kind, count, difficulty=None):
+        """Claim and remove count random items, or return None if the pool is short"""
+        if not self._pooled(kind, difficulty):
+            return None
+        scope = self._scope(user_id, material_id, kind, difficulty)
+        available = self.collection.count_documents(scope)
+        if available < count:
+            self.schedule_fill(user_id, material_id, kind, difficulty)
+            return None
+
+        # Claim the sampled ids first so concurrent requests never serve the same item
+        now = time.time()
+        unclaimed = {'$or': [{'claim': {'$exists': False}}, {'claimed_at': {'$lt': now - self.claim_ttl}}]}
+        sampled = [doc['_id'] for doc in self.collection.aggregate([
+            {'$match': {**scope, **unclaimed}},
+            {'$sample': {'size': count}},
+            {'$project': {'_id': 1}}
+        ])]
+        claim = uuid.uuid4().hex
+        self.collection.update_many(
+            {'_id': {'$in': sampled}, **unclaimed},
+            {'$set': {'claim': claim, 'claimed_at': now}}
+        )
+        items = [doc['item'] for doc in self.collection.find({'claim': claim}, {'item': 1})]
+        if len(items) < count:
+            # Lost a race for some items; leave the pool as it was
+            self.collection.update_many({'claim': claim}, {'$unset': {'claim': '', 'claimed_at': ''}})
+            return None
+        self.collection.delete_many({'claim': claim})
+
+        if available - count < self.low_watermark:
+            self.schedule_fill(user_id, material_id, kind, difficulty)
+        return items
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'pending_fills': pending, 'quiz_size': self.quiz_size, 'flashcard_size': self.flashcard_size}
+
+    def _fill_pending(self, key):
+        try:
+            self.fill(*key)
+        except Exception:
+            logger.exception("Error filling question pool %s", key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    @staticmethod
+    def _pooled(kind, difficulty):
+        """Only the QUIZ_DIFFICULTIES quiz pools exist; any other value would start a new pool"""
+        return kind != 'quiz' or difficulty is None or difficulty in QUIZ_DIFFICULTIES
+
+    def _scope(self, user_id, material_id, kind, difficulty):
+        scope = {'user_id': user_id, 'material_id': material_id, 'kind': kind}
+        if kind == 'quiz':
+            scope['difficulty'] = difficulty or 'medium'
+        return scope
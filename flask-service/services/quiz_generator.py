@@ -1,58 +1,428 @@
 from langchain_openai import AzureChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
+from services.context_builder import ContextBuilder
 from services.document_processor import DocumentProcessor
+from services.feedback_cache import FeedbackCache
+from services.json_stream import JSONArrayStream, parse_json_array
+from services.llm_client import RateLimitedChatModel
+from services.question_pool import QUIZ_DIFFICULTIES
+from services.telemetry import record_llm_usage, stage, timed_stream
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
 import os
-import json
+import math
+import queue
+import re
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Pools hold general questions about a material, so only these topics (or none) are served from them
+POOL_TOPIC = 'The key concepts covered in this material'
+GENERIC_TOPICS = {'', 'all', 'all topics', 'general', 'everything', 'overview', 'review', 'key concepts',
+                  POOL_TOPIC.casefold()}
+
+def group_chunks(chunks, groups):
+    """Split chunks into contiguous sub-contexts, ordered by material and position
+    
+    With fewer chunks than groups, chunks are shared between groups.
+    """
+    ordered = sorted(chunks, key=lambda chunk: (str(chunk.get('material_id')), chunk.get('chunk_index') or 0))
+    if len(ordered) < groups:
+        return [[ordered[i % len(ordered)]] for i in range(groups)]
+    size, extra = divmod(len(ordered), groups)
+    result = []
+    start = 0
+    for i in range(groups):
+        end = start + size + (1 if i < extra else 0)
+        result.append(ordered[start:end])
+        start = end
+    return result
+
+def _tokens(text):
+    return set(re.findall(r'\w+', str(text).lower()))
+
+def dedupe_items(items, text_field, threshold, seen=()):
+    """Drop items whose text_field is a near-duplicate (token Jaccard >= threshold) of an earlier one
+    
+    Items in seen count as earlier ones but are not returned.
+    """
+    kept = []
+    kept_tokens = [_tokens(item.get(text_field, '')) for item in seen]
+    for item in items:
+        tokens = _tokens(item.get(text_field, ''))
+        if _near_duplicate(tokens, kept_tokens, threshold):
+            continue
+        kept.append(item)
+        kept_tokens.append(tokens)
+    return kept
+
+def _near_duplicate(tokens, kept_tokens, threshold):
+    return any(
+        tokens and len(tokens & other) / len(tokens | other) >= threshold
+        for other in kept_tokens
+    )
+
+def _valid_question(item):
+    options = item.get('options') if isinstance(item, dict) else None
+    return (
+        isinstance(options, dict)
+        and bool(item.get('question'))
+        and item.get('correct_answer') in options
+    )
+
+def _valid_flashcard(item):
+    return isinstance(item, dict) and bool(item.get('front')) and bool(item.get('back'))
+
 class QuizGenerator:
-    def __init__(self):
-        # Initialize Azure OpenAI LLM
-        self.llm = AzureChatOpenAI(
+    def __init__(self, doc_processor=None, llm=None, question_pool=None, feedback_cache=None, context_builder=None):
+        # Initialize Azure OpenAI LLM unless a shared client is given
+        self.llm = llm or RateLimitedChatModel(AzureChatOpenAI(
             azure_endpoint=os.getenv("AZURE_OPENAI_API_BASE"),
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
             azure_deployment=os.getenv("AZURE_OPENAI_API_NAME"),
             model_name="gpt-4o",
-            temperature=0.7
-        )
+            temperature=0.7,
+            max_retries=0
+        ))
+        
+        self.doc_processor = doc_processor or DocumentProcessor()
         
-        self.doc_processor = DocumentProcessor()
+        # Packs each batch's chunks into its prompt within a token budget
+        self.context_builder = context_builder or ContextBuilder()
+        
+        # Fan-out: split big quizzes into parallel batches of fanout_batch_size items
+        self.fanout_enabled = os.getenv("QUIZ_FANOUT_ENABLED", "true").lower() == 'true'
+        self.fanout_batch_size = max(1, int(os.getenv("QUIZ_FANOUT_BATCH_SIZE", "3")))
+        self.fanout_workers = max(1, int(os.getenv("QUIZ_FANOUT_WORKERS", "4")))
+        # Extra items requested per batch to make up for dropped duplicates
+        self.fanout_surplus = max(0, int(os.getenv("QUIZ_FANOUT_SURPLUS", "1")))
+        self.fanout_retries = max(0, int(os.getenv("QUIZ_FANOUT_RETRIES", "1")))
+        # Token Jaccard similarity at which two questions count as duplicates
+        self.dedup_threshold = float(os.getenv("QUIZ_DEDUP_SIMILARITY", "0.7"))
+        
+        # Optional QuestionPool of items pre-generated per material
+        self.question_pool = question_pool
+        
+        # Evaluation feedback: shared per (topic, score band), generated off the request path
+        self.feedback_cache = feedback_cache if feedback_cache is not None else FeedbackCache()
+        # async returns cached feedback or a feedback_id to poll; sync (opt-in) waits on the LLM
+        self.feedback_mode = os.getenv("EVALUATION_FEEDBACK_MODE", "async").lower()
+        self._feedback_executor = ThreadPoolExecutor(
+            max_workers=max(1, int(os.getenv("FEEDBACK_WORKERS", "4"))),
+            thread_name_prefix='quiz-feedback'
+        )
+        self._feedback_pending = {}  # {feedback_id: Future}
+        self._feedback_lock = threading.Lock()
     
-    def generate_quiz(self, topic, user_id, material_id=None, num_questions=5, difficulty='medium', use_all_materials=False):
+    def generate_quiz(self, topic, user_id, material_id=None, num_questions=5, difficulty='medium', use_all_materials=False,
+                      from_pool=True):
         """Generate quiz questions from materials"""
         try:
-            # Retrieve relevant chunks
+            num_questions = int(num_questions)
+            if from_pool and self._can_use_pool(topic, material_id, use_all_materials, difficulty):
+                questions = self.question_pool.take(user_id, material_id, 'quiz', num_questions, difficulty)
+                if questions:
+                    return {
+                        'topic': topic,
+                        'difficulty': difficulty,
+                        'questions': questions,
+                        'pooled': True
+                    }
+            
+            # Retrieve relevant chunks (more when the quiz fans out over many sub-contexts)
             relevant_chunks = self.doc_processor.get_relevant_chunks(
                 topic,
                 user_id,
                 material_id,
                 use_all_materials,
-                top_k=10
+                top_k=max(10, 2 * self._batch_count(num_questions))
             )
             
             if not relevant_chunks:
                 return {'error': 'No relevant materials found for this topic'}
             
-            context = "\n\n".join([chunk['content'] for chunk in relevant_chunks])
+            questions, stats = self._fan_out(
+                relevant_chunks,
+                num_questions,
+                lambda context, count: self._quiz_messages(topic, context, count, difficulty),
+                _valid_question,
+                'question'
+            )
             
-            # Difficulty mapping
-            difficulty_instructions = {
-                'easy': 'Focus on basic concepts, definitions, and recall. Questions should be straightforward.',
-                'medium': 'Include application and understanding questions. Mix recall with analysis.',
-                'hard': 'Focus on analysis, synthesis, and application. Include complex scenarios.'
+            result = {
+                'topic': topic,
+                'difficulty': difficulty,
+                'questions': questions
             }
+            if not questions:
+                # Fallback if every batch failed to parse
+                result['error'] = 'Failed to parse quiz format'
+            elif stats['failed']:
+                result['warning'] = f"{stats['failed']} of {stats['batches']} question batches failed"
+            return result
+                
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def stream_quiz(self, topic, user_id, material_id=None, num_questions=5, difficulty='medium', use_all_materials=False,
+                    from_pool=True):
+        """Stream quiz questions as events: one 'question' per item as soon as it parses, then 'done'"""
+        try:
+            num_questions = int(num_questions)
+            if from_pool and self._can_use_pool(topic, material_id, use_all_materials, difficulty):
+                questions = self.question_pool.take(user_id, material_id, 'quiz', num_questions, difficulty)
+                if questions:
+                    for index, question in enumerate(questions):
+                        yield {'event': 'question', 'index': index, 'question': question}
+                    yield {'event': 'done', 'topic': topic, 'difficulty': difficulty, 'total': len(questions), 'pooled': True}
+                    return
             
-            prompt = ChatPromptTemplate.from_messages([
-                SystemMessage(content=f"""You are an expert quiz generator for educational purposes.
+            relevant_chunks = self.doc_processor.get_relevant_chunks(
+                topic,
+                user_id,
+                material_id,
+                use_all_materials,
+                top_k=max(10, 2 * self._batch_count(num_questions))
+            )
+            
+            if not relevant_chunks:
+                yield {'event': 'error', 'error': 'No relevant materials found for this topic'}
+                return
+            
+            stats = {}
+            total = 0
+            for question in self._stream_fan_out(
+                relevant_chunks,
+                num_questions,
+                lambda context, count: self._quiz_messages(topic, context, count, difficulty),
+                _valid_question,
+                'question',
+                stats
+            ):
+                yield {'event': 'question', 'index': total, 'question': question}
+                total += 1
+            
+            if not total:
+                yield {'event': 'error', 'error': 'Failed to parse quiz format'}
+                return
+            done = {'event': 'done', 'topic': topic, 'difficulty': difficulty, 'total': total, 'pooled': False}
+            if stats['failed']:
+                done['warning'] = f"{stats['failed']} of {stats['batches']} question batches failed"
+            yield done
+            
+        except Exception as e:
+            yield {'event': 'error', 'error': str(e)}
+    
+    def generate_flashcards(self, topic, user_id, material_id=None, num_cards=10, use_all_materials=False,
+                            from_pool=True):
+        """Generate flashcards from materials"""
+        try:
+            num_cards = int(num_cards)
+            if from_pool and self._can_use_pool(topic, material_id, use_all_materials):
+                flashcards = self.question_pool.take(user_id, material_id, 'flashcard', num_cards)
+                if flashcards:
+                    return {
+                        'topic': topic,
+                        'flashcards': flashcards,
+                        'pooled': True
+                    }
+            
+            relevant_chunks = self.doc_processor.get_relevant_chunks(
+                topic,
+                user_id,
+                material_id,
+                use_all_materials,
+                top_k=max(15, 2 * self._batch_count(num_cards))
+            )
+            
+            if not relevant_chunks:
+                return {'error': 'No relevant materials found for this topic'}
+            
+            flashcards, stats = self._fan_out(
+                relevant_chunks,
+                num_cards,
+                lambda context, count: self._flashcard_messages(topic, context, count),
+                _valid_flashcard,
+                'front'
+            )
+            
+            if not flashcards:
+                return {'error': 'Failed to parse flashcard format'}
+            result = {
+                'topic': topic,
+                'flashcards': flashcards
+            }
+            if stats['failed']:
+                result['warning'] = f"{stats['failed']} of {stats['batches']} flashcard batches failed"
+            return result
+                
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def generate_items(self, kind, chunks, count, difficulty=None, existing=()):
+        """Generate quiz questions or flashcards for a question pool from sampled chunks
+        
+        Items that near-duplicate one in existing are dropped.
+        """
+        topic = POOL_TOPIC
+        if kind == 'quiz':
+            build_messages = lambda context, n: self._quiz_messages(topic, context, n, difficulty or 'medium')
+            items, _ = self._fan_out(chunks, count, build_messages, _valid_question, 'question', existing)
+        else:
+            build_messages = lambda context, n: self._flashcard_messages(topic, context, n)
+            items, _ = self._fan_out(chunks, count, build_messages, _valid_flashcard, 'front', existing)
+        return items
+    
+    def _can_use_pool(self, topic, material_id, use_all_materials, difficulty=None):
+        """Pooled items fit a request for one material with no specific topic (and a pooled difficulty)"""
+        if self.question_pool is None or not material_id or use_all_materials:
+            return False
+        # Other difficulties are generated directly rather than opening a pool per value
+        if difficulty is not None and difficulty not in QUIZ_DIFFICULTIES:
+            return False
+        return ' '.join(str(topic or '').split()).casefold() in GENERIC_TOPICS
+    
+    def _batch_count(self, count):
+        if not self.fanout_enabled:
+            return 1
+        return max(1, math.ceil(count / self.fanout_batch_size))
+    
+    def _fan_out(self, chunks, count, build_messages, is_valid, text_field, existing=()):
+        """Generate count items as parallel batches over chunk sub-contexts
+        
+        Each batch asks for its share of the items (plus a small surplus when
+        there are several batches, to absorb duplicates) from its own group of
+        chunks. A batch whose call or JSON fails is retried on its own. Items
+        are merged in batch order, malformed ones dropped and near-duplicates
+        removed by token Jaccard similarity of text_field.
+        """
+        batches = self._batch_count(count)
+        groups = group_chunks(chunks, batches)
+        shares = [count // batches + (1 if i < count % batches else 0) for i in range(batches)]
+        surplus = self.fanout_surplus if batches > 1 else 0
+        
+        def run(group, share):
+            context, _ = self.context_builder.build(group)
+            messages = build_messages(context, share + surplus)
+            for attempt in range(self.fanout_retries + 1):
+                try:
+                    with stage('quiz.llm'):
+                        response = self.llm.invoke(messages)
+                    record_llm_usage('quiz', response)
+                    items = parse_json_array(response.content)
+                    return [item for item in items if is_valid(item)]
+                except Exception as e:
+                    logger.warning("Quiz batch attempt %d failed: %s", attempt + 1, e)
+            return None
+        
+        # Each batch runs in a copy of the caller's context so its stages count towards the request trace
+        contexts = [contextvars.copy_context() for _ in groups]
+        with ThreadPoolExecutor(max_workers=min(batches, self.fanout_workers)) as executor:
+            results = list(executor.map(lambda context, group, share: context.run(run, group, share),
+                                        contexts, groups, shares))
+        
+        merged = dedupe_items(
+            [item for items in results if items for item in items],
+            text_field,
+            self.dedup_threshold,
+            existing
+        )
+        return merged[:count], {'batches': batches, 'failed': sum(1 for items in results if items is None)}
+    
+    def _stream_fan_out(self, chunks, count, build_messages, is_valid, text_field, stats):
+        """Streaming counterpart of _fan_out: yields each item as soon as any batch completes it
+        
+        Batches stream concurrently and their items are deduplicated as they
+        arrive. A batch is retried only if it failed before producing an item.
+        Once count items are out (or the consumer stops) remaining streams are
+        abandoned. stats is filled with batch totals when iteration ends.
+        """
+        batches = self._batch_count(count)
+        groups = group_chunks(chunks, batches)
+        shares = [count // batches + (1 if i < count % batches else 0) for i in range(batches)]
+        surplus = self.fanout_surplus if batches > 1 else 0
+        events = queue.Queue()
+        stop = threading.Event()
+        stats.update(batches=batches, failed=0)
+        
+        def run(group, share):
+            context, _ = self.context_builder.build(group)
+            messages = build_messages(context, share + surplus)
+            produced = 0
+            try:
+                for attempt in range(self.fanout_retries + 1):
+                    parser = JSONArrayStream()
+                    stream = timed_stream('quiz', self.llm.stream(messages))
+                    try:
+                        for chunk in stream:
+                            if stop.is_set():
+                                return
+                            for item in parser.feed(chunk.content or ''):
+                                if is_valid(item):
+                                    produced += 1
+                                    events.put(('item', item))
+                        for item in parser.close():
+                            if is_valid(item):
+                                produced += 1
+                                events.put(('item', item))
+                    except Exception as e:
+                        logger.warning("Quiz batch attempt %d failed: %s", attempt + 1, e)
+                    finally:
+                        if hasattr(stream, 'close'):
+                            stream.close()
+                    if produced:
+                        return
+                events.put(('failed', None))
+            finally:
+                events.put(('finished', None))
+        
+        executor = ThreadPoolExecutor(max_workers=min(batches, self.fanout_workers))
+        try:
+            for group, share in zip(groups, shares):
+                executor.submit(contextvars.copy_context().run, run, group, share)
+            kept_tokens = []
+            emitted = 0
+            finished = 0
+            while finished < batches and emitted < count:
+                kind, item = events.get()
+                if kind == 'finished':
+                    finished += 1
+                elif kind == 'failed':
+                    stats['failed'] += 1
+                else:
+                    tokens = _tokens(item.get(text_field, ''))
+                    if _near_duplicate(tokens, kept_tokens, self.dedup_threshold):
+                        continue
+                    kept_tokens.append(tokens)
+                    emitted += 1
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+    
+    def _quiz_messages(self, topic, context, num_questions, difficulty):
+        # Difficulty mapping
+        difficulty_instructions = {
+            'easy': 'Focus on basic concepts, definitions, and recall. Questions should be straightforward.',
+            'medium': 'Include application and understanding questions. Mix recall with analysis.',
+            'hard': 'Focus on analysis, synthesis, and application. Include complex scenarios.'
+        }
+        
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content=f"""You are an expert quiz generator for educational purposes.
 
 Generate {num_questions} multiple-choice questions based on the provided content.
 
 Difficulty Level: {difficulty}
 {difficulty_instructions.get(difficulty, difficulty_instructions['medium'])}
+Every question must be at this difficulty level, regardless of how simple or dense the content is.
 
 Requirements:
 - Each question must have 4 options (A, B, C, D)
@@ -75,65 +445,18 @@ Return ONLY a valid JSON array with this exact structure:
     "explanation": "Brief explanation of why this is correct"
   }}
 ]"""),
-                HumanMessage(content=f"""Topic: {topic}
+            HumanMessage(content=f"""Topic: {topic}
 
 Content:
 {context}
 
 Generate {num_questions} multiple-choice questions.""")
-            ])
-            
-            messages = prompt.format_messages()
-            response = self.llm.invoke(messages)
-            
-            # Parse JSON response
-            try:
-                # Extract JSON from response
-                content = response.content.strip()
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.startswith('```'):
-                    content = content[3:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-                
-                quiz_data = json.loads(content)
-                return {
-                    'topic': topic,
-                    'difficulty': difficulty,
-                    'questions': quiz_data
-                }
-            except json.JSONDecodeError:
-                # Fallback if JSON parsing fails
-                return {
-                    'topic': topic,
-                    'difficulty': difficulty,
-                    'questions': [],
-                    'error': 'Failed to parse quiz format'
-                }
-                
-        except Exception as e:
-            return {'error': str(e)}
+        ])
+        return prompt.format_messages()
     
-    def generate_flashcards(self, topic, user_id, material_id=None, num_cards=10, use_all_materials=False):
-        """Generate flashcards from materials"""
-        try:
-            relevant_chunks = self.doc_processor.get_relevant_chunks(
-                topic,
-                user_id,
-                material_id,
-                use_all_materials,
-                top_k=15
-            )
-            
-            if not relevant_chunks:
-                return {'error': 'No relevant materials found for this topic'}
-            
-            context = "\n\n".join([chunk['content'] for chunk in relevant_chunks])
-            
-            prompt = ChatPromptTemplate.from_messages([
-                SystemMessage(content=f"""You are an expert at creating effective study flashcards.
+    def _flashcard_messages(self, topic, context, num_cards):
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content=f"""You are an expert at creating effective study flashcards.
 
 Generate {num_cards} flashcards from the provided content.
 
@@ -151,49 +474,113 @@ Return ONLY a valid JSON array:
     "back": "Concise answer"
   }}
 ]"""),
-                HumanMessage(content=f"""Topic: {topic}
+            HumanMessage(content=f"""Topic: {topic}
 
 Content:
 {context}
 
 Generate {num_cards} flashcards.""")
-            ])
-            
-            messages = prompt.format_messages()
-            response = self.llm.invoke(messages)
-            
-            try:
-                content = response.content.strip()
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.startswith('```'):
-                    content = content[3:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-                
-                flashcards = json.loads(content)
-                return {
-                    'topic': topic,
-                    'flashcards': flashcards
-                }
-            except json.JSONDecodeError:
-                return {'error': 'Failed to parse flashcard format'}
-                
-        except Exception as e:
-            return {'error': str(e)}
+        ])
+        return prompt.format_messages()
     
-    def evaluate_answers(self, user_answers, correct_answers, topic):
+    def evaluate_answers(self, user_answers, correct_answers, topic, feedback_mode=None):
         """Evaluate quiz answers and provide feedback"""
         try:
-            # Calculate score
-            total = len(correct_answers)
-            correct = sum(1 for i, ans in enumerate(user_answers) if ans == correct_answers[i])
-            score = (correct / total) * 100
-            
-            # Generate feedback
-            prompt = ChatPromptTemplate.from_messages([
-                SystemMessage(content="""You are an encouraging AI tutor providing feedback on quiz performance.
+            return self.evaluate_batch(
+                [{'answers': user_answers, 'correct_answers': correct_answers, 'topic': topic}],
+                feedback_mode
+            )[0]
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def evaluate_batch(self, submissions, feedback_mode=None):
+        """Grade many submissions; feedback is generated once per distinct (topic, score band)
+        
+        feedback_mode (default EVALUATION_FEEDBACK_MODE, 'async'): 'async'
+        returns cached feedback or a feedback_id to fetch it later with
+        get_feedback, 'sync' waits for missing feedback, 'none' skips it.
+        Score, per-question results and suggested difficulty never wait on
+        the LLM.
+        """
+        mode = feedback_mode or self.feedback_mode
+        results = []
+        for submission in submissions:
+            result = self._grade(submission.get('answers') or [], submission.get('correct_answers') or [])
+            if mode == 'none':
+                result.update(feedback=None, feedback_status='skipped')
+                results.append(result)
+                continue
+            topic = submission.get('topic')
+            band = self.feedback_cache.band(result['score'])
+            key = self.feedback_cache.make_key(topic, band)
+            cached = self.feedback_cache.get(key)
+            result['feedback_id'] = key
+            if cached:
+                result.update(feedback=cached['feedback'], feedback_status='ready', feedback_cached=True)
+            else:
+                result.update(feedback=None, feedback_status='pending', feedback_cached=False)
+                result['_future'] = self._feedback_future(key, topic, band)
+            results.append(result)
+        
+        for result in results:
+            future = result.pop('_future', None)
+            if future is None or mode != 'sync':
+                continue
+            try:
+                result.update(feedback=future.result(), feedback_status='ready')
+            except Exception as e:
+                result.update(feedback_status='error', feedback_error=str(e))
+        return results
+    
+    def get_feedback(self, feedback_id):
+        """Status of feedback handed out by an async evaluation: ready, pending or None if unknown"""
+        cached = self.feedback_cache.get(feedback_id)
+        if cached:
+            return {'feedback_id': feedback_id, 'status': 'ready', 'feedback': cached['feedback']}
+        with self._feedback_lock:
+            pending = feedback_id in self._feedback_pending
+        if pending or self.feedback_cache.is_pending(feedback_id):
+            return {'feedback_id': feedback_id, 'status': 'pending', 'feedback': None}
+        return None
+    
+    def _grade(self, user_answers, correct_answers):
+        total = len(correct_answers)
+        results = []
+        for i, expected in enumerate(correct_answers):
+            given = user_answers[i] if i < len(user_answers) else None
+            results.append({'index': i, 'answer': given, 'correct_answer': expected, 'is_correct': given == expected})
+        correct = sum(1 for item in results if item['is_correct'])
+        score = (correct / total) * 100 if total else 0.0
+        return {
+            'score': score,
+            'correct': correct,
+            'total': total,
+            'results': results,
+            'suggested_difficulty': 'hard' if score >= 80 else 'medium' if score >= 50 else 'easy'
+        }
+    
+    def _feedback_future(self, key, topic, band):
+        """Feedback generation for a key, shared by every caller while it runs"""
+        with self._feedback_lock:
+            future = self._feedback_pending.get(key)
+            if future is not None:
+                return future
+            self.feedback_cache.mark_pending(key, topic, band)
+            future = self._feedback_executor.submit(self._generate_feedback, key, topic, band)
+            self._feedback_pending[key] = future
+        # Outside the lock: a future that already finished runs the callback right here
+        future.add_done_callback(lambda done: self._forget_pending(key, done))
+        return future
+    
+    def _forget_pending(self, key, future):
+        with self._feedback_lock:
+            if self._feedback_pending.get(key) is future:
+                del self._feedback_pending[key]
+    
+    def _generate_feedback(self, key, topic, band):
+        # Generate feedback
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content="""You are an encouraging AI tutor providing feedback on quiz performance.
 
 Analyze the student's performance and provide:
 1. Overall assessment of their understanding
@@ -202,23 +589,17 @@ Analyze the student's performance and provide:
 4. Encouraging next steps
 5. Suggested difficulty adjustment for next quiz
 
-Be supportive and constructive."""),
-                HumanMessage(content=f"""Topic: {topic}
-Score: {correct}/{total} ({score:.1f}%)
+Be supportive and constructive. The feedback is shared by every student in the same score range,
+so refer to the range rather than an exact score."""),
+            HumanMessage(content=f"""Topic: {topic}
+Score range: {band[0]}-{band[1]}%
 
 Provide personalized feedback and recommendations.""")
-            ])
-            
-            messages = prompt.format_messages()
+        ])
+        
+        messages = prompt.format_messages()
+        with stage('quiz.feedback_llm'):
             response = self.llm.invoke(messages)
-            
-            return {
-                'score': score,
-                'correct': correct,
-                'total': total,
-                'feedback': response.content,
-                'suggested_difficulty': 'hard' if score >= 80 else 'medium' if score >= 50 else 'easy'
-            }
-            
-        except Exception as e:
-            return {'error': str(e)}
\ No newline at end of file
+        record_llm_usage('feedback', response)
+        self.feedback_cache.put(key, topic, band, response.content)
+        return response.content
@@ -1,52 +1,141 @@
 from langchain_openai import AzureChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage
+from services.context_builder import ContextBuilder
 from services.document_processor import DocumentProcessor
+from services.llm_client import RateLimitedChatModel
+from services.telemetry import atimed_stream, record_llm_usage, stage, timed_stream
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class SocraticTutor:
-    def __init__(self):
-        # Initialize Azure OpenAI LLM
-        self.llm = AzureChatOpenAI(
+    def __init__(self, doc_processor=None, llm=None, context_builder=None):
+        # Initialize Azure OpenAI LLM unless a shared client is given
+        self.llm = llm or RateLimitedChatModel(AzureChatOpenAI(
             azure_endpoint=os.getenv("AZURE_OPENAI_API_BASE"),
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
             azure_deployment=os.getenv("AZURE_OPENAI_API_NAME"),
             model_name="gpt-4o",
-            temperature=0.8
-        )
+            temperature=0.8,
+            max_retries=0
+        ))
         
         # Initialize document processor
-        self.doc_processor = DocumentProcessor()
+        self.doc_processor = doc_processor or DocumentProcessor()
+        
+        # Packs retrieved chunks into the prompt within a token budget
+        self.context_builder = context_builder or ContextBuilder()
     
     def generate_questions(self, student_question, user_id, material_id=None, use_all_materials=False):
         """Generate Socratic questions to guide student thinking"""
         try:
-            # Retrieve relevant chunks
-            relevant_chunks = self.doc_processor.get_relevant_chunks(
-                student_question,
-                user_id,
-                material_id,
-                use_all_materials,
-                top_k=3
-            )
+            relevant_chunks, messages = self._build_prompt(student_question, user_id, material_id, use_all_materials)
+            
+            if not relevant_chunks:
+                return self._no_materials_response()
+            
+            # Generate questions
+            with stage('socratic.llm'):
+                response = self.llm.invoke(messages)
+            record_llm_usage('socratic', response)
+            return self._parse_questions(response.content)
+            
+        except Exception as e:
+            return self._error_response(e)
+    
+    def stream_questions(self, student_question, user_id, material_id=None, use_all_materials=False):
+        """Stream Socratic questions as events: sources, then tokens, then the parsed questions"""
+        try:
+            relevant_chunks, messages = self._build_prompt(student_question, user_id, material_id, use_all_materials)
+            yield {'event': 'sources', 'sources': self._sources(relevant_chunks)}
+            
+            if not relevant_chunks:
+                yield {'event': 'done', **self._no_materials_response()}
+                return
+            
+            parts = []
+            for chunk in timed_stream('socratic', self.llm.stream(messages)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {'event': 'token', 'content': chunk.content}
+            
+            yield {'event': 'done', **self._parse_questions(''.join(parts))}
+            
+        except Exception as e:
+            yield {'event': 'error', **self._error_response(e)}
+    
+    async def agenerate_questions(self, student_question, user_id, material_id=None, use_all_materials=False):
+        """Async variant of generate_questions"""
+        try:
+            relevant_chunks, messages = await self._abuild_prompt(student_question, user_id, material_id, use_all_materials)
+            
+            if not relevant_chunks:
+                return self._no_materials_response()
+            
+            with stage('socratic.llm'):
+                response = await self.llm.ainvoke(messages)
+            record_llm_usage('socratic', response)
+            return self._parse_questions(response.content)
+            
+        except Exception as e:
+            return self._error_response(e)
+    
+    async def astream_questions(self, student_question, user_id, material_id=None, use_all_materials=False):
+        """Async variant of stream_questions"""
+        try:
+            relevant_chunks, messages = await self._abuild_prompt(student_question, user_id, material_id, use_all_materials)
+            yield {'event': 'sources', 'sources': self._sources(relevant_chunks)}
             
             if not relevant_chunks:
-                return {
-                    'questions': ["What materials have you studied on this topic?", 
-                                "Can you break down what you already know about this?"],
-                    'hint': "Upload your study materials first so I can guide you better!"
-                }
+                yield {'event': 'done', **self._no_materials_response()}
+                return
+            
+            parts = []
+            async for chunk in atimed_stream('socratic', self.llm.astream(messages)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {'event': 'token', 'content': chunk.content}
             
-            # Prepare context
-            context = "\n\n".join([chunk['content'] for chunk in relevant_chunks])
+            yield {'event': 'done', **self._parse_questions(''.join(parts))}
             
-            # Create Socratic prompt
-            prompt = ChatPromptTemplate.from_messages([
-                SystemMessage(content="""You are a Socratic AI tutor. Your goal is to guide students to discover answers themselves through thoughtful questioning.
+        except Exception as e:
+            yield {'event': 'error', **self._error_response(e)}
+    
+    def _build_prompt(self, student_question, user_id, material_id, use_all_materials):
+        """Retrieve context and build the Socratic prompt; returns (chunks, messages)"""
+        # Retrieve relevant chunks
+        relevant_chunks = self.doc_processor.get_relevant_chunks(
+            student_question,
+            user_id,
+            material_id,
+            use_all_materials,
+            top_k=3
+        )
+        return relevant_chunks, self._format_prompt(student_question, relevant_chunks)
+    
+    async def _abuild_prompt(self, student_question, user_id, material_id, use_all_materials):
+        relevant_chunks = await self.doc_processor.aget_relevant_chunks(
+            student_question,
+            user_id,
+            material_id,
+            use_all_materials,
+            top_k=3
+        )
+        return relevant_chunks, self._format_prompt(student_question, relevant_chunks)
+    
+    def _format_prompt(self, student_question, relevant_chunks):
+        if not relevant_chunks:
+            return []
+        
+        # Prepare context
+        context, _ = self.context_builder.build(relevant_chunks)
+        
+        # Create Socratic prompt
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content="""You are a Socratic AI tutor. Your goal is to guide students to discover answers themselves through thoughtful questioning.
 
 Guidelines:
 - Never give direct answers
@@ -61,37 +150,51 @@ Your questions should help students:
 2. Make connections between concepts
 3. Think about implications and applications
 4. Arrive at the answer through their own reasoning"""),
-                HumanMessage(content=f"""Context from study materials:
+            HumanMessage(content=f"""Context from study materials:
 {context}
 
 Student Question: {student_question}
 
 Generate 2-3 Socratic questions to guide the student toward understanding, without giving away the answer directly.""")
-            ])
-            
-            # Generate questions
-            messages = prompt.format_messages()
-            response = self.llm.invoke(messages)
-            
-            # Parse questions (assuming they come as numbered list)
-            questions_text = response.content
-            questions = [q.strip() for q in questions_text.split('\n') if q.strip() and (q.strip()[0].isdigit() or q.strip().startswith('-'))]
-            
-            # Clean up questions
-            cleaned_questions = []
-            for q in questions:
-                # Remove numbering
-                q = q.lstrip('0123456789.-) ')
-                if q:
-                    cleaned_questions.append(q)
-            
-            return {
-                'questions': cleaned_questions if cleaned_questions else [questions_text],
-                'hint': "Think through these questions step by step. Try to connect what you already know!"
+        ])
+        
+        return prompt.format_messages()
+    
+    def _sources(self, relevant_chunks):
+        return [
+            {
+                'content': chunk['content'][:200] + '...' if len(chunk['content']) > 200 else chunk['content'],
+                'similarity': chunk['similarity']
             }
-            
-        except Exception as e:
-            return {
-                'questions': [f"Let's break this down. What do you already know about this topic?"],
-                'hint': f"Error: {str(e)}"
-            }
\ No newline at end of file
+            for chunk in relevant_chunks
+        ]
+    
+    def _parse_questions(self, questions_text):
+        """Parse questions (assuming they come as numbered list)"""
+        questions = [q.strip() for q in questions_text.split('\n') if q.strip() and (q.strip()[0].isdigit() or q.strip().startswith('-'))]
+        
+        # Clean up questions
+        cleaned_questions = []
+        for q in questions:
+            # Remove numbering
+            q = q.lstrip('0123456789.-) ')
+            if q:
+                cleaned_questions.append(q)
+        
+        return {
+            'questions': cleaned_questions if cleaned_questions else [questions_text],
+            'hint': "Think through these questions step by step. Try to connect what you already know!"
+        }
+    
+    def _no_materials_response(self):
+        return {
+            'questions': ["What materials have you studied on this topic?", 
+                        "Can you break down what you already know about this?"],
+            'hint': "Upload your study materials first so I can guide you better!"
+        }
+    
+    def _error_response(self, error):
+        return {
+            'questions': [f"Let's break this down. What do you already know about this topic?"],
+            'hint': f"Error: {str(error)}"
+        }
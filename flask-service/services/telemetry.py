@@ -0,0 +1,338 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Seconds; from sub-millisecond cache hits up to slow LLM completions
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# Incoming X-Request-ID values are echoed into headers and logs, so only simple ones are kept
+TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.type = 'counter'
+        self._values = {}  # {label values: total}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.type = 'histogram'
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # {label values: [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in series.items():
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (('le', _format_value(float(bound))),), cumulative
+            yield f"{self.name}_sum", labels, values[-2]
+            yield f"{self.name}_count", labels, values[-1]
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text format
+
+    Like the caches, metrics live in each worker process; scrape every
+    worker (or run one) to see all traffic.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collect):
+        """collect() -> [(name, type, documentation, [(labels dict, value)])], called at scrape time"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception:
+                logger.exception("Metrics collector failed")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'mentivio_request_duration_seconds',
+    'Time until the response is returned (streams: until headers are sent)',
+    ('method', 'endpoint', 'status')
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    'mentivio_stage_duration_seconds',
+    'Time spent in each hot-path stage (embedding, MongoDB, search, LLM)',
+    ('stage',)
+)
+LLM_TOKENS = REGISTRY.counter(
+    'mentivio_llm_tokens_total',
+    'Prompt and completion tokens reported by the LLM API',
+    ('operation', 'kind')
+)
+CONTEXT_TOKENS = REGISTRY.histogram(
+    'mentivio_context_tokens',
+    'Tokens of retrieved material packed into a prompt',
+    buckets=TOKEN_BUCKETS
+)
+STREAM_SECONDS = REGISTRY.histogram(
+    'mentivio_stream_duration_seconds',
+    'Time until a streamed (SSE) response body finishes',
+    ('endpoint',)
+)
+CHUNKS_SCANNED = REGISTRY.histogram(
+    'mentivio_retrieval_chunks_scanned',
+    'Chunk vectors scored by one vector search',
+    ('index',),
+    buckets=COUNT_BUCKETS
+)
+
+
+class Trace:
+    """Per-request trace id and the time its stages took"""
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = {}  # {stage: seconds}, summed when a stage repeats
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add(self, stage_name, seconds):
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def server_timing(self):
+        """Server-Timing header value, so browser dev tools show the breakdown"""
+        with self._lock:
+            stages = dict(self.stages)
+        return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
+    def summary(self):
+        with self._lock:
+            stages = dict(self.stages)
+        return ' '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in stages.items())
+
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+def request_trace_id(header_value):
+    """The caller's X-Request-ID when it is well formed, else a new id"""
+    if header_value and TRACE_ID_PATTERN.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+
+def start_trace(trace_id=None):
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def activate_trace(trace):
+    """Make trace current again, e.g. inside a streamed response body"""
+    _current_trace.set(trace)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def finish_request(trace, method, endpoint, status, log=True):
+    """Record a request whose response is ready; returns the headers that carry its trace"""
+    elapsed = trace.elapsed
+    REQUEST_SECONDS.observe(elapsed, method=method, endpoint=endpoint, status=status)
+    if log:
+        logger.info("%s %s %s %.1fms %s", method, endpoint, status, elapsed * 1000, trace.summary())
+    headers = {'X-Request-ID': trace.trace_id}
+    timing = trace.server_timing()
+    if timing:
+        headers['Server-Timing'] = timing
+    return headers
+
+
+def finish_stream(trace, endpoint):
+    """Record the end of a streamed response body, with the stages that ran while streaming"""
+    elapsed = trace.elapsed
+    STREAM_SECONDS.observe(elapsed, endpoint=endpoint)
+    logger.info("stream %s finished %.1fms %s", endpoint, elapsed * 1000, trace.summary())
+
+
+def observe_stage(stage_name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage_name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name):
+    """Time the enclosed block as stage_name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage_name, time.perf_counter() - started)
+
+
+def record_llm_usage(operation, message):
+    """Count the tokens of an LLM response that carries usage metadata"""
+    usage = getattr(message, 'usage_metadata', None)
+    if usage:
+        LLM_TOKENS.inc(usage.get('input_tokens', 0), operation=operation, kind='input')
+        LLM_TOKENS.inc(usage.get('output_tokens', 0), operation=operation, kind='output')
+
+
+def timed_stream(operation, chunks):
+    """Pass an LLM stream through, timing the first chunk and the whole stream"""
+    started = time.perf_counter()
+    first = True
+    try:
+        for chunk in chunks:
+            if first:
+                observe_stage(f"{operation}.llm_first_token", time.perf_counter() - started)
+                first = False
+            record_llm_usage(operation, chunk)
+            yield chunk
+    finally:
+        # Close the upstream completion right away if the consumer stopped early
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        observe_stage(f"{operation}.llm", time.perf_counter() - started)
+
+
+async def atimed_stream(operation, chunks):
+    """Async variant of timed_stream"""
+    started = time.perf_counter()
+    first = True
+    try:
+        async for chunk in chunks:
+            if first:
+                observe_stage(f"{operation}.llm_first_token", time.perf_counter() - started)
+                first = False
+            record_llm_usage(operation, chunk)
+            yield chunk
+    finally:
+        close = getattr(chunks, 'aclose', None)
+        if close is not None:
+            await close()
+        observe_stage(f"{operation}.llm", time.perf_counter() - started)
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current trace id (or '-') to every log record"""
+    def filter(self, record):
+        trace = _current_trace.get()
+        record.trace_id = trace.trace_id if trace is not None else '-'
+        return True
+
+
+_logging_configured = False
+
+
+def configure_logging():
+    """Log to stderr with the trace id on every line; LOG_LEVEL sets the level (default INFO)"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
@@ -0,0 +1,207 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """Scale each row to unit length so dot products are cosine similarities"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def top_k_scores(matrix, query_vector, top_k):
+    """Score all rows with one matrix-vector product and return (row indices, scores) best first"""
+    if top_k <= 0 or matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    scores = matrix @ query_vector
+    k = min(top_k, scores.shape[0])
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = candidates[np.argsort(-scores[candidates])]
+    return order, scores[order]
+
+
+class ShardedScorer:
+    """Scores large matrices in row blocks across a thread pool
+
+    numpy releases the GIL in the matrix-vector product and the partial
+    sort, so shards run on separate cores while reading the shared matrix
+    through views, without copying it. Each shard keeps its local top_k and
+    the shard results are merged with a heap. Matrices smaller than two
+    shards of min_rows are scored inline, as before.
+    """
+    def __init__(self, workers=None, min_rows=None):
+        self.workers = max(1, int(workers if workers is not None else os.getenv("RETRIEVAL_WORKERS", str(min(8, os.cpu_count() or 1)))))
+        self.min_rows = max(1, int(min_rows if min_rows is not None else os.getenv("RETRIEVAL_SHARD_MIN_ROWS", "32768")))
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def top_k(self, matrix, query_vector, top_k):
+        """Same result as top_k_scores(matrix, query_vector, top_k)"""
+        shards = min(self.workers, matrix.shape[0] // self.min_rows)
+        if shards <= 1 or top_k <= 0:
+            return top_k_scores(matrix, query_vector, top_k)
+        bounds = np.linspace(0, matrix.shape[0], shards + 1, dtype=np.int64)
+        pool = self._get_pool()
+        # The calling thread scores the first shard instead of waiting idle
+        futures = [
+            pool.submit(top_k_scores, matrix[start:end], query_vector, top_k)
+            for start, end in zip(bounds[1:-1], bounds[2:])
+        ]
+        results = [top_k_scores(matrix[:bounds[1]], query_vector, top_k)]
+        results.extend(future.result() for future in futures)
+        candidates = []
+        for start, (rows, scores) in zip(bounds[:-1], results):
+            candidates.extend(zip(scores.tolist(), (rows + start).tolist()))
+        best = heapq.nlargest(top_k, candidates)
+        return (
+            np.array([row for _, row in best], dtype=np.int64),
+            np.array([score for score, _ in best], dtype=np.float32)
+        )
+
+    def _get_pool(self):
+        with self._lock:
+            # Pool threads do not survive fork(); a child process starts its own
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers - 1, thread_name_prefix='retrieval')
+                self._pool_pid = os.getpid()
+            return self._pool
+
+
+class VectorCacheEntry:
+    """Pre-normalized float32 embedding matrix with a parallel array of chunk ids"""
+    def __init__(self, ids, matrix):
+        self.ids = np.asarray(ids, dtype=object)
+        self.matrix = normalize_rows(matrix) if len(self.ids) else np.empty((0, 0), dtype=np.float32)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.ids.nbytes
+
+    def search(self, query_vector, top_k, scorer=None):
+        """Return [(chunk_id, similarity)] for the top_k rows"""
+        if not len(self.ids):
+            return []
+        query = normalize_rows(query_vector)[0]
+        if scorer is not None:
+            rows, scores = scorer.top_k(self.matrix, query, top_k)
+        else:
+            rows, scores = top_k_scores(self.matrix, query, top_k)
+        return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+
+
+class VectorCache:
+    """LRU cache of per-user / per-material embedding matrices bounded by a memory budget"""
+    def __init__(self, max_bytes=None, max_entries=None, ttl_seconds=None):
+        self.max_bytes = int(max_bytes if max_bytes is not None else os.getenv("VECTOR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv("VECTOR_CACHE_MAX_ENTRIES", "1000"))
+        # Bounds staleness when another worker process ingests for the same user
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else os.getenv("VECTOR_CACHE_TTL_SECONDS", "600"))
+        self._entries = OrderedDict()  # {(user_id, scope): VectorCacheEntry}
+        # Bumped by invalidate so a load that started before an ingest is not cached after it
+        self._generations = {}  # {user_id: int}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(user_id, material_id=None, use_all_materials=False):
+        scope = '*' if use_all_materials or not material_id else material_id
+        return (user_id, scope)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Return the cached entry for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if self.ttl_seconds > 0 and time.monotonic() - entry.loaded_at > self.ttl_seconds:
+                self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, key, entry, generation=None):
+        """Insert an entry and evict least recently used entries until within budget
+
+        generation, if given, is generation(user_id) read before the entry was
+        loaded; the entry is not cached if the user was invalidated since.
+        """
+        if not self.enabled or entry.nbytes > self.max_bytes:
+            return entry
+        with self._lock:
+            if generation is not None and self._generations.get(key[0], 0) != generation:
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def get_or_load(self, key, loader):
+        """Return the cached entry for key, building it with loader() -> (ids, matrix) on a miss"""
+        entry = self.get(key)
+        if entry is None:
+            generation = self.generation(key[0])
+            ids, matrix = loader()
+            entry = self.put(key, VectorCacheEntry(ids, matrix), generation)
+        return entry
+
+    def invalidate(self, user_id, material_id=None):
+        """Drop a user's entries; with material_id only that material and the all-materials entry"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in list(self._entries):
+                if key[0] != user_id:
+                    continue
+                if material_id is None or key[1] in ('*', material_id):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
@@ -0,0 +1,350 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from bson import ObjectId
+
+from services.telemetry import CHUNKS_SCANNED
+from services.vector_cache import ShardedScorer, VectorCache, normalize_rows, top_k_scores
+
+logger = logging.getLogger(__name__)
+
+
+class BruteForceIndex:
+    """Exact search over the cached per-scope embedding matrix"""
+    def __init__(self, vector_cache, load_vectors, scorer=None):
+        # load_vectors(user_id, material_id, use_all_materials) -> (ids, matrix)
+        self.vector_cache = vector_cache
+        self.load_vectors = load_vectors
+        # Splits large (library-wide) matrices across cores
+        self.scorer = scorer or ShardedScorer()
+
+    def search(self, query_vector, user_id, material_id=None, use_all_materials=False, top_k=5):
+        """Return [(chunk_id, similarity)] best first"""
+        key = VectorCache.make_key(user_id, material_id, use_all_materials)
+        entry = self.vector_cache.get_or_load(
+            key, lambda: self.load_vectors(user_id, material_id, use_all_materials)
+        )
+        CHUNKS_SCANNED.observe(len(entry.ids), index='brute_force')
+        return entry.search(query_vector, top_k, self.scorer)
+
+    def add(self, user_id, material_id, ids, vectors):
+        """New chunks were stored; cached matrices for the user are now stale"""
+        self.vector_cache.invalidate(user_id, material_id)
+
+    def persist(self, user_id):
+        pass
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, seed=0, block_size=8192):
+    """Cluster unit vectors by cosine similarity; returns unit-norm centroids"""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(n_clusters, vectors.shape[0]))
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_clusters(vectors, centroids, block_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(vectors.shape[0], len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def assign_clusters(vectors, centroids, block_size=8192):
+    """Index of the most similar centroid for every row, computed in blocks to bound memory"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], block_size):
+        block = vectors[start:start + block_size]
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFUserIndex:
+    """Inverted-file index over one user's chunk embeddings
+
+    Vectors are searched exactly until min_train vectors exist. After that a
+    spherical k-means coarse quantizer with nlist cells is trained and queries
+    scan only the nprobe closest cells. The quantizer is retrained when the
+    index has grown retrain_factor times past its last training size.
+    """
+    def __init__(self, nlist=64, nprobe=8, min_train=2048, retrain_factor=4.0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+        self.ids = []
+        self.id_set = set()
+        self.vectors = None  # float32 buffer with spare capacity, rows [:size] are live
+        self.size = 0
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.lists = []
+        self.trained_size = 0
+        # time.monotonic() of the last check against MongoDB; None until checked
+        self.verified_at = None
+        self.lock = threading.RLock()
+
+    def add(self, ids, vectors):
+        """Append vectors, skipping ids already indexed"""
+        with self.lock:
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self.id_set]
+            if not keep:
+                return
+            vectors = normalize_rows(np.asarray(vectors, dtype=np.float32)[keep])
+            start = self.size
+            self._reserve(start + len(keep), vectors.shape[1])
+            self.vectors[start:start + len(keep)] = vectors
+            self.size += len(keep)
+            for i in keep:
+                self.ids.append(ids[i])
+                self.id_set.add(ids[i])
+
+            if self.centroids is None:
+                if self.size >= self.min_train:
+                    self.train()
+            elif self.size >= self.trained_size * self.retrain_factor:
+                self.train()
+            else:
+                new_assignments = assign_clusters(vectors, self.centroids)
+                self.assignments = np.concatenate([self.assignments, new_assignments])
+                for offset, cell in enumerate(new_assignments):
+                    self.lists[cell].append(start + offset)
+
+    def train(self, iterations=10):
+        """(Re)build the coarse quantizer and inverted lists from all vectors"""
+        with self.lock:
+            live = self.vectors[:self.size]
+            sample_size = min(self.size, self.nlist * 256)
+            sample = live[np.random.default_rng(0).choice(self.size, sample_size, replace=False)]
+            self.centroids = spherical_kmeans(sample, min(self.nlist, self.size), iterations)
+            self.assignments = assign_clusters(live, self.centroids)
+            self._rebuild_lists()
+            self.trained_size = self.size
+
+    def search(self, query_vector, top_k=5, nprobe=None):
+        """Return [(chunk_id, similarity)] best first"""
+        with self.lock:
+            if self.size == 0:
+                return []
+            query = normalize_rows(query_vector)[0]
+            live = self.vectors[:self.size]
+            if self.centroids is None:
+                CHUNKS_SCANNED.observe(self.size, index='ivf')
+                rows, scores = top_k_scores(live, query, top_k)
+                return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+
+            nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+            cells, _ = top_k_scores(self.centroids, query, nprobe)
+            candidates = np.concatenate([np.asarray(self.lists[cell], dtype=np.int64) for cell in cells])
+            CHUNKS_SCANNED.observe(len(candidates), index='ivf')
+            if not len(candidates):
+                return []
+            local_rows, scores = top_k_scores(live[candidates], query, top_k)
+            return [(self.ids[candidates[row]], float(score)) for row, score in zip(local_rows, scores)]
+
+    def save(self, path, user_id=None):
+        """Write the index to path atomically, with user_id in a .user file beside it for preload"""
+        if user_id is not None:
+            meta_path = path[:-4] + '.user'
+            if not os.path.exists(meta_path):
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    f.write(str(user_id))
+        with self.lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    ids=np.array([str(chunk_id) for chunk_id in self.ids]),
+                    vectors=self.vectors[:self.size] if self.size else np.empty((0, 0), dtype=np.float32),
+                    centroids=self.centroids if self.centroids is not None else np.empty((0, 0), dtype=np.float32),
+                    assignments=self.assignments,
+                    trained_size=np.array(self.trained_size)
+                )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **params):
+        data = np.load(path, allow_pickle=False)
+        index = cls(**params)
+        ids = [ObjectId(chunk_id) if ObjectId.is_valid(chunk_id) else chunk_id for chunk_id in data['ids'].tolist()]
+        index.ids = ids
+        index.id_set = set(ids)
+        index.size = len(ids)
+        index.vectors = np.ascontiguousarray(data['vectors'], dtype=np.float32) if index.size else None
+        if data['centroids'].size:
+            index.centroids = data['centroids']
+            index.assignments = data['assignments'].astype(np.int32)
+            index.trained_size = int(data['trained_size'])
+            index._rebuild_lists()
+        return index
+
+    def _reserve(self, capacity, dim):
+        """Grow the vector buffer geometrically so appends stay amortized O(1)"""
+        if self.vectors is not None and self.vectors.shape[0] >= capacity:
+            return
+        current = 0 if self.vectors is None else self.vectors.shape[0]
+        grown = np.empty((max(capacity, current * 2, 1024), dim), dtype=np.float32)
+        if self.size:
+            grown[:self.size] = self.vectors[:self.size]
+        self.vectors = grown
+
+    def _rebuild_lists(self):
+        self.lists = [[] for _ in range(self.centroids.shape[0])]
+        for row, cell in enumerate(self.assignments):
+            self.lists[cell].append(row)
+
+
+class IVFIndex:
+    """Per-user IVF indexes for library-wide queries, persisted to local disk
+
+    Material-scoped queries are small and stay on the exact brute-force path.
+    An index is checked against the user's chunk count in MongoDB when
+    loaded and again every verify_seconds, so chunks ingested by other
+    worker processes show up with bounded delay.
+    """
+    def __init__(self, brute_force, load_vectors, count_vectors, index_dir=None,
+                 nlist=None, nprobe=None, min_train=None, max_users=None, verify_seconds=None):
+        self.brute_force = brute_force
+        # load_vectors(user_id, material_id, use_all_materials) -> (ids, matrix)
+        self.load_vectors = load_vectors
+        # count_vectors(user_id) -> number of stored chunks for the user
+        self.count_vectors = count_vectors
+        self.index_dir = index_dir or os.getenv(
+            "VECTOR_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'vector_index')
+        )
+        self.params = {
+            'nlist': int(nlist or os.getenv("IVF_NLIST", "64")),
+            'nprobe': int(nprobe or os.getenv("IVF_NPROBE", "8")),
+            'min_train': int(min_train or os.getenv("IVF_MIN_TRAIN", "2048"))
+        }
+        self.max_users = int(max_users or os.getenv("VECTOR_INDEX_MAX_USERS", "200"))
+        # Same staleness bound as the vector cache by default
+        self.verify_seconds = float(
+            verify_seconds if verify_seconds is not None
+            else os.getenv("VECTOR_INDEX_VERIFY_SECONDS", os.getenv("VECTOR_CACHE_TTL_SECONDS", "600"))
+        )
+        self._indexes = OrderedDict()  # {user_id: IVFUserIndex}
+        self._lock = threading.Lock()
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def search(self, query_vector, user_id, material_id=None, use_all_materials=False, top_k=5):
+        if not use_all_materials and material_id:
+            return self.brute_force.search(query_vector, user_id, material_id, use_all_materials, top_k)
+        index = self._get_index(user_id, build=True)
+        return index.search(query_vector, top_k)
+
+    def add(self, user_id, material_id, ids, vectors):
+        self.brute_force.add(user_id, material_id, ids, vectors)
+        # A user with no index yet is built from MongoDB on first search, which
+        # already includes these chunks
+        index = self._get_index(user_id, build=False)
+        if index is not None:
+            index.add(ids, vectors)
+
+    def persist(self, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.save(self._path(user_id), user_id)
+
+    def preload(self):
+        """Load the most recently written indexes from disk, up to max_users"""
+        files = [
+            os.path.join(self.index_dir, name)
+            for name in os.listdir(self.index_dir) if name.endswith('.npz')
+        ]
+        files.sort(key=os.path.getmtime, reverse=True)
+        user_files = {}
+        for path in files[:self.max_users]:
+            meta_path = path[:-4] + '.user'
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding='utf-8') as f:
+                    user_files[f.read()] = path
+        for user_id, path in user_files.items():
+            try:
+                self._store(user_id, IVFUserIndex.load(path, **self.params))
+            except Exception as e:
+                logger.warning("Skipping unreadable vector index %s: %s", path, e)
+        return len(user_files)
+
+    def _get_index(self, user_id, build):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+        if index is None:
+            path = self._path(user_id)
+            if os.path.exists(path):
+                index = IVFUserIndex.load(path, **self.params)
+            elif not build:
+                return None
+            else:
+                index = self._build(user_id)
+            self._store(user_id, index)
+        if build and self._needs_verify(index):
+            index = self._verify(user_id, index)
+        return index
+
+    def _needs_verify(self, index):
+        if index.verified_at is None:
+            return True
+        return self.verify_seconds > 0 and time.monotonic() - index.verified_at > self.verify_seconds
+
+    def _verify(self, user_id, index):
+        """Bring index in line with the user's chunks in MongoDB"""
+        # The on-disk copy misses chunks if a process died before persisting,
+        # and other worker processes ingest without telling this one
+        count = self.count_vectors(user_id)
+        if count > index.size:
+            # add() skips ids already indexed, so only the new chunks go in
+            ids, matrix = self.load_vectors(user_id, None, True)
+            if len(ids):
+                index.add(list(ids), matrix)
+        if index.size != count:
+            # Chunks were deleted: start over
+            index = self._build(user_id)
+            self._store(user_id, index)
+        index.verified_at = time.monotonic()
+        return index
+
+    def _build(self, user_id):
+        ids, matrix = self.load_vectors(user_id, None, True)
+        index = IVFUserIndex(**self.params)
+        if len(ids):
+            index.add(list(ids), matrix)
+        index.verified_at = time.monotonic()
+        index.save(self._path(user_id), user_id)
+        return index
+
+    def _store(self, user_id, index):
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+
+    def _path(self, user_id):
+        name = hashlib.sha1(str(user_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.index_dir, f"{name}.npz")
+
+
+def create_vector_index(vector_cache, load_vectors, count_vectors, backend=None):
+    """Build the retrieval index selected by VECTOR_INDEX_BACKEND (bruteforce or ivf)"""
+    backend = (backend or os.getenv("VECTOR_INDEX_BACKEND", "bruteforce")).lower()
+    brute_force = BruteForceIndex(vector_cache, load_vectors)
+    if backend == 'bruteforce':
+        return brute_force
+    if backend == 'ivf':
+        index = IVFIndex(brute_force, load_vectors, count_vectors)
+        if os.getenv("VECTOR_INDEX_PRELOAD", "true").lower() == 'true':
+            index.preload()
+        return index
+    raise ValueError(f"Unknown VECTOR_INDEX_BACKEND: {backend}")
@@ -0,0 +1,97 @@
+import math
+
+from services.context_builder import ContextBuilder, remove_overlap
+
+
+class CharCounter:
+    """Four characters per token, recording how much text was tokenized"""
+    exact = False
+
+    def __init__(self):
+        self.chars = 0
+
+    def count(self, text):
+        self.chars += len(text)
+        return math.ceil(len(text) / 4)
+
+    def truncate(self, text, max_tokens):
+        return text[:max_tokens * 4]
+
+
+def split(text, size=120, overlap=40):
+    """Chunks of text overlapping the way the ingest splitter's do"""
+    chunks = []
+    for index, start in enumerate(range(0, len(text), size - overlap)):
+        chunks.append({'content': text[start:start + size], 'material_id': 'm1', 'chunk_index': index})
+        if start + size >= len(text):
+            break
+    return chunks
+
+
+TEXT = ''.join(f'{i:03d}abcdefg ' for i in range(60))
+
+
+def test_remove_overlap_drops_only_the_shared_prefix():
+    shared = 'the shared sentence both chunks contain'
+    assert remove_overlap('Earlier text, ' + shared, shared + ' and more', 60) == ' and more'
+    assert remove_overlap('Earlier text, ' + shared, shared + ' and more', 10) == shared + ' and more'
+    assert remove_overlap('unrelated text', 'fresh start', 60) == 'fresh start'
+
+
+def test_consecutive_chunks_are_merged_without_their_overlap():
+    chunks = split(TEXT)
+    context, stats = ContextBuilder(max_tokens=10 ** 6, max_overlap=50, counter=CharCounter()).build(
+        list(reversed(chunks))
+    )
+    assert context == TEXT
+    assert stats['chunks_used'] == len(chunks) and stats['chunks_dropped'] == 0
+    assert stats['tokens_saved'] > 0
+
+
+def test_runs_are_ordered_by_their_best_chunk():
+    chunks = split(TEXT)
+    other = {'content': 'Other material entirely', 'material_id': 'm2', 'chunk_index': 0}
+    context, _ = ContextBuilder(max_tokens=10 ** 6, max_overlap=50, counter=CharCounter()).build(
+        [other, chunks[3], chunks[1], chunks[2]]
+    )
+    first, second = context.split('\n\n')
+    assert first == other['content']
+    assert second == TEXT[80:360]
+
+
+def test_chunk_between_two_runs_joins_them():
+    chunks = split(TEXT)
+    context, stats = ContextBuilder(max_tokens=10 ** 6, max_overlap=50, counter=CharCounter()).build(
+        [chunks[0], chunks[2], chunks[1]]
+    )
+    assert context == TEXT[:280]
+    assert stats['tokens'] == math.ceil(280 / 4)
+
+
+def test_chunks_that_do_not_fit_are_skipped_and_budget_holds():
+    chunks = split(TEXT)
+    unrelated = {'content': 'x' * 40, 'material_id': 'm2', 'chunk_index': None}
+    context, stats = ContextBuilder(max_tokens=41, max_overlap=50, counter=CharCounter()).build(
+        [chunks[0], chunks[4], unrelated]
+    )
+    assert stats['tokens'] <= 41
+    assert context == chunks[0]['content'] + '\n\n' + unrelated['content']
+    assert stats['chunks_used'] == 2 and stats['chunks_dropped'] == 1
+
+
+def test_oversized_best_chunk_is_truncated():
+    context, stats = ContextBuilder(max_tokens=10, counter=CharCounter()).build(
+        [{'content': 'y' * 400, 'material_id': 'm1', 'chunk_index': 0}, {'content': 'short', 'material_id': 'm2'}]
+    )
+    assert context == 'y' * 40
+    assert stats['tokens'] == 10 and stats['chunks_used'] == 1
+
+
+def test_tokenizer_work_grows_linearly_with_chunks():
+    def tokenized(count):
+        counter = CharCounter()
+        chunks = [{'content': 'z' * 1000, 'material_id': 'm1', 'chunk_index': i * 2} for i in range(count)]
+        ContextBuilder(max_tokens=10 ** 6, counter=counter).build(chunks)
+        return counter.chars
+
+    assert tokenized(200) <= 4 * tokenized(50) * 1.1
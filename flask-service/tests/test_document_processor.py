@@ -0,0 +1,141 @@
+import pytest
+
+pytest.importorskip('langchain_community')
+pytest.importorskip('langchain_openai')
+pytest.importorskip('langchain_text_splitters')
+mongomock = pytest.importorskip('mongomock')
+
+from services.document_processor import CHUNK_FIELDS, DocumentProcessor
+from services.embedding_codec import encode_embedding
+from services.lexical_index import term_frequencies
+
+VOCABULARY = ['krebs', 'glucose', 'light', 'mass', 'ribosome']
+
+CHUNKS = [
+    ('m1', 'Krebs cycle krebs mitochondria'),
+    ('m1', 'Glucose splits into pyruvate'),
+    ('m2', 'Light energy is stored as glucose'),
+    ('m2', 'Mass energy equivalence'),
+    ('m2', 'Ribosome reads codons'),
+]
+
+
+class KeywordEmbeddings:
+    """Embeds text as counts of a few vocabulary words, so similarity is predictable"""
+    def __init__(self):
+        self.queries = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.queries += 1
+        words = text.lower().split()
+        return [float(words.count(word)) + 0.01 for word in VOCABULARY]
+
+
+class RecordingCollection:
+    """Collection wrapper that records the filter and projection of every find()"""
+    def __init__(self, collection):
+        self.collection = collection
+        self.finds = []
+
+    def find(self, *args, **kwargs):
+        self.finds.append(args)
+        return self.collection.find(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setenv('ENSURE_INDEXES', 'false')
+    db = mongomock.MongoClient()['ai_tutor']
+    embeddings = KeywordEmbeddings()
+    db['embeddings'].insert_many([
+        {
+            'user_id': 'u1',
+            'material_id': material_id,
+            'chunk_index': index,
+            'content': content,
+            'metadata': {'page': index},
+            'lexical_terms': term_frequencies(content),
+            **encode_embedding(embeddings.embed_query(content), 'array')
+        }
+        for index, (material_id, content) in enumerate(CHUNKS)
+    ])
+    processor = DocumentProcessor(embeddings=embeddings, db=db)
+    processor.embeddings_collection = RecordingCollection(processor.embeddings_collection)
+    return processor
+
+
+def content_fetches(processor):
+    return [args for args in processor.embeddings_collection.finds if len(args) > 1 and 'content' in args[1]]
+
+
+def test_vector_retrieval_fetches_content_for_top_k_only(processor):
+    chunks = processor.get_relevant_chunks('krebs', 'u1', top_k=2, mode='vector')
+    assert chunks[0]['content'] == CHUNKS[0][1]
+    assert len(chunks) == 2
+    assert chunks[0]['similarity'] >= chunks[1]['similarity']
+    assert all(chunk['retrieval'] == 'vector' for chunk in chunks)
+
+    scans = [args for args in processor.embeddings_collection.finds if args not in content_fetches(processor)]
+    assert scans and all('content' not in args[1] for args in scans)
+    (query, projection), = content_fetches(processor)
+    assert len(query['_id']['$in']) == 2
+    assert projection == CHUNK_FIELDS
+
+
+def test_vector_retrieval_respects_material_scope(processor):
+    chunks = processor.get_relevant_chunks('glucose', 'u1', material_id='m2', top_k=5, mode='vector')
+    assert {chunk['material_id'] for chunk in chunks} == {'m2'}
+    chunks = processor.get_relevant_chunks('glucose', 'u1', material_id='m2', use_all_materials=True,
+                                           top_k=5, mode='vector')
+    assert len(chunks) == len(CHUNKS)
+
+
+def test_lexical_mode_skips_query_embedding(processor):
+    queries = processor.embeddings.embeddings.queries
+    chunks = processor.get_relevant_chunks('ribosome codons', 'u1', top_k=1, mode='lexical')
+    assert [chunk['content'] for chunk in chunks] == [CHUNKS[4][1]]
+    assert chunks[0]['similarity'] == 1.0
+    assert chunks[0]['retrieval'] == 'lexical'
+    assert processor.embeddings.embeddings.queries == queries
+
+
+def test_hybrid_mode_fuses_rankings_and_scores_lexical_only_hits(processor):
+    chunks = processor.get_relevant_chunks('krebs pyruvate', 'u1', top_k=3, mode='hybrid')
+    contents = [chunk['content'] for chunk in chunks]
+    assert contents[0] == CHUNKS[0][1]
+    assert CHUNKS[1][1] in contents
+    assert all(chunk['retrieval'] == 'hybrid' for chunk in chunks)
+    assert all(chunk['similarity'] is not None for chunk in chunks)
+
+
+def test_fuse_hits_prefers_chunks_both_rankings_agree_on(processor):
+    processor.rrf_k = 60
+    vector_hits = [('a', 0.9), ('b', 0.8), ('c', 0.7)]
+    lexical_hits = [('c', 9.0), ('d', 5.0)]
+    fused = processor._fuse_hits(vector_hits, lexical_hits, top_k=3)
+    assert [chunk_id for chunk_id, _, _ in fused] == ['c', 'a', 'b']
+    assert fused[0] == ('c', 0.7, 'hybrid')
+    assert processor._fuse_hits([], lexical_hits, top_k=2) == [('c', None, 'hybrid'), ('d', None, 'hybrid')]
+
+
+def test_missing_chunks_are_skipped(processor):
+    hits = [(doc['_id'], 0.5) for doc in processor.embeddings_collection.collection.find({}, {'_id': 1})][:2]
+    processor.embeddings_collection.collection.delete_one({'_id': hits[0][0]})
+    assert [chunk['id'] for chunk in processor._fetch_chunks(hits)] == [str(hits[1][0])]
+    assert processor.get_relevant_chunks('krebs', 'u1', mode='hybrid', material_id='missing') == []
+
+
+def test_unknown_retrieval_mode_is_an_error(processor, monkeypatch):
+    with pytest.raises(ValueError, match='Unknown retrieval mode'):
+        processor.get_relevant_chunks('krebs', 'u1', mode='vectr')
+    monkeypatch.setenv('RETRIEVAL_MODE', 'hybird')
+    with pytest.raises(ValueError, match='Unknown retrieval mode'):
+        DocumentProcessor(embeddings=KeywordEmbeddings(), db=mongomock.MongoClient()['ai_tutor'])
+    monkeypatch.setenv('RETRIEVAL_MODE', ' Hybrid ')
+    assert DocumentProcessor(embeddings=KeywordEmbeddings(), db=mongomock.MongoClient()['ai_tutor']).retrieval_mode == 'hybrid'
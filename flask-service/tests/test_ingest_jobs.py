@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from services.ingest_jobs import IngestJobQueue, QueueFullError
+
+
+def make_queue(tmp_path, process_fn=None, **kwargs):
+    calls = []
+
+    def process(file_path, user_id, material_id, progress, resume):
+        calls.append((file_path, resume))
+        progress(pages_parsed=1, chunks_stored=2)
+        return {'success': True}
+
+    queue = IngestJobQueue(process_fn or process, db_path=str(tmp_path / 'jobs.db'), workers=1,
+                           poll_interval=0.05, lease_seconds=30, **kwargs)
+    # Tests claim and run jobs themselves instead of racing the worker threads
+    queue.start = lambda: None
+    return queue, calls
+
+
+def abandon(queue, job_id, attempts):
+    """Make job_id look like it was running in a worker that died"""
+    queue._update(job_id, status='running', claim_token='dead', lease_expires=time.time() - 1, attempts=attempts)
+
+
+def test_claim_runs_queued_jobs_in_order(tmp_path):
+    queue, calls = make_queue(tmp_path)
+    first = queue.submit('a.pdf', 'u1', 'm1')['job_id']
+    second = queue.submit('b.pdf', 'u1', 'm2')['job_id']
+    queue._run(queue._claim())
+    queue._run(queue._claim())
+    assert calls == [('a.pdf', False), ('b.pdf', False)]
+    job = queue.get(first)
+    assert job['status'] == 'completed' and job['chunks_stored'] == 2 and 'claim_token' not in job
+    assert queue.get(second)['status'] == 'completed'
+    assert queue._claim() is None
+
+
+def test_expired_lease_is_requeued_and_resumed(tmp_path):
+    queue, calls = make_queue(tmp_path, max_attempts=3)
+    job_id = queue.submit('a.pdf', 'u1', 'm1')['job_id']
+    abandon(queue, job_id, attempts=1)
+    job = queue._claim()
+    assert job['id'] == job_id and job['attempts'] == 2
+    queue._run(job)
+    assert calls == [('a.pdf', True)]
+    assert queue.get(job_id)['status'] == 'completed'
+
+
+def test_job_that_keeps_losing_its_worker_fails_at_max_attempts(tmp_path):
+    queue, calls = make_queue(tmp_path, max_attempts=3)
+    job_id = queue.submit('poison.pdf', 'u1', 'm1')['job_id']
+    abandon(queue, job_id, attempts=3)
+    assert queue._claim() is None
+    job = queue.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == 'Worker lost during ingest after 3 attempts'
+    assert calls == []
+
+
+def test_stale_claim_cannot_overwrite_a_newer_one(tmp_path):
+    queue, _ = make_queue(tmp_path)
+    job_id = queue.submit('a.pdf', 'u1', 'm1')['job_id']
+    job = queue._claim()
+    queue._update(job_id, 'someone-else', status='failed')
+    assert queue.get(job_id)['status'] == 'running'
+    queue._update(job_id, job['claim_token'], status='completed')
+    assert queue.get(job_id)['status'] == 'completed'
+
+
+def test_submit_rejects_jobs_beyond_max_depth(tmp_path):
+    queue, _ = make_queue(tmp_path, max_depth=1)
+    queue.submit('a.pdf', 'u1', 'm1')
+    with pytest.raises(QueueFullError):
+        queue.submit('b.pdf', 'u1', 'm1')
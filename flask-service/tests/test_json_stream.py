@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from services.json_stream import JSONArrayStream, parse_json_array
+
+QUESTIONS = [
+    {
+        'question': 'What does "photosynthesis" produce? {not a brace} [nor a bracket]',
+        'options': {'A': 'Glucose', 'B': 'Back\\slash', 'C': 'Tab\there', 'D': 'Quote \" inside'},
+        'correct_answer': 'A',
+        'tags': [['nested', ['deeper']], []]
+    },
+    {'question': 'Second', 'options': {'A': '}', 'B': ']'}, 'correct_answer': 'B', 'meta': {'depth': {'x': [1, 2]}}},
+    {'question': 'Unicode é中 \\u escape', 'options': {}, 'correct_answer': None}
+]
+
+
+def feed_chunks(text, size):
+    parser = JSONArrayStream()
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return items + parser.close(), parser
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 16, 1000])
+def test_items_survive_any_chunk_boundary(size):
+    text = '```json\n' + json.dumps(QUESTIONS, indent=2) + '\n```'
+    items, parser = feed_chunks(text, size)
+    assert items == QUESTIONS
+    assert parser.finished
+    assert parser.skipped == 0
+
+
+def test_boundary_inside_every_escape_sequence():
+    text = json.dumps([{'text': 'a\\"b\\\\c"d\nend'}])
+    for split in range(1, len(text)):
+        parser = JSONArrayStream()
+        items = parser.feed(text[:split]) + parser.feed(text[split:]) + parser.close()
+        assert items == [{'text': 'a\\"b\\\\c"d\nend'}], split
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    parser = JSONArrayStream()
+    assert parser.feed('[{"a": 1}, {"b": [1, {"c": 2}') == [{'a': 1}]
+    assert parser.feed(']}') == [{'b': [1, {'c': 2}]}]
+    assert parser.feed(']') == []
+    assert parser.finished
+
+
+def test_bracket_pair_in_preamble_is_not_the_array():
+    items, _ = feed_chunks('Here are [3 questions]:\n[{"q": 1}, {"q": 2}]', 4)
+    assert items == [{'q': 1}, {'q': 2}]
+
+
+def test_text_after_the_array_is_ignored():
+    items, _ = feed_chunks('[{"q": 1}] and then [{"q": 2}]', 5)
+    assert items == [{'q': 1}]
+
+
+def test_trailing_comma_is_repaired():
+    items, parser = feed_chunks('[{"q": 1, "options": ["a", "b",],}, ]', 3)
+    assert items == [{'q': 1, 'options': ['a', 'b']}]
+    assert parser.skipped == 0
+
+
+def test_malformed_item_is_skipped_and_the_rest_kept():
+    items, parser = feed_chunks('[{"q": 1}, {"q": oops}, {"q": 3}]', 2)
+    assert items == [{'q': 1}, {'q': 3}]
+    assert parser.skipped == 1
+
+
+@pytest.mark.parametrize('tail, expected', [
+    ('{"q": 3, "options": ["a", "b"', {'q': 3, 'options': ['a', 'b']}),
+    ('{"q": "cut off mid-str', {'q': 'cut off mid-str'}),
+    ('{"q": {"nested": [1, 2', {'q': {'nested': [1, 2]}}),
+])
+def test_close_salvages_a_truncated_tail(tail, expected):
+    items, parser = feed_chunks('[{"q": 1}, ' + tail, 3)
+    assert items == [{'q': 1}, expected]
+    assert not parser.finished
+
+
+@pytest.mark.parametrize('tail', ['{"q": ', '{"q": 1, "r"', '{"q": tru'])
+def test_unsalvageable_tail_is_dropped(tail):
+    items, parser = feed_chunks('[{"q": 1}, ' + tail, 3)
+    assert items == [{'q': 1}]
+    assert parser.skipped == 1
+
+
+def test_close_without_an_open_item_returns_nothing():
+    parser = JSONArrayStream()
+    parser.feed('[{"q": 1}')
+    assert parser.close() == []
+
+
+def test_parse_json_array_raises_when_nothing_is_recovered():
+    with pytest.raises(ValueError, match='No JSON objects'):
+        parse_json_array('I could not generate questions.')
+    with pytest.raises(ValueError, match='malformed'):
+        parse_json_array('[{"q": oops}]')
+    assert parse_json_array('[{"q": 1}, {"q": 2}') == [{'q': 1}, {'q': 2}]
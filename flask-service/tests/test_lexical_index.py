@@ -0,0 +1,107 @@
+from services.lexical_index import BM25UserIndex, LexicalIndex, term_frequencies, tokenize
+
+CHUNKS = {
+    'c1': ('m1', 'The Krebs cycle oxidises acetyl CoA in the mitochondria'),
+    'c2': ('m1', 'Glycolysis splits glucose into two pyruvate molecules in the cytoplasm'),
+    'c3': ('m2', 'Equation E2 relates energy and mass; the Krebs cycle is unrelated'),
+    'c4': ('m2', 'Photosynthesis stores light energy as glucose in chloroplasts'),
+}
+
+
+def build_index(chunks=CHUNKS):
+    index = BM25UserIndex()
+    ids = list(chunks)
+    index.add(ids, [chunks[i][0] for i in ids], [term_frequencies(chunks[i][1]) for i in ids])
+    return index
+
+
+def test_tokenize_drops_stopwords_and_keeps_digits():
+    assert tokenize('What is the Krebs cycle, explain E2?') == ['krebs', 'cycle', 'e2']
+    assert term_frequencies('cycle Cycle CYCLE of life') == {'cycle': 3, 'life': 1}
+
+
+def test_search_ranks_chunks_with_more_query_terms_first():
+    hits, confidence = build_index().search(tokenize('Krebs cycle mitochondria'))
+    assert [chunk_id for chunk_id, _ in hits] == ['c1', 'c3']
+    assert hits[0][1] > hits[1][1] > 0
+    assert 0 < confidence <= 1
+
+
+def test_search_rare_term_outweighs_common_terms():
+    hits, _ = build_index().search(tokenize('glucose pyruvate'))
+    assert hits[0][0] == 'c2'
+
+
+def test_search_respects_material_filter_and_top_k():
+    index = build_index()
+    hits, _ = index.search(tokenize('Krebs cycle'), material_id='m2')
+    assert [chunk_id for chunk_id, _ in hits] == ['c3']
+    hits, _ = index.search(tokenize('glucose energy'), top_k=1)
+    assert len(hits) == 1
+
+
+def test_search_without_matches_has_zero_confidence():
+    index = build_index()
+    assert index.search(tokenize('quantum chromodynamics')) == ([], 0.0)
+    assert index.search([]) == ([], 0.0)
+    assert BM25UserIndex().search(['krebs']) == ([], 0.0)
+
+
+def test_confidence_drops_when_best_chunk_misses_query_terms():
+    index = build_index()
+    _, full = index.search(tokenize('Krebs cycle mitochondria'))
+    _, partial = index.search(tokenize('Krebs cycle ribosome'))
+    assert partial < full
+
+
+def test_added_chunks_are_searchable():
+    index = build_index()
+    index.search(tokenize('ribosome'))
+    index.add(['c5'], ['m3'], [term_frequencies('Ribosomes translate mRNA; the ribosome reads codons')])
+    hits, _ = index.search(tokenize('ribosome'))
+    assert [chunk_id for chunk_id, _ in hits] == ['c5']
+    assert index.size == 5
+
+
+def make_lexical(max_users=2, ttl_seconds=600):
+    loads = []
+
+    def load_terms(user_id):
+        loads.append(user_id)
+        ids = list(CHUNKS)
+        return ids, [CHUNKS[i][0] for i in ids], [term_frequencies(CHUNKS[i][1]) for i in ids]
+
+    return LexicalIndex(load_terms, max_users=max_users, ttl_seconds=ttl_seconds), loads
+
+
+def test_lexical_index_loads_each_user_once_and_scopes_materials():
+    lexical, loads = make_lexical()
+    hits, _ = lexical.search('Krebs cycle', 'u1', material_id='m1')
+    assert [chunk_id for chunk_id, _ in hits] == ['c1']
+    hits, _ = lexical.search('Krebs cycle', 'u1', material_id='m1', use_all_materials=True)
+    assert {chunk_id for chunk_id, _ in hits} == {'c1', 'c3'}
+    assert loads == ['u1']
+
+
+def test_lexical_index_evicts_least_recently_used_user():
+    lexical, loads = make_lexical(max_users=2)
+    for user_id in ['u1', 'u2', 'u1', 'u3', 'u1', 'u2']:
+        lexical.search('glucose', user_id)
+    assert loads == ['u1', 'u2', 'u3', 'u2']
+
+
+def test_lexical_index_rebuilds_expired_indexes():
+    lexical, loads = make_lexical(ttl_seconds=0)
+    lexical.search('glucose', 'u1')
+    lexical.search('glucose', 'u1')
+    assert loads == ['u1', 'u1']
+
+
+def test_lexical_index_add_extends_loaded_index_only():
+    lexical, loads = make_lexical()
+    lexical.add('u1', 'm3', ['c5'], [term_frequencies('ribosome')])
+    lexical.search('glucose', 'u1')
+    lexical.add('u1', 'm3', ['c5'], [term_frequencies('ribosome')])
+    hits, _ = lexical.search('ribosome', 'u1')
+    assert [chunk_id for chunk_id, _ in hits] == ['c5']
+    assert loads == ['u1']
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.llm_client import (RateLimitedChatModel, RateLimitedEmbeddings, RequestLimiter, RetryPolicy,
+                                 Singleflight)
+
+
+class Message:
+    def __init__(self, content, type='human'):
+        self.content = content
+        self.type = type
+
+
+def status_error(status, headers=None):
+    error = Exception(f"HTTP {status}")
+    error.status_code = status
+    error.response = type('Response', (), {'status_code': status, 'headers': headers or {}})()
+    return error
+
+
+class FakeChat:
+    """Chat model that answers after a delay, fails the first `failures` calls and records concurrency"""
+    def __init__(self, delay=0.05, failures=0, status=429):
+        self.delay = delay
+        self.failures = failures
+        self.status = status
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            fail = self.failures > 0
+            self.failures -= fail
+        return fail
+
+    def _finish(self):
+        with self.lock:
+            self.active -= 1
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, messages, **kwargs):
+        fail = self._start()
+        try:
+            time.sleep(self.delay)
+            if fail:
+                raise status_error(self.status, {'retry-after-ms': '20'})
+            return Message('answer ' + messages[-1].content, 'ai')
+        finally:
+            self._finish()
+
+    async def ainvoke(self, messages, **kwargs):
+        fail = self._start()
+        try:
+            await asyncio.sleep(self.delay)
+            if fail:
+                raise status_error(self.status, {'retry-after-ms': '20'})
+            return Message('answer ' + messages[-1].content, 'ai')
+        finally:
+            self._finish()
+
+
+def chat(llm, max_concurrency=0, tokens_per_minute=0):
+    return RateLimitedChatModel(
+        llm, limiter=RequestLimiter(max_concurrency, tokens_per_minute),
+        retry=RetryPolicy(3, 0.01, 0.05), singleflight=Singleflight(), coalesce=True
+    )
+
+
+def run_threads(target, count):
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(target(i))) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrency_is_capped():
+    llm = FakeChat()
+    model = chat(llm, max_concurrency=3)
+    run_threads(lambda i: model.invoke([Message(f'question {i}')]), 12)
+    assert llm.calls == 12
+    assert llm.peak <= 3
+    assert model.limiter.stats()['in_flight'] == 0
+
+
+def test_identical_calls_in_flight_are_coalesced():
+    llm = FakeChat()
+    model = chat(llm)
+    results = run_threads(lambda i: model.invoke([Message('same')]).content, 8)
+    assert llm.calls == 1
+    assert results == ['answer same'] * 8
+
+
+def test_bound_parameters_are_part_of_the_key():
+    model = chat(FakeChat())
+    bound = model.bind(temperature=0.8)
+    assert bound.limiter is model.limiter and bound.singleflight is model.singleflight
+    assert bound._call_key([Message('x')], {}) != model._call_key([Message('x')], {})
+
+
+def test_rate_limited_calls_are_retried():
+    llm = FakeChat(delay=0, failures=2)
+    assert chat(llm).invoke([Message('retry')]).content == 'answer retry'
+    assert llm.calls == 3
+
+
+def test_client_errors_are_not_retried():
+    llm = FakeChat(delay=0, failures=1, status=400)
+    with pytest.raises(Exception, match='HTTP 400'):
+        chat(llm).invoke([Message('bad')])
+    assert llm.calls == 1
+
+
+def test_tokens_per_minute_budget_delays_calls():
+    limiter = RequestLimiter(0, 600)  # 10 tokens per second
+    limiter.acquire(600)
+    started = time.monotonic()
+    limiter.acquire(2)
+    assert time.monotonic() - started >= 0.15
+
+
+def test_async_identical_calls_are_coalesced():
+    llm = FakeChat()
+    model = chat(llm)
+
+    async def main():
+        return await asyncio.gather(*[model.ainvoke([Message('same')]) for _ in range(5)])
+
+    results = asyncio.run(main())
+    assert llm.calls == 1
+    assert {message.content for message in results} == {'answer same'}
+
+
+def test_cancelled_follower_does_not_fail_the_shared_call():
+    llm = FakeChat(delay=0.1)
+    model = chat(llm)
+
+    async def main():
+        leader = asyncio.ensure_future(model.ainvoke([Message('same')]))
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.ensure_future(model.ainvoke([Message('same')]))
+        follower = asyncio.ensure_future(model.ainvoke([Message('same')]))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        return await asyncio.gather(leader, cancelled, follower, return_exceptions=True)
+
+    leader, cancelled, follower = asyncio.run(main())
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert leader.content == follower.content == 'answer same'
+    assert llm.calls == 1
+
+
+def test_cancelled_leader_hands_the_call_to_a_follower():
+    llm = FakeChat(delay=0.1)
+    model = chat(llm)
+
+    async def main():
+        leader = asyncio.ensure_future(model.ainvoke([Message('same')]))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(model.ainvoke([Message('same')]))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader, follower = asyncio.run(main())
+    assert isinstance(leader, asyncio.CancelledError)
+    assert follower.content == 'answer same'
+    assert llm.calls == 2
+
+
+def test_finish_ignores_a_future_that_is_already_done():
+    singleflight = Singleflight()
+    future, leader = singleflight.join('key')
+    assert leader
+    future.cancel()
+    singleflight.finish('key', future, 'result')
+    assert singleflight.join('key')[1]
+
+
+def test_embedding_queries_are_coalesced():
+    class FakeEmbeddings:
+        calls = 0
+
+        def embed_query(self, text):
+            FakeEmbeddings.calls += 1
+            time.sleep(0.05)
+            return [float(len(text))]
+
+    embeddings = RateLimitedEmbeddings(
+        FakeEmbeddings(), limiter=RequestLimiter(0, 0), retry=RetryPolicy(0), singleflight=Singleflight(), coalesce=True
+    )
+    results = run_threads(lambda i: embeddings.embed_query('query'), 4)
+    assert results == [[5.0]] * 4
+    assert FakeEmbeddings.calls == 1
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('langchain_core')
+
+from services.pdf_extract import _document_info
+
+
+class Reader:
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    @property
+    def metadata(self):
+        if isinstance(self._metadata, Exception):
+            raise self._metadata
+        return self._metadata
+
+
+def test_document_info_matches_pypdfloader_keys():
+    info = _document_info(Reader({
+        '/Author': 'Ada', '/Title': 'Biology', '/CreationDate': "D:20240131120000+01'00'", '/ModDate': 'unknown'
+    }))
+    assert info == {
+        'producer': 'PyPDF', 'creator': 'PyPDF', 'author': 'Ada', 'title': 'Biology',
+        'creationdate': '2024-01-31T12:00:00+01:00', 'moddate': 'unknown'
+    }
+
+
+def test_document_info_defaults_without_metadata():
+    defaults = {'producer': 'PyPDF', 'creator': 'PyPDF', 'creationdate': ''}
+    assert _document_info(Reader(None)) == defaults
+    assert _document_info(Reader(ValueError('broken info dictionary'))) == defaults
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip('langchain_core')
+pytest.importorskip('langchain_openai')
+
+from services.feedback_cache import FeedbackCache
+from services.quiz_generator import QuizGenerator
+
+
+class Reply:
+    def __init__(self, content):
+        self.content = content
+        self.usage_metadata = None
+
+
+class InstantLLM:
+    """Answers (or fails) immediately, like an auth error or a 429 with no retries left"""
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return Reply('Keep going')
+
+
+class InlineExecutor:
+    """Runs submitted work on the calling thread, so the future is done before submit returns"""
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def make_generator(llm, inline=True):
+    generator = QuizGenerator(doc_processor=object(), llm=llm, feedback_cache=FeedbackCache())
+    if inline:
+        generator._feedback_executor = InlineExecutor()
+    return generator
+
+
+def run_with_timeout(fn, timeout=5):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "call deadlocked"
+    return results[0]
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_feedback_that_finishes_immediately_does_not_deadlock(mode):
+    generator = make_generator(InstantLLM())
+    result = run_with_timeout(lambda: generator.evaluate_answers(['A', 'B'], ['A', 'C'], 'Biology', mode))
+    assert result['score'] == 50.0
+    feedback = run_with_timeout(lambda: generator.get_feedback(result['feedback_id']))
+    assert feedback['status'] == 'ready' and feedback['feedback'] == 'Keep going'
+    assert generator._feedback_pending == {}
+
+
+def test_feedback_that_fails_immediately_does_not_deadlock():
+    generator = make_generator(InstantLLM(RuntimeError('401 Unauthorized')))
+    result = run_with_timeout(lambda: generator.evaluate_answers(['A'], ['A'], 'Biology', 'sync'))
+    assert result['feedback_status'] == 'error' and '401' in result['feedback_error']
+    # The lock was released: later evaluations still run
+    result = run_with_timeout(lambda: generator.evaluate_answers(['A'], ['B'], 'Biology', 'sync'))
+    assert result['score'] == 0.0
+
+
+def test_default_mode_returns_without_waiting_and_shares_feedback_per_band(monkeypatch):
+    monkeypatch.delenv('EVALUATION_FEEDBACK_MODE', raising=False)
+    llm = InstantLLM()
+    generator = make_generator(llm, inline=False)
+    first, second = run_with_timeout(lambda: generator.evaluate_batch([
+        {'answers': ['A', 'B'], 'correct_answers': ['A', 'B'], 'topic': 'Biology'},
+        {'answers': ['A', 'B'], 'correct_answers': ['A', 'B'], 'topic': 'biology '}
+    ]))
+    assert generator.feedback_mode == 'async'
+    assert first['feedback_id'] == second['feedback_id']
+    generator._feedback_executor.shutdown(wait=True)
+    assert llm.calls == 1
+    assert generator.get_feedback(first['feedback_id'])['status'] == 'ready'
@@ -0,0 +1,66 @@
+import numpy as np
+
+from services.vector_cache import VectorCache, VectorCacheEntry, top_k_scores
+
+
+def vectors(count, dim=4):
+    return np.arange(count * dim, dtype=np.float32).reshape(count, dim) + 1
+
+
+def test_get_or_load_caches_until_invalidated():
+    cache = VectorCache(max_bytes=1 << 20, max_entries=10, ttl_seconds=600)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return ['a', 'b'], vectors(2)
+
+    key = VectorCache.make_key('u1', 'm1')
+    cache.get_or_load(key, loader)
+    cache.get_or_load(key, loader)
+    assert len(loads) == 1
+    cache.invalidate('u1', 'm1')
+    cache.get_or_load(key, loader)
+    assert len(loads) == 2
+
+
+def test_load_that_overlaps_an_invalidate_is_not_cached():
+    cache = VectorCache(max_bytes=1 << 20, max_entries=10, ttl_seconds=600)
+    key = VectorCache.make_key('u1')
+
+    def stale_loader():
+        # An ingest for the user finishes while this load is reading the old chunks
+        cache.invalidate('u1', 'm1')
+        return ['old'], vectors(1)
+
+    entry = cache.get_or_load(key, stale_loader)
+    assert list(entry.ids) == ['old']
+    assert cache.get(key) is None
+    entry = cache.get_or_load(key, lambda: (['old', 'new'], vectors(2)))
+    assert cache.get(key) is entry
+
+
+def test_invalidate_with_material_keeps_other_materials():
+    cache = VectorCache(max_bytes=1 << 20, max_entries=10, ttl_seconds=600)
+    for scope in ['m1', 'm2', None]:
+        cache.put(VectorCache.make_key('u1', scope), VectorCacheEntry(['a'], vectors(1)))
+    cache.invalidate('u1', 'm1')
+    assert cache.get(VectorCache.make_key('u1', 'm2')) is not None
+    assert cache.get(VectorCache.make_key('u1', 'm1')) is None
+    assert cache.get(VectorCache.make_key('u1')) is None
+
+
+def test_entries_are_evicted_to_stay_within_budget():
+    entry_bytes = VectorCacheEntry(['a', 'b'], vectors(2)).nbytes
+    cache = VectorCache(max_bytes=entry_bytes * 2, max_entries=10, ttl_seconds=600)
+    for user_id in ['u1', 'u2', 'u3']:
+        cache.put(VectorCache.make_key(user_id), VectorCacheEntry(['a', 'b'], vectors(2)))
+    assert cache.get(VectorCache.make_key('u1')) is None
+    assert cache.stats()['entries'] == 2
+
+
+def test_top_k_scores_orders_best_first():
+    matrix = np.array([[1, 0], [0, 1], [0.6, 0.8]], dtype=np.float32)
+    rows, scores = top_k_scores(matrix, np.array([0, 1], dtype=np.float32), 2)
+    assert rows.tolist() == [1, 2]
+    assert scores[0] >= scores[1]
@@ -1,5 +1,5 @@
-import React, { useState } from 'react';
-import { generateQuiz, submitQuiz } from '../services/api';
+import React, { useEffect, useState } from 'react';
+import { generateQuiz, getQuizFeedback, submitQuiz } from '../services/api';
 
 function Quiz({ userId, materialId, useAllMaterials, onQuizComplete }) {
   const [stage, setStage] = useState('setup'); // 'setup', 'taking', 'results'
@@ -41,6 +41,38 @@ function Quiz({ userId, materialId, useAllMaterials, onQuizComplete }) {
     }
   };
 
+  // Feedback not cached yet is generated in the background; poll until it is ready
+  useEffect(() => {
+    const feedback = results && results.feedback;
+    if (!feedback || feedback.feedback_status !== 'pending' || !feedback.feedback_id) {
+      return undefined;
+    }
+    let cancelled = false;
+    const timer = setInterval(async () => {
+      try {
+        const update = await getQuizFeedback(feedback.feedback_id);
+        if (cancelled || update.status === 'pending') {
+          return;
+        }
+        clearInterval(timer);
+        setResults(prev => ({
+          ...prev,
+          feedback: {
+            ...prev.feedback,
+            feedback: update.feedback,
+            feedback_status: update.status === 'ready' ? 'ready' : 'error'
+          }
+        }));
+      } catch (error) {
+        clearInterval(timer);
+      }
+    }, 2000);
+    return () => {
+      cancelled = true;
+      clearInterval(timer);
+    };
+  }, [results]);
+
   const handleAnswerSelect = (questionIndex, answer) => {
     setAnswers(prev => ({
       ...prev,
@@ -218,7 +250,9 @@ function Quiz({ userId, materialId, useAllMaterials, onQuizComplete }) {
         <div className="feedback-section">
           <h3>Feedback</h3>
           <div className="feedback-content">
-            {results.feedback.feedback}
+            {results.feedback.feedback_status === 'pending'
+              ? 'Preparing feedback...'
+              : results.feedback.feedback}
           </div>
         </div>
 
@@ -124,6 +124,12 @@ export const submitQuiz = async (quizId, answers) => {
   return response.json();
 };
 
+// Get quiz feedback that was still pending when the quiz was submitted
+export const getQuizFeedback = async (feedbackId) => {
+  const response = await fetch(`${API_BASE}/tutor/feedback/${encodeURIComponent(feedbackId)}`);
+  return response.json();
+};
+
 // Generate Flashcards
 export const generateFlashcards = async (topic, userId, materialId, numCards, useAllMaterials) => {
   const response = await fetch(`${API_BASE}/tutor/generate-flashcards`, {